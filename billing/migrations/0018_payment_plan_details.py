@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0017_payment_mpgs_order_amount_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='plan_details',
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
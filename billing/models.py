@@ -34,10 +34,36 @@ class Payment(models.Model):
         max_digits=10, decimal_places=2, default=None, blank=True, null=True
     )
     mpgs_order_currency = models.CharField(max_length=10, default=None, blank=True, null=True)
+    plan_details = models.JSONField(default=None, blank=True, null=True)  # Plan as resolved at creation; provisioning orders from it
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     date_created = models.DateTimeField(default=now)
     expiry_datetime = models.DateTimeField(default=None, blank=True, null=True)
     date_paid = models.DateTimeField(default=None, blank=True, null=True)
 
+    # Status as last loaded from or written to the database (None for unsaved payments).
+    _saved_status = None
+    # (previous, new) status while a save that changed the status is being processed, else None.
+    status_transition = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_status = instance.__dict__.get("status")
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        writes_status = update_fields is None or "status" in update_fields
+        if writes_status and self.status != self._saved_status:
+            self.status_transition = (self._saved_status, self.status)
+        else:
+            self.status_transition = None
+        try:
+            super().save(*args, **kwargs)
+            if writes_status:
+                self._saved_status = self.status
+        finally:
+            self.status_transition = None
+
     def __str__(self):
         return f"Payment by {self.user.email} - {self.status}"
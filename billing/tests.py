@@ -1,13 +1,23 @@
-from django.test import TestCase
-from unittest.mock import patch, MagicMock
+import json
+from django.contrib.auth import get_user_model
+from django.test import AsyncRequestFactory, TestCase
+from unittest.mock import AsyncMock, patch, MagicMock
 from decimal import Decimal
-from billing.utils import initiate_mastercard_checkout, convert_currency, FXConversionError
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from billing.models import Payment
+from billing.utils import (
+    CoinPayments, initiate_mastercard_checkout, convert_currency, FXConversionError, get_mastercard_payment_status,
+)
+from billing.views import PaymentStatusCheckAsyncView, PaymentStatusCheckView
+from magic_esim.vendor_stubs import VendorStubs
 
 
 class MastercardCheckoutCurrencyTests(TestCase):
     """Test that Mastercard Hosted Checkout handles USD, SAR, and other currencies correctly."""
 
-    @patch('billing.utils.requests.post')
+    @patch('billing.utils.mpgs_http.post')
     def test_usd_payment_no_conversion(self, mock_post):
         """Test that USD payments are sent directly without conversion to SAR."""
         # Mock successful Mastercard API response
@@ -39,7 +49,7 @@ class MastercardCheckoutCurrencyTests(TestCase):
         self.assertEqual(payload["order"]["currency"], "USD")
         self.assertEqual(payload["order"]["amount"], "10.00")
 
-    @patch('billing.utils.requests.post')
+    @patch('billing.utils.mpgs_http.post')
     def test_sar_payment_no_conversion(self, mock_post):
         """Test that SAR payments are sent directly without conversion."""
         # Mock successful Mastercard API response
@@ -72,7 +82,7 @@ class MastercardCheckoutCurrencyTests(TestCase):
         self.assertEqual(payload["order"]["amount"], "37.50")
 
     @patch('billing.utils.convert_currency')
-    @patch('billing.utils.requests.post')
+    @patch('billing.utils.mpgs_http.post')
     def test_other_currency_converts_to_sar(self, mock_post, mock_convert):
         """Test that non-USD/SAR currencies are converted to SAR."""
         # Mock currency conversion
@@ -112,7 +122,7 @@ class MastercardCheckoutCurrencyTests(TestCase):
 
     def test_usd_payment_with_lowercase_currency(self):
         """Test that USD in lowercase is properly handled."""
-        with patch('billing.utils.requests.post') as mock_post:
+        with patch('billing.utils.mpgs_http.post') as mock_post:
             mock_response = MagicMock()
             mock_response.status_code = 200
             mock_response.json.return_value = {
@@ -138,7 +148,7 @@ class MastercardCheckoutCurrencyTests(TestCase):
 
     def test_default_currency_is_usd(self):
         """Test that when no currency is provided, USD is used as default."""
-        with patch('billing.utils.requests.post') as mock_post:
+        with patch('billing.utils.mpgs_http.post') as mock_post:
             mock_response = MagicMock()
             mock_response.status_code = 200
             mock_response.json.return_value = {
@@ -191,3 +201,119 @@ class CurrencyConversionTests(TestCase):
             convert_currency(Decimal("10.00"), "EUR", "GBP")
         self.assertIn("Unsupported currency conversion", str(context.exception))
 
+
+
+class CoinPaymentsRequestTests(TestCase):
+    """Test the CoinPayments API client over the pooled vendor client."""
+
+    def setUp(self):
+        self.cp = CoinPayments(publicKey="pub", privateKey="priv", ipn_url="https://example.com/ipn")
+
+    @patch('billing.utils.coinpayments_http.request')
+    def test_signed_form_post_and_flattened_result(self, mock_request):
+        """Test that the signed form body is posted and the result merged into the response."""
+        mock_request.return_value.json.return_value = {"error": "ok", "result": {"status_text": "Complete"}}
+
+        response = self.cp.getTransactionInfo({"pmtid": "CP123"})
+
+        self.assertEqual(response, {"error": "ok", "status_text": "Complete"})
+        method, url = mock_request.call_args.args
+        kwargs = mock_request.call_args.kwargs
+        self.assertEqual((method, url), ("post", "https://www.coinpayments.net/api.php"))
+        encoded, sig = self.cp.createHmac(pmtid="CP123", cmd="get_tx_info", key="pub", version=1, format="json")
+        self.assertEqual(kwargs["data"], encoded)
+        self.assertEqual(kwargs["headers"]["hmac"], sig)
+        self.assertTrue(kwargs["idempotent"])  # A read, so it may be retried
+
+    @patch('billing.utils.coinpayments_http.request')
+    def test_transport_errors_are_reported_as_failed_calls(self, mock_request):
+        """Test that a failed transaction creation is not retried and reads as an error."""
+        mock_request.side_effect = requests.ConnectionError("down")
+
+        response = self.cp.createTransaction({"amount": 10, "currency1": "USD", "currency2": "BTC"})
+
+        self.assertEqual(response, {"error": "down"})
+        self.assertFalse(mock_request.call_args.kwargs["idempotent"])
+
+
+class VendorStubPaymentTests(TestCase):
+    """Test the payment gateway clients end to end against the local vendor stubs."""
+
+    def setUp(self):
+        self.stubs = VendorStubs().start()
+        self.addCleanup(self.stubs.stop)
+
+    def test_mastercard_checkout_then_order_status(self):
+        """Test that the stubbed order carries the amount and currency of its checkout session."""
+        checkout = initiate_mastercard_checkout(
+            amount=25, currency="USD", customer_email="buyer@example.com", reference_id="REF-STUB",
+        )
+        self.stubs.mpgs.order_status = "AUTHORIZED"
+
+        status = get_mastercard_payment_status("REF-STUB")
+
+        self.assertTrue(checkout["status"])
+        self.assertEqual((status["status"], status["amount"], status["currency"]), ("AUTHORIZED", 25.0, "USD"))
+        self.assertEqual(status["payment_method"], "CARD")
+        self.assertEqual(dict(self.stubs.mpgs.calls), {"session": 1, "order": 1})
+
+    def test_coinpayments_transaction_round_trip(self):
+        """Test that a created CoinPayments transaction can be looked up by its id."""
+        cp = CoinPayments(publicKey="pub", privateKey="priv", ipn_url="https://example.com/ipn")
+
+        created = cp.createTransaction({"amount": 10, "currency1": "USD", "currency2": "BTC"})
+        self.stubs.coinpayments.tx_status_text = "Complete"
+        info = cp.getTransactionInfo({"txid": created["txn_id"]})
+
+        self.assertEqual(created["error"], "ok")
+        self.assertEqual((info["status"], info["amountf"]), (100, created["amount"]))
+        self.assertEqual(cp.url, f"{self.stubs.coinpayments.url}/api.php")
+
+
+class PaymentStatusAsyncViewTests(TestCase):
+    """Test the async payment status view against the DRF one."""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = get_user_model().objects.create_user(
+            email="status@example.com", username="status", password="secret123"
+        )
+
+    def _payment(self, **fields):
+        return Payment.objects.create(
+            user=self.user, price=10, package_code="CKH001", payment_gateway="MastercardHostedCheckout", **fields
+        )
+
+    def _request(self, payment):
+        return self.factory.get(f"/api/billing/payments/status/{payment.ref_id}/")
+
+    async def test_mastercard_status_is_awaited_and_applied(self):
+        """Test that a pending Mastercard payment is refreshed through the async MPGS client."""
+        payment = await sync_to_async(self._payment)(status="PENDING")
+        order = httpx.Response(
+            200,
+            json={"status": "CAPTURED", "transactions": [{"id": "TX1", "paymentMethod": "CARD"}]},
+            request=httpx.Request("GET", "https://mpgs.example"),
+        )
+
+        with patch('billing.utils.mpgs_async.get', AsyncMock(return_value=order)) as mock_get:
+            response = await PaymentStatusCheckAsyncView.as_view()(self._request(payment), ref_id=str(payment.ref_id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_get.call_args.kwargs["endpoint"], "order")
+        data = json.loads(response.content)["data"]
+        self.assertEqual((data["status"], data["transaction_id"]), ("COMPLETED", "TX1"))
+        await payment.arefresh_from_db()
+        self.assertEqual(payment.status, "COMPLETED")
+
+    async def test_settled_payments_match_the_drf_view(self):
+        """Test that a payment that needs no refresh renders exactly as the DRF view renders it."""
+        payment = await sync_to_async(self._payment)(status="FAILED")
+        await Payment.objects.filter(pk=payment.pk).aupdate(date_created=payment.date_created.replace(year=2020))
+
+        response = await PaymentStatusCheckAsyncView.as_view()(self._request(payment), ref_id=str(payment.ref_id))
+        expected = await sync_to_async(PaymentStatusCheckView.as_view())(self._request(payment), ref_id=str(payment.ref_id))
+
+        expected.render()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
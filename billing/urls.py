@@ -1,14 +1,16 @@
 from django.urls import path
+from magic_esim.async_views import routed_view
 from .views import (
     MastercardCheckoutCallbackView,
     PaymentListCreateView,
+    PaymentStatusCheckAsyncView,
     PaymentStatusCheckView,
     UpdatePendingPaymentsView,
 )
 
 urlpatterns = [
     path('payments/', PaymentListCreateView.as_view(), name='payment-list-create'),
-    path('payments/status/<str:ref_id>/', PaymentStatusCheckView.as_view(), name='payment-status-check'),
+    path('payments/status/<str:ref_id>/', routed_view(PaymentStatusCheckView, PaymentStatusCheckAsyncView), name='payment-status-check'),
     path("payments/update-pending/", UpdatePendingPaymentsView.as_view(), name="update_pending_payments"),
     path(
         "payments/mastercard/callback/",
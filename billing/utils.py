@@ -1,14 +1,17 @@
-import urllib.request, urllib.error, urllib.parse
+import urllib.parse
 import hmac
 import hashlib
 import json
 import logging
 from copy import deepcopy
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import httpx
 import requests
 from django.conf import settings
 from datetime import datetime, timedelta, timezone
 
+from magic_esim.vendors import coinpayments_http, mpgs_async, mpgs_http
+
 
 logger = logging.getLogger(__name__)
 
@@ -78,13 +81,16 @@ def convert_currency(amount, source_currency, target_currency):
 
 
 class CoinPayments():
+    # Commands that only read, so a failed call can safely be retried.
+    READ_COMMANDS = frozenset({'get_basic_info', 'get_tx_info', 'rates', 'balances'})
+
     def __init__(self, publicKey, privateKey, ipn_url):
         self.publicKey = publicKey
         self.privateKey = privateKey
         self.ipn_url = ipn_url
         self.format = 'json'
         self.version = 1
-        self.url = 'https://www.coinpayments.net/api.php'
+        self.url = getattr(settings, 'COINPAYMENTS_API_URL', 'https://www.coinpayments.net/api.php')
 
     def createHmac(self, **params):
         """ Generate an HMAC based upon the url arguments/parameters
@@ -105,26 +111,25 @@ class CoinPayments():
         encoded, sig = self.createHmac(**params)
 
         headers = {'hmac': sig}
-
-        if request_method == 'get':
-            req = urllib.request.Request(self.url, headers=headers)
-        elif request_method == 'post':
+        data = None
+        if request_method == 'post':
             headers['Content-Type'] = 'application/x-www-form-urlencoded'
-            req = urllib.request.Request(self.url, data=encoded, headers=headers)
+            data = encoded
 
         try:
-            response      = urllib.request.urlopen(req)
-            status_code   = response.getcode()
-            response_body = response.read()
-
-            response_body_decoded = json.loads(response_body) #decode Json to dictionary
+            response = coinpayments_http.request(
+                request_method, self.url, data=data, headers=headers,
+                endpoint=params.get('cmd'), idempotent=params.get('cmd') in self.READ_COMMANDS,
+            )
+            response_body_decoded = response.json() #decode Json to dictionary
 
-            response_body_decoded.update(response_body_decoded['result']) #clean up dictionary, flatten "result" key:value pairs to parent dictionary
+            response_body_decoded.update(response_body_decoded.get('result') or {}) #clean up dictionary, flatten "result" key:value pairs to parent dictionary
             response_body_decoded.pop('result', None) #remove the flattened dictionary
-            
-        except urllib.error.HTTPError as e:
-            status_code   = e.getcode()
-            response_body = e.read()
+
+        except (requests.RequestException, ValueError) as e:
+            # Callers treat anything but error == 'ok' as a failed call.
+            logger.error("[CoinPayments] %s request failed: %s", params.get('cmd'), e)
+            response_body_decoded = {'error': str(e)}
 
         return response_body_decoded
 
@@ -424,7 +429,7 @@ def initiate_mastercard_checkout(
     data = None
 
     try:
-        response = requests.post(url, json=payload, auth=_mpgs_auth(), timeout=30)
+        response = mpgs_http.post(url, json=payload, auth=_mpgs_auth(), timeout=30, endpoint="session")
 
         try:
             data = response.json()
@@ -502,102 +507,128 @@ def get_mpgs_payment_status(order_id):
     return get_mastercard_payment_status(order_id)
 
 
+def _mastercard_order_url(order_id):
+    return (
+        f"{_mpgs_base_url()}/api/rest/version/{settings.MPGS_API_VERSION}/"
+        f"merchant/{settings.MPGS_MERCHANT_ID}/order/{order_id}"
+    )
+
+
+def _mastercard_status_result(order_id, response):
+    """Normalize a Retrieve Order response; raises the client's HTTP error for error statuses."""
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+
+    if data is None:
+        data = {}
+
+    pretty_payload = json.dumps(data, indent=2, sort_keys=True)
+    logger.info("[Mastercard Checkout] Order %s status payload: %s", order_id, pretty_payload)
+    print(f"[Mastercard Checkout] Order {order_id} status payload: {pretty_payload}")
+
+    response.raise_for_status()
+
+    order_data = data.get("order")
+    order_status = None
+    order_amount = None
+    order_currency = None
+
+    if isinstance(order_data, dict):
+        order_status = order_data.get("status")
+        order_amount = order_data.get("amount")
+        order_currency = order_data.get("currency")
+
+    transaction = None
+    transactions = data.get("transactions")
+    if isinstance(transactions, list) and transactions:
+        transaction = transactions[-1]
+
+    if transaction is None:
+        transaction_data = data.get("transaction")
+        if isinstance(transaction_data, list) and transaction_data:
+            transaction = transaction_data[-1]
+        elif isinstance(transaction_data, dict):
+            transaction = transaction_data
+
+    # If MPGS nests the order under transactions, use that status/amount/currency as a fallback.
+    if order_status is None or order_amount is None or order_currency is None:
+        for candidate in (transaction,):
+            if isinstance(candidate, dict):
+                tx_order = candidate.get("order")
+                if isinstance(tx_order, dict):
+                    order_status = order_status or tx_order.get("status")
+                    order_amount = order_amount or tx_order.get("amount")
+                    order_currency = order_currency or tx_order.get("currency")
+
+    # Finalise status with sensible fallbacks: prefer top-level status/result, then order status.
+    status = data.get("status") or data.get("result") or order_status or data.get("error", {}).get("cause")
+    amount = order_amount or data.get("amount")
+    currency = order_currency or data.get("currency")
+
+    payment_method = None
+    if isinstance(transaction, dict):
+        payment_method = transaction.get("paymentMethod") or transaction.get(
+            "sourceOfFunds", {}
+        ).get("type")
+
+    customer_email = None
+    if isinstance(order_data, dict):
+        customer_email = order_data.get("customerEmail")
+    if not customer_email:
+        customer_email = data.get("customer", {}).get("email")
+
+    result = {
+        "status": status,
+        "amount": amount,
+        "currency": currency,
+        "customer_email": customer_email,
+        "payment_method": payment_method,
+        "raw": data,
+    }
+
+    logger.info("[Mastercard Checkout] Normalized order status: %s", json.dumps(result, indent=2, sort_keys=True))
+    print(
+        f"[Mastercard Checkout] Normalized order status: {json.dumps(result, indent=2, sort_keys=True)}"
+    )
+
+    return result
+
+
 def get_mastercard_payment_status(order_id):
     """Fetch the status of a Mastercard order using the order identifier."""
 
     logger.info("[Mastercard Checkout] Fetching payment status for order_id=%s", order_id)
     print(f"[Mastercard Checkout] Fetching payment status for order_id={order_id}")
 
-    url = (
-        f"{_mpgs_base_url()}/api/rest/version/{settings.MPGS_API_VERSION}/"
-        f"merchant/{settings.MPGS_MERCHANT_ID}/order/{order_id}"
-    )
-
     response = None
-    data = None
 
     try:
-        response = requests.get(url, auth=_mpgs_auth(), timeout=30)
+        response = mpgs_http.get(_mastercard_order_url(order_id), auth=_mpgs_auth(), timeout=30, endpoint="order")
+        return _mastercard_status_result(order_id, response)
+    except requests.RequestException as exc:
+        if response is None:
+            logger.error("[Mastercard Checkout] Order status request failed: %s", exc)
+            print(f"[Mastercard Checkout] Order status request failed before response: {exc}")
 
-        try:
-            data = response.json()
-        except ValueError:
-            data = None
+        return {"status": "ERROR", "message": str(exc)}
 
-        if data is None:
-            data = {}
 
-        pretty_payload = json.dumps(data, indent=2, sort_keys=True)
-        logger.info("[Mastercard Checkout] Order %s status payload: %s", order_id, pretty_payload)
-        print(f"[Mastercard Checkout] Order {order_id} status payload: {pretty_payload}")
+async def aget_mastercard_payment_status(order_id):
+    """``get_mastercard_payment_status`` for async views."""
 
-        response.raise_for_status()
+    logger.info("[Mastercard Checkout] Fetching payment status for order_id=%s", order_id)
+    print(f"[Mastercard Checkout] Fetching payment status for order_id={order_id}")
 
-        order_data = data.get("order")
-        order_status = None
-        order_amount = None
-        order_currency = None
-
-        if isinstance(order_data, dict):
-            order_status = order_data.get("status")
-            order_amount = order_data.get("amount")
-            order_currency = order_data.get("currency")
-
-        transaction = None
-        transactions = data.get("transactions")
-        if isinstance(transactions, list) and transactions:
-            transaction = transactions[-1]
-
-        if transaction is None:
-            transaction_data = data.get("transaction")
-            if isinstance(transaction_data, list) and transaction_data:
-                transaction = transaction_data[-1]
-            elif isinstance(transaction_data, dict):
-                transaction = transaction_data
-
-        # If MPGS nests the order under transactions, use that status/amount/currency as a fallback.
-        if order_status is None or order_amount is None or order_currency is None:
-            for candidate in (transaction,):
-                if isinstance(candidate, dict):
-                    tx_order = candidate.get("order")
-                    if isinstance(tx_order, dict):
-                        order_status = order_status or tx_order.get("status")
-                        order_amount = order_amount or tx_order.get("amount")
-                        order_currency = order_currency or tx_order.get("currency")
-
-        # Finalise status with sensible fallbacks: prefer top-level status/result, then order status.
-        status = data.get("status") or data.get("result") or order_status or data.get("error", {}).get("cause")
-        amount = order_amount or data.get("amount")
-        currency = order_currency or data.get("currency")
-
-        payment_method = None
-        if isinstance(transaction, dict):
-            payment_method = transaction.get("paymentMethod") or transaction.get(
-                "sourceOfFunds", {}
-            ).get("type")
-
-        customer_email = None
-        if isinstance(order_data, dict):
-            customer_email = order_data.get("customerEmail")
-        if not customer_email:
-            customer_email = data.get("customer", {}).get("email")
-
-        result = {
-            "status": status,
-            "amount": amount,
-            "currency": currency,
-            "customer_email": customer_email,
-            "payment_method": payment_method,
-            "raw": data,
-        }
+    response = None
 
-        logger.info("[Mastercard Checkout] Normalized order status: %s", json.dumps(result, indent=2, sort_keys=True))
-        print(
-            f"[Mastercard Checkout] Normalized order status: {json.dumps(result, indent=2, sort_keys=True)}"
+    try:
+        response = await mpgs_async.get(
+            _mastercard_order_url(order_id), auth=_mpgs_auth(), timeout=30, endpoint="order"
         )
-
-        return result
-    except requests.RequestException as exc:
+        return _mastercard_status_result(order_id, response)
+    except httpx.HTTPError as exc:
         if response is None:
             logger.error("[Mastercard Checkout] Order status request failed: %s", exc)
             print(f"[Mastercard Checkout] Order status request failed before response: {exc}")
@@ -1,5 +1,7 @@
+from asgiref.sync import sync_to_async
 from rest_framework import generics, serializers, status
 from rest_framework.views import APIView
+from magic_esim.async_views import AsyncAPIView, api_response
 from magic_esim.permissions import IsAuthenticatedWithSessionOrJWT
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
@@ -11,7 +13,7 @@ from drf_spectacular.utils import (
     extend_schema_view,
 )
 from .models import Payment
-from esim.utils import fetch_esim_plan_details
+from esim.plans import plan_name, resolve_plan
 from .serializers import (
     MastercardCallbackResponseSerializer,
     PaymentCreateResponseSerializer,
@@ -21,6 +23,7 @@ from .serializers import (
 )
 from billing.utils import (
     CoinPayments,
+    aget_mastercard_payment_status,
     get_mastercard_payment_status,
     initiate_mastercard_checkout,
 )
@@ -34,6 +37,7 @@ from django.db.models import Q
 
 MPGS_SUCCESS_STATUSES = {"CAPTURED", "APPROVED", "SUCCESS", "SUCCESSFUL", "PAID", "SETTLED"}
 MPGS_PENDING_STATUSES = {"PENDING", "IN_PROGRESS", "INITIATED", "AUTHORIZED", "AUTHORISED", "AUTHORISED_PENDING_SETTLEMENT"}
+MASTERCARD_GATEWAYS = ('HyperPayMPGS', 'MastercardHostedCheckout')
 
 
 def _apply_mastercard_status(payment, status_response):
@@ -138,8 +142,20 @@ class PaymentListCreateView(generics.ListCreateAPIView):
         return Payment.objects.filter(user=self.request.user)
 
     def perform_create(self, serializer):
+        # Resolve the plan once (from the catalogue snapshot when possible) and
+        # freeze it on the payment; provisioning orders from these details.
+        package_code = serializer.validated_data.get("package_code")
+        seller = serializer.validated_data.get("seller")
+        plan_details = resolve_plan(package_code, seller) if package_code else None
+        esim_plan = plan_name(plan_details, seller) if plan_details else None
+
+        # Rejected before saving, so a missing plan leaves no payment behind.
+        gateway = serializer.validated_data.get("payment_gateway")
+        if gateway in ('CoinPayments', 'HyperPayMPGS', 'MastercardHostedCheckout') and not plan_details:
+            raise serializers.ValidationError({"status": False, "message": "The selected eSIM plan could not be found."})
+
         # Save the payment instance with user details
-        payment = serializer.save(user=self.request.user)
+        payment = serializer.save(user=self.request.user, plan_details=plan_details, esim_plan=esim_plan)
         serializer.instance = payment
 
         if payment.payment_gateway == 'CoinPayments':
@@ -158,12 +174,6 @@ class PaymentListCreateView(generics.ListCreateAPIView):
                 'custom': str(payment.ref_id),  # Reference for later tracking
                 'ipn_url': settings.COINPAYMENTS_IPN_URL,
             })
-            plan_details = fetch_esim_plan_details(payment.package_code, seller=payment.seller)
-            if payment.seller == 'esimgo':
-                # Fetch eSIM plan details
-                esim_plan = plan_details['description']
-            else:
-                esim_plan = plan_details['obj']['packageList'][0]['name']
 
             if response.get('error') == 'ok':
                 # Save transaction details if creation is successful
@@ -186,12 +196,6 @@ class PaymentListCreateView(generics.ListCreateAPIView):
                 raise serializers.ValidationError({"status": False, "message": response.get('error')})
         elif payment.payment_gateway in ('HyperPayMPGS', 'MastercardHostedCheckout'):
             payment.payment_gateway = 'MastercardHostedCheckout'
-            plan_details = fetch_esim_plan_details(payment.package_code, seller=payment.seller)
-            if payment.seller == 'esimgo':
-                # Fetch eSIM plan details
-                esim_plan = plan_details['description']
-            else:
-                esim_plan = plan_details['obj']['packageList'][0]['name']
 
             mpgs_response = initiate_mastercard_checkout(
                 amount=payment.price,
@@ -263,6 +267,56 @@ class PaymentListCreateView(generics.ListCreateAPIView):
         return Response(self.response_data, status=status.HTTP_201_CREATED)
 
 
+def _refreshable(payment):
+    """Always allow refresh for PENDING; allow FAILED only within 24h."""
+    refresh_cutoff = now() - datetime.timedelta(hours=24)
+    return payment.status == "PENDING" or (
+        payment.status == "FAILED" and payment.date_created >= refresh_cutoff
+    )
+
+
+def _refresh_coinpayments_status(payment):
+    """Update ``payment`` from CoinPayments; returns the gateway error, or None on success."""
+    cp = CoinPayments(
+        publicKey=settings.COINPAYMENTS_PUBLIC_KEY,
+        privateKey=settings.COINPAYMENTS_PRIVATE_KEY,
+        ipn_url=settings.COINPAYMENTS_IPN_URL
+    )
+
+    response = cp.getTransactionInfo({'pmtid': payment.gateway_transaction_id})
+    if response.get('error') != 'ok':
+        return response.get('error')
+
+    if response['status_text'] == 'Waiting for buyer funds...':
+        payment_status = 'PENDING'
+    elif response['status_text'] == 'Cancelled / Timed Out':
+        payment_status = 'FAILED'
+    else:
+        payment_status = 'COMPLETED'
+        payment.date_paid = now()
+
+    payment.status = payment_status
+    payment.save()
+    return None
+
+
+def _status_payload(payment, message):
+    return {
+        "status": True,
+        "message": message,
+        "data": {
+            "ref_id": payment.ref_id,
+            "status": payment.status,
+            "amount": payment.price,
+            "date_created": payment.date_created,
+            "expiry_datetime": payment.expiry_datetime,
+            "currency": payment.currency,
+            "payment_gateway": payment.payment_gateway,
+            "transaction_id": payment.gateway_transaction_id,
+        },
+    }
+
+
 class PaymentStatusCheckView(APIView):
     """
     Check the status of a payment.
@@ -300,88 +354,45 @@ class PaymentStatusCheckView(APIView):
         except Payment.DoesNotExist:
             return Response({"status": False, "message": "Payment not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        refresh_cutoff = now() - datetime.timedelta(hours=24)
-        # Always allow refresh for PENDING; allow FAILED only within 24h.
-        allow_refresh = payment.status == "PENDING" or (
-            payment.status == "FAILED" and payment.date_created >= refresh_cutoff
-        )
-
-        if payment.payment_gateway in ('HyperPayMPGS', 'MastercardHostedCheckout') and allow_refresh:
+        if payment.payment_gateway in MASTERCARD_GATEWAYS and _refreshable(payment):
             status_response = get_mastercard_payment_status(str(payment.ref_id))
             payment = _apply_mastercard_status(payment, status_response)
+            return Response(_status_payload(payment, "Payment status checked successfully."))
 
-            return Response({
-                "status": True,
-                "message": "Payment status checked successfully.",
-                "data": {
-                    "ref_id": payment.ref_id,
-                    "status": payment.status,
-                    "amount": payment.price,
-                    "date_created": payment.date_created,
-                    "expiry_datetime": payment.expiry_datetime,
-                    "currency": payment.currency,
-                    "payment_gateway": payment.payment_gateway,
-                    "transaction_id": payment.gateway_transaction_id,
-                },
-            })
+        if payment.payment_gateway == 'CoinPayments' and _refreshable(payment):
+            error = _refresh_coinpayments_status(payment)
+            if error is not None:
+                return Response({"status": False, "message": error}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(_status_payload(payment, "Payment status checked successfully."))
 
-        if payment.payment_gateway == 'CoinPayments' and allow_refresh:
-            cp = CoinPayments(
-                publicKey=settings.COINPAYMENTS_PUBLIC_KEY,
-                privateKey=settings.COINPAYMENTS_PRIVATE_KEY,
-                ipn_url=settings.COINPAYMENTS_IPN_URL
-            )
+        # If not refreshed (older than cutoff or unsupported gateway), return current state.
+        return Response(_status_payload(payment, "Payment status returned."), status=status.HTTP_200_OK)
 
-            response = cp.getTransactionInfo({'pmtid': payment.gateway_transaction_id})
-            if response.get('error') == 'ok':
-                payment_status = response['status_text']
 
-                if response['status_text'] == 'Waiting for buyer funds...':
-                    payment_status = 'PENDING'
-                elif response['status_text'] == 'Cancelled / Timed Out':
-                    payment_status = 'FAILED'
-                else:
-                    payment_status = 'COMPLETED'
-                    payment.date_paid = now()
+class PaymentStatusCheckAsyncView(AsyncAPIView):
+    """
+    ``PaymentStatusCheckView`` for ASGI: the MPGS order lookup is awaited;
+    the ORM and CoinPayments (signed form posts) run in threads.
+    """
 
-                payment.status = payment_status
-                payment.save()
+    async def get(self, request, ref_id):
+        try:
+            payment = await Payment.objects.aget(ref_id=ref_id)
+        except Payment.DoesNotExist:
+            return api_response({"status": False, "message": "Payment not found."}, status=status.HTTP_404_NOT_FOUND)
 
-                return Response({
-                    "status": True,
-                    "message": "Payment status checked successfully.",
-                    "data": {
-                        "ref_id": payment.ref_id,
-                        "status": payment.status,
-                        "amount": payment.price,
-                        "date_created": payment.date_created,
-                        "expiry_datetime": payment.expiry_datetime,
-                        "currency": payment.currency,
-                        "payment_gateway": payment.payment_gateway,
-                        "transaction_id": payment.gateway_transaction_id,
-                    },
-                })
-            else:
-                return Response(
-                    {"status": False, "message": response.get('error')},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        if payment.payment_gateway in MASTERCARD_GATEWAYS and _refreshable(payment):
+            status_response = await aget_mastercard_payment_status(str(payment.ref_id))
+            payment = await sync_to_async(_apply_mastercard_status)(payment, status_response)
+            return api_response(_status_payload(payment, "Payment status checked successfully."))
 
-        # If not refreshed (older than cutoff or unsupported gateway), return current state.
-        return Response({
-            "status": True,
-            "message": "Payment status returned.",
-            "data": {
-                "ref_id": payment.ref_id,
-                "status": payment.status,
-                "amount": payment.price,
-                "date_created": payment.date_created,
-                "expiry_datetime": payment.expiry_datetime,
-                "currency": payment.currency,
-                "payment_gateway": payment.payment_gateway,
-                "transaction_id": payment.gateway_transaction_id,
-            },
-        }, status=status.HTTP_200_OK)
+        if payment.payment_gateway == 'CoinPayments' and _refreshable(payment):
+            error = await sync_to_async(_refresh_coinpayments_status)(payment)
+            if error is not None:
+                return api_response({"status": False, "message": error}, status=status.HTTP_400_BAD_REQUEST)
+            return api_response(_status_payload(payment, "Payment status checked successfully."))
+
+        return api_response(_status_payload(payment, "Payment status returned."), status=status.HTTP_200_OK)
 
 
 class MastercardCheckoutCallbackView(APIView):
@@ -1,4 +1,7 @@
 from django.contrib import admin
-from .models import eSIMPlan
+from .models import CatalogueSnapshot, ProvisioningJob, UsageSnapshot, eSIMPlan
 
 admin.site.register(eSIMPlan)
+admin.site.register(CatalogueSnapshot)
+admin.site.register(UsageSnapshot)
+admin.site.register(ProvisioningJob)
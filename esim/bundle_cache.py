@@ -0,0 +1,78 @@
+"""
+In-process cache of eSIMGo bundle details keyed by bundle name.
+
+The full catalogue already carries every field ``/catalogue/bundle/<name>``
+returns, so each catalogue snapshot fills the cache in bulk and detail
+lookups (plan detail view, payment creation, provisioning) rarely need a
+vendor call. Misses are filled on demand by ``esimgo.get_esimgo_bundle``.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class BundleCache:
+    """Thread-safe TTL + LRU map of bundle name to formatted bundle."""
+
+    def __init__(self, ttl=None, max_entries=None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # name -> (bundle, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, "ESIMGO_BUNDLE_CACHE_TTL_SECONDS", 900)
+
+    @property
+    def max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, "ESIMGO_BUNDLE_CACHE_MAX_ENTRIES", 5000)
+
+    def get(self, name):
+        """Return a copy of the cached bundle, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[name]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, name, bundle, age=0.0):
+        self.put_many([bundle], age=age, key=lambda _: name)
+
+    def put_many(self, bundles, age=0.0, key=None):
+        """Cache ``bundles`` fetched ``age`` seconds ago; they expire ``ttl`` after fetching."""
+        expires_at = time.monotonic() + self.ttl - age
+        if expires_at <= time.monotonic():
+            return
+        key = key or (lambda bundle: bundle.get("name"))
+        with self._lock:
+            for bundle in bundles:
+                name = key(bundle)
+                if not name:
+                    continue
+                self._entries[name] = (bundle, expires_at)
+                self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,617 @@
+"""
+Local snapshot store for the eSIMAccess and eSIMGo catalogues.
+
+The plans endpoint used to call both vendors on every request. Snapshots are
+now fetched once per TTL, persisted in ``CatalogueSnapshot`` so every worker
+(and the ``refresh_catalogue`` management command) shares them, and kept in
+process memory so the hot path does not touch the database either.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+import requests
+from decouple import config
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from magic_esim.vendors import esimaccess_http
+
+from .circuit import CircuitOpenError, breaker_for, breaker_stats
+from .catalogue_index import EXCLUDED_SLUG_SUFFIXES, ESIMAccessIndex, ESIMGoIndex
+from .esimgo import bundle_cache, fetch_esimgo_bundles
+from .models import CatalogueSnapshot
+from .singleflight import vendor_flights
+from .utils import format_esimaccess_package, format_esimgo_bundle
+
+
+logger = logging.getLogger(__name__)
+
+ESIMACCESS = "esimaccess"
+ESIMGO = "esimgo"
+
+# eSIMAccess treats "!RG" and "!GL" as the regional and global catalogues, so
+# each is kept as its own scope. The empty scope is the full package list.
+PROVIDER_SCOPES = {
+    ESIMACCESS: ("", "!RG", "!GL"),
+    ESIMGO: ("",),
+}
+
+
+
+class CatalogueError(Exception):
+    """Raised when a provider catalogue cannot be fetched."""
+
+
+Snapshot = namedtuple("Snapshot", ["provider", "scope", "items", "fetched_at", "index"])
+
+INDEX_CLASSES = {
+    ESIMACCESS: ESIMAccessIndex,
+    ESIMGO: ESIMGoIndex,
+}
+
+# Outcome of one provider in a fan-out: ``status`` is "ok", "error", "timeout" or "unavailable",
+# ``source`` says whether the items came from the snapshot, the vendor or a stale copy.
+# ``index`` is the snapshot index when the items came from one, else None.
+ProviderResult = namedtuple("ProviderResult", ["items", "status", "latency_ms", "source", "age", "index"])
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "ESIM_VENDOR_FANOUT_WORKERS", 8),
+    thread_name_prefix="esim-vendor",
+)
+
+
+def build_snapshot(provider, scope, items, fetched_at):
+    """Wrap ``items`` in a ``Snapshot``, building its index once per refresh."""
+    return Snapshot(provider, scope, items, fetched_at, INDEX_CLASSES[provider](items))
+
+
+def snapshot_age(snapshot):
+    """Seconds since ``snapshot`` was fetched from the vendor."""
+    return time.time() - snapshot.fetched_at
+
+
+def fetch_esimaccess_packages(filters):
+    """
+    Fetch the raw eSIMAccess package list matching ``filters`` (the upstream request body).
+
+    Raises ``CircuitOpenError`` without calling eSIMAccess while its breaker is open.
+    """
+    return breaker_for("esimaccess:package/list").call(_request_esimaccess_packages, filters)
+
+
+def _request_esimaccess_packages(filters):
+    esim_host = config("ESIMACCESS_HOST")
+    api_token = config("ESIMACCESS_ACCESS_CODE")
+
+    response = esimaccess_http.post(
+        f"{esim_host}/api/v1/open/package/list",
+        json=filters,
+        headers={"RT-AccessCode": api_token},
+        timeout=15,
+        endpoint="package/list",
+        idempotent=True,
+    )
+    if response.status_code != 200:
+        raise CatalogueError(f"eSIMAccess returned HTTP {response.status_code}: {response.text}")
+
+    body = response.json() or {}
+    if body.get("success") is False:
+        raise CatalogueError(f"eSIMAccess error: {body.get('errorMsg')}")
+    return (body.get("obj") or {}).get("packageList", [])
+
+
+def _load_esimaccess(scope):
+    packages = sorted(fetch_esimaccess_packages({"locationCode": scope}), key=lambda x: x.get("price", float("inf")))
+    return [format_esimaccess_package(item) for item in packages]
+
+
+def fetch_live_esimaccess(filters):
+    """Query eSIMAccess directly for filters a snapshot cannot answer, such as top-ups for an ICCID."""
+    key = ("esimaccess-live", tuple(sorted(filters.items())))
+    packages = vendor_flights.do(key, partial(fetch_esimaccess_packages, filters))
+    packages = filter_esimaccess_packages(packages, filters)
+    packages = sorted(packages, key=lambda x: x.get("price", float("inf")))
+    return [format_esimaccess_package(item) for item in packages]
+
+
+def _load_esimgo(scope):
+    return [format_esimgo_bundle(item) for item in fetch_esimgo_bundles()]
+
+
+_LOADERS = {
+    ESIMACCESS: _load_esimaccess,
+    ESIMGO: _load_esimgo,
+}
+
+
+class CatalogueStore:
+    """
+    Two-level (memory, then database) cache of provider catalogues.
+
+    ``get`` serves from memory while the snapshot is younger than the TTL,
+    falls back to the shared database row, and only calls the vendor when
+    both are stale or missing.
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._refreshing = set()
+        self._db_checked = {}
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, "ESIM_CATALOGUE_TTL_SECONDS", 900)
+
+    @property
+    def stale_ttl(self):
+        """How long past the TTL an expired snapshot may still be served while it refreshes."""
+        return getattr(settings, "ESIM_CATALOGUE_STALE_SECONDS", 86400)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def add_listener(self, callback):
+        """Call ``callback(snapshot)`` whenever a newer snapshot replaces the current one."""
+        self._listeners.append(callback)
+
+    def _remember(self, snapshot):
+        key = (snapshot.provider, snapshot.scope)
+        with self._lock:
+            previous = self._snapshots.get(key)
+            self._snapshots[key] = snapshot
+        if previous is None or previous.fetched_at != snapshot.fetched_at:
+            for callback in self._listeners:
+                callback(snapshot)
+        return snapshot
+
+    def _load_from_db(self, provider, scope):
+        # Only ``fetched_at`` is read while the row matches the snapshot in memory:
+        # loading the payload and rebuilding its index is left for a newer row.
+        rows = CatalogueSnapshot.objects.filter(provider=provider, scope=scope)
+        fetched_at = rows.values_list("fetched_at", flat=True).first()
+        if fetched_at is None:
+            return None
+        current = self._snapshots.get((provider, scope))
+        if current is not None and current.fetched_at == fetched_at.timestamp():
+            return current
+        row = rows.first()
+        return self._remember(build_snapshot(provider, scope, row.payload, row.fetched_at.timestamp()))
+
+    def _db_check_due(self, key):
+        # Rate-limits database rechecks of an expired in-memory snapshot.
+        interval = getattr(settings, "ESIM_CATALOGUE_DB_RECHECK_SECONDS", 5)
+        clock = time.monotonic()
+        with self._lock:
+            if clock - self._db_checked.get(key, float("-inf")) < interval:
+                return False
+            self._db_checked[key] = clock
+        return True
+
+    def _current(self, provider, scope):
+        # The newest snapshot known without calling the vendor, fresh or not.
+        snapshot = self._snapshots.get((provider, scope))
+        if snapshot is None or (snapshot_age(snapshot) >= self.ttl and self._db_check_due((provider, scope))):
+            snapshot = self._load_from_db(provider, scope) or snapshot
+        return snapshot
+
+    def lookup(self, provider, scope=""):
+        """
+        Return ``(fresh, stale)`` snapshots without calling the vendor.
+
+        ``fresh`` is set when a snapshot younger than the TTL exists in memory
+        or in the database; otherwise ``stale`` holds the newest expired copy.
+        An expired snapshot in memory is served as stale without touching the
+        database between rechecks (``ESIM_CATALOGUE_DB_RECHECK_SECONDS``).
+        """
+        snapshot = self._current(provider, scope)
+        if snapshot is not None and snapshot_age(snapshot) < self.ttl:
+            self._count("hits")
+            return snapshot, None
+        self._count("misses")
+        return None, snapshot
+
+    def get(self, provider, scope=""):
+        """Return a fresh ``Snapshot`` for ``provider``/``scope``, refreshing it on a miss."""
+        fresh, stale = self.lookup(provider, scope)
+        if fresh is not None:
+            return fresh
+        try:
+            return self.refresh(provider, scope)
+        except (CatalogueError, CircuitOpenError, requests.RequestException) as e:
+            logger.warning("Catalogue refresh failed for %s [%s]: %s", provider, scope or "all", e)
+            # A stale catalogue is still better than an empty storefront.
+            return stale
+
+    def get_many(self, scopes, timeout, live=None, narrow=None):
+        """
+        Resolve several providers at once under a single deadline.
+
+        ``scopes`` maps provider to snapshot scope; ``live`` maps a provider to a
+        callable that returns items which must not be snapshotted. ``narrow``
+        maps a provider to a targeted upstream query to run instead of the full
+        download when its snapshot misses; the full snapshot is then refreshed
+        in the background. Snapshot hits are answered inline, and so are expired
+        snapshots younger than ``stale_ttl`` (stale-while-revalidate: they are
+        refreshed in the background). Everything else is fetched concurrently.
+        Providers still running when ``timeout`` expires are reported as
+        "timeout" (with their stale snapshot, if any) and are committed once
+        they finish so the next request is a hit. A provider whose circuit
+        breaker is open is reported as "unavailable" without waiting.
+        Returns ``{provider: ProviderResult}``.
+        """
+        results = {}
+        stale = {}
+        tasks = {}
+        full_fetches = set()
+        for provider, scope in scopes.items():
+            fresh, stale[provider] = self.lookup(provider, scope)
+            if fresh is not None:
+                results[provider] = ProviderResult(
+                    fresh.items, "ok", 0.0, "snapshot", snapshot_age(fresh), fresh.index
+                )
+            elif stale[provider] is not None and snapshot_age(stale[provider]) < self.ttl + self.stale_ttl:
+                results[provider] = ProviderResult(
+                    stale[provider].items, "ok", 0.0, "stale", snapshot_age(stale[provider]), stale[provider].index
+                )
+                self.refresh_in_background(provider, scope)
+            elif provider in (narrow or {}):
+                tasks[provider] = narrow[provider]
+                self.refresh_in_background(provider, scope)
+            else:
+                tasks[provider] = partial(self.fetch, provider, scope)
+                full_fetches.add(provider)
+        tasks.update(live or {})
+        if not tasks:
+            return results
+
+        started = time.monotonic()
+        futures = {provider: _executor.submit(_timed, task) for provider, task in tasks.items()}
+        done, _ = wait(futures.values(), timeout=timeout)
+        waited_ms = (time.monotonic() - started) * 1000
+
+        for provider, future in futures.items():
+            if future not in done:
+                logger.warning("Catalogue fetch for %s exceeded the %ss deadline", provider, timeout)
+                results[provider] = _fallback(stale.get(provider), "timeout", waited_ms)
+                if provider in full_fetches:
+                    future.add_done_callback(partial(self._commit_late, provider, scopes[provider]))
+                continue
+
+            try:
+                items, latency_ms = future.result()
+            except CircuitOpenError as e:
+                logger.info("Catalogue fetch for %s skipped: %s", provider, e)
+                results[provider] = _fallback(stale.get(provider), "unavailable", waited_ms)
+                continue
+            except Exception as e:
+                logger.warning("Catalogue fetch failed for %s: %s", provider, e)
+                results[provider] = _fallback(stale.get(provider), "error", waited_ms)
+                continue
+
+            if provider in full_fetches:
+                snapshot = self.commit(provider, scopes[provider], items)
+                results[provider] = ProviderResult(snapshot.items, "ok", latency_ms, "vendor", 0.0, snapshot.index)
+            else:
+                results[provider] = ProviderResult(items, "ok", latency_ms, "live", 0.0, None)
+        return results
+
+    def find(self, provider, code, max_age=None):
+        """
+        Return ``(item, snapshot)`` for the plan identified by ``code``.
+
+        Looks the code up in every snapshot of ``provider`` without calling the
+        vendor. Snapshots older than ``max_age`` seconds (by default ``ttl +
+        stale_ttl``) are skipped; expired ones are refreshed in the background.
+        Returns ``(None, None)`` when no usable snapshot has the code.
+        """
+        if max_age is None:
+            max_age = self.ttl + self.stale_ttl
+        for scope in PROVIDER_SCOPES[provider]:
+            snapshot = self._current(provider, scope)
+            if snapshot is None:
+                continue
+            age = snapshot_age(snapshot)
+            if age >= self.ttl:
+                self.refresh_in_background(provider, scope)
+            if age >= max_age:
+                continue
+            item = snapshot.index.by_code.get(code)
+            if item is not None:
+                return item, snapshot
+        return None, None
+
+    def resolve(self, codes, timeout):
+        """
+        Look many plans up by code in one pass.
+
+        ``codes`` maps provider to a list of plan codes (eSIMAccess package
+        codes, eSIMGo bundle names). Codes are first looked up in every
+        snapshot of their provider. When some are missing and the provider's
+        full snapshot is not fresh, that snapshot is fetched once (all such
+        providers concurrently, under ``timeout``) and the lookup repeated.
+        Returns ``(found, results)``: ``{provider: {code: item or None}}`` and
+        the ``ProviderResult`` of every provider that had to be fetched.
+        """
+        found = {}
+        missing = {}
+        for provider, provider_codes in codes.items():
+            found[provider] = {}
+            for code in provider_codes:
+                found[provider][code], _ = self.find(provider, code)
+                if found[provider][code] is None:
+                    missing.setdefault(provider, []).append(code)
+
+        scopes = {provider: "" for provider in missing if self.lookup(provider, "")[0] is None}
+        results = self.get_many(scopes, timeout) if scopes else {}
+        for provider, result in results.items():
+            if result.index is None:
+                continue
+            for code in missing[provider]:
+                found[provider][code] = result.index.by_code.get(code)
+        return found, results
+
+    def peek(self, provider, scope=""):
+        """Return whatever snapshot is in memory without refreshing or counting."""
+        return self._snapshots.get((provider, scope))
+
+    def fetch(self, provider, scope=""):
+        """
+        Download and format ``provider``/``scope`` from the vendor.
+
+        Concurrent fetches of the same snapshot share one upstream download.
+        With a cross-worker single-flight backend, a snapshot another worker
+        stored while this one waited for the lock is adopted instead.
+        """
+        requested_at = now()
+
+        def adopt():
+            row = CatalogueSnapshot.objects.filter(
+                provider=provider, scope=scope, fetched_at__gte=requested_at
+            ).first()
+            return row.payload if row is not None else None
+
+        try:
+            return vendor_flights.do((provider, scope), partial(_LOADERS[provider], scope), recheck=adopt)
+        except Exception:
+            self._count("failures")
+            raise
+
+    def commit(self, provider, scope, items):
+        """Persist freshly fetched ``items`` and make them the current snapshot."""
+        fetched_at = now()
+        CatalogueSnapshot.objects.update_or_create(
+            provider=provider,
+            scope=scope,
+            defaults={"payload": items, "item_count": len(items), "fetched_at": fetched_at},
+        )
+        self._count("refreshes")
+        return self._remember(build_snapshot(provider, scope, items, fetched_at.timestamp()))
+
+    def refresh(self, provider, scope=""):
+        """Fetch ``provider``/``scope`` from the vendor and persist it."""
+        return self.commit(provider, scope, self.fetch(provider, scope))
+
+    def refresh_in_background(self, provider, scope=""):
+        """Fetch ``provider``/``scope`` on the vendor pool and commit it when done."""
+        with self._lock:
+            if (provider, scope) in self._refreshing:
+                return None
+            self._refreshing.add((provider, scope))
+        future = _executor.submit(_timed, partial(self.fetch, provider, scope))
+        future.add_done_callback(partial(self._commit_late, provider, scope))
+        return future
+
+    def _commit_late(self, provider, scope, future):
+        # Runs on the pool thread once a background or over-deadline fetch finishes.
+        try:
+            if future.exception() is None:
+                items, _ = future.result()
+                self.commit(provider, scope, items)
+        except Exception:
+            logger.exception("Late catalogue commit failed for %s [%s]", provider, scope or "all")
+        finally:
+            with self._lock:
+                self._refreshing.discard((provider, scope))
+            close_old_connections()
+
+    def refresh_stale(self, max_age, providers=None):
+        """
+        Refresh every snapshot older than ``max_age`` seconds.
+
+        Snapshots another process refreshed recently are adopted from the
+        database instead of being fetched again. Returns a list of
+        ``(provider, scope, error)`` tuples, with ``error`` None on success.
+        """
+        results = []
+        for provider in providers or PROVIDER_SCOPES:
+            for scope in PROVIDER_SCOPES[provider]:
+                snapshot = self._load_from_db(provider, scope)
+                if snapshot is not None and snapshot_age(snapshot) < max_age:
+                    results.append((provider, scope, None))
+                    continue
+                try:
+                    self.refresh(provider, scope)
+                    results.append((provider, scope, None))
+                except (CatalogueError, CircuitOpenError, requests.RequestException) as e:
+                    logger.warning("Catalogue refresh failed for %s [%s]: %s", provider, scope or "all", e)
+                    results.append((provider, scope, e))
+        return results
+
+    def stats(self):
+        """Hit/miss counters and the age of every snapshot held in memory."""
+        with self._lock:
+            snapshots = list(self._snapshots.values())
+            data = {
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+            }
+        data["single_flight"] = vendor_flights.stats()
+        data["breakers"] = breaker_stats()
+        data["esimgo_bundles"] = bundle_cache.stats()
+        data["snapshots"] = {
+            f"{snapshot.provider}:{snapshot.scope or 'all'}": {
+                "age": round(snapshot_age(snapshot), 1),
+                "items": len(snapshot.items),
+            }
+            for snapshot in snapshots
+        }
+        return data
+
+
+def _timed(task):
+    started = time.monotonic()
+    return task(), (time.monotonic() - started) * 1000
+
+
+def provider_report(result):
+    """The per-provider status block returned alongside plan data."""
+    return {
+        "status": result.status,
+        "source": result.source,
+        "latency_ms": round(result.latency_ms, 1),
+        "age": round(result.age, 1) if result.age is not None else None,
+    }
+
+
+def _fallback(snapshot, status, latency_ms):
+    if snapshot is None:
+        return ProviderResult([], status, latency_ms, None, None, None)
+    return ProviderResult(snapshot.items, status, latency_ms, "stale", snapshot_age(snapshot), snapshot.index)
+
+
+store = CatalogueStore()
+
+
+def _warm_bundle_cache(snapshot):
+    # Full eSIMGo catalogues carry the same fields as /catalogue/bundle/<name>.
+    if snapshot.provider == ESIMGO:
+        bundle_cache.put_many(snapshot.items, age=snapshot_age(snapshot))
+
+
+store.add_listener(_warm_bundle_cache)
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def _refresh_loop():
+    interval = getattr(settings, "ESIM_CATALOGUE_REFRESH_INTERVAL_SECONDS", 300)
+    while True:
+        try:
+            store.refresh_stale(max_age=interval)
+        except Exception:
+            logger.exception("Background catalogue refresh crashed")
+        finally:
+            close_old_connections()
+        time.sleep(interval)
+
+
+def start_background_refresher():
+    """Start the per-process refresher thread once, if enabled in settings."""
+    global _refresher
+    if not getattr(settings, "ESIM_CATALOGUE_BACKGROUND_REFRESH", True):
+        return
+    with _refresher_lock:
+        if _refresher is not None and _refresher.is_alive():
+            return
+        _refresher = threading.Thread(target=_refresh_loop, name="esim-catalogue-refresher", daemon=True)
+        _refresher.start()
+
+
+def select_esimaccess_packages(result, filters):
+    """Filter a provider result, through its snapshot index when it has one."""
+    if result.index is not None:
+        return result.index.filter(filters)
+    return filter_esimaccess_packages(result.items, filters)
+
+
+def select_esimgo_bundles(result, countries="", region="", description=""):
+    """Filter a provider result, through its snapshot index when it has one."""
+    if result.index is not None:
+        return result.index.filter(countries, region, description)
+    return filter_esimgo_bundles(result.items, countries, region, description)
+
+
+def filter_esimaccess_packages(packages, filters):
+    """
+    Apply the plans endpoint filters to a list of eSIMAccess packages by scanning it.
+
+    Mirrors what the upstream ``packageCode``/``slug`` filters did plus the
+    slug prefix rules the view has always applied to location codes.
+    """
+    package_code = filters.get("packageCode")
+    if package_code:
+        packages = [item for item in packages if item.get("packageCode") == package_code]
+
+    slug = filters.get("slug")
+    if slug:
+        packages = [item for item in packages if item.get("slug") == slug]
+
+    # Filter packages where slug starts with locationCode and doesn't end with _END or _DAILY
+    location_code = filters.get("locationCode")
+    if location_code and location_code != '!RG' and location_code != '!GL':
+        packages = [
+            item for item in packages
+            if item.get("slug", "").startswith(f"{location_code}_") and not item.get("slug", "").endswith(EXCLUDED_SLUG_SUFFIXES)
+        ]
+
+    # If mainRegion was passed, filter
+    main_region = filters.get("mainRegion")
+    if main_region and location_code == '!RG':
+        packages = [
+            item for item in packages
+            if item.get("slug", "").startswith(f"{main_region}-") and not item.get("slug", "").endswith(EXCLUDED_SLUG_SUFFIXES)
+        ]
+    elif main_region and location_code == '!GL':
+        packages = [
+            item for item in packages
+            if item.get("slug", "").startswith(main_region) and not item.get("slug", "").endswith(EXCLUDED_SLUG_SUFFIXES)
+        ]
+    return packages
+
+
+def filter_esimgo_bundles(bundles, countries="", region="", description=""):
+    """Apply the eSIMGo ``countries``/``region``/``description`` filters by scanning ``bundles``."""
+    if countries:
+        iso = countries.upper()
+        bundles = [
+            bundle for bundle in bundles
+            if any(country.get("iso", "").upper() == iso for country in bundle.get("countries", []))
+        ]
+
+    if region:
+        # Upstream region filter, then the view's historic iso check on top of it.
+        bundles = [
+            bundle for bundle in bundles
+            if any(
+                (country.get("region") or "").lower() == region.lower()
+                for country in bundle.get("countries", [])
+            )
+        ]
+        bundles = [
+            bundle for bundle in bundles
+            if any(region in country.get("iso", "") for country in bundle.get("countries", []))
+        ]
+
+    if description:
+        needle = description.lower()
+        bundles = [bundle for bundle in bundles if needle in (bundle.get("description") or "").lower()]
+    return bundles
@@ -0,0 +1,143 @@
+"""
+Lookup structures built once per catalogue snapshot.
+
+Filtering used to scan every package on every request. The indexes here
+answer the plans endpoint filters with dictionary and trie lookups, and
+return items in snapshot order (price ascending for eSIMAccess).
+"""
+
+EXCLUDED_SLUG_SUFFIXES = ("_End", "_Daily")
+
+
+class SlugTrie:
+    """
+    Character trie over package slugs.
+
+    Every node keeps the positions of all slugs below it, so a prefix query
+    costs one walk down the prefix instead of a scan of the catalogue.
+    """
+
+    def __init__(self):
+        self._root = {"children": {}, "positions": []}
+
+    def insert(self, slug, position):
+        node = self._root
+        node["positions"].append(position)
+        for char in slug:
+            node = node["children"].setdefault(char, {"children": {}, "positions": []})
+            node["positions"].append(position)
+
+    def prefix(self, prefix):
+        """Positions of every slug that starts with ``prefix``."""
+        node = self._root
+        for char in prefix:
+            node = node["children"].get(char)
+            if node is None:
+                return []
+        return node["positions"]
+
+
+class ESIMAccessIndex:
+    """Indexes over an eSIMAccess package snapshot."""
+
+    def __init__(self, items):
+        self.items = items
+        self.by_code = {}
+        self._code_positions = {}
+        self.by_slug = {}
+        self.by_location = {}
+        self.slugs = SlugTrie()
+        self.excluded = set()
+
+        for position, item in enumerate(items):
+            slug = item.get("slug") or ""
+            if item.get("packageCode"):
+                self.by_code[item["packageCode"]] = item
+                self._code_positions[item["packageCode"]] = position
+            if slug:
+                self.by_slug.setdefault(slug, []).append(position)
+                # "NG_1_7" belongs to location "NG"; the view matches on "<code>_".
+                if "_" in slug:
+                    self.by_location.setdefault(slug.split("_", 1)[0], []).append(position)
+                self.slugs.insert(slug, position)
+            if slug.endswith(EXCLUDED_SLUG_SUFFIXES):
+                self.excluded.add(position)
+
+    def filter(self, filters):
+        """Index-backed equivalent of ``catalogue.filter_esimaccess_packages``."""
+        selected = None
+
+        def narrow(positions):
+            nonlocal selected
+            positions = set(positions)
+            selected = positions if selected is None else selected & positions
+
+        package_code = filters.get("packageCode")
+        if package_code:
+            position = self._code_positions.get(package_code)
+            narrow([position] if position is not None else [])
+
+        slug = filters.get("slug")
+        if slug:
+            narrow(self.by_slug.get(slug, []))
+
+        location_code = filters.get("locationCode")
+        main_region = filters.get("mainRegion")
+        if location_code and location_code != '!RG' and location_code != '!GL':
+            narrow(p for p in self.by_location.get(location_code, []) if p not in self.excluded)
+        if main_region and location_code == '!RG':
+            narrow(p for p in self.slugs.prefix(f"{main_region}-") if p not in self.excluded)
+        elif main_region and location_code == '!GL':
+            narrow(p for p in self.slugs.prefix(main_region) if p not in self.excluded)
+
+        if selected is None:
+            return list(self.items)
+        return [self.items[position] for position in sorted(selected)]
+
+
+class ESIMGoIndex:
+    """Indexes over an eSIMGo bundle snapshot, including multi-country bundles."""
+
+    def __init__(self, items):
+        self.items = items
+        self.by_code = {}
+        self.by_country = {}
+        self.by_region = {}
+
+        for position, item in enumerate(items):
+            if item.get("name"):
+                self.by_code[item["name"]] = item
+            isos = set()
+            regions = set()
+            for country in item.get("countries", []):
+                if country.get("iso"):
+                    isos.add(country["iso"].upper())
+                if country.get("region"):
+                    regions.add(country["region"].lower())
+            # Inverted index: a 40-country bundle is listed under each of its countries.
+            for iso in isos:
+                self.by_country.setdefault(iso, []).append(position)
+            for region in regions:
+                self.by_region.setdefault(region, []).append(position)
+
+    def filter(self, countries="", region="", description=""):
+        """Index-backed equivalent of ``catalogue.filter_esimgo_bundles``."""
+        selected = None
+        if countries:
+            selected = set(self.by_country.get(countries.upper(), []))
+        if region:
+            positions = set(self.by_region.get(region.lower(), []))
+            selected = positions if selected is None else selected & positions
+
+        items = self.items if selected is None else [self.items[p] for p in sorted(selected)]
+
+        if region:
+            # The view's historic iso check still applies on top of the region match.
+            items = [
+                bundle for bundle in items
+                if any(region in country.get("iso", "") for country in bundle.get("countries", []))
+            ]
+        if description:
+            needle = description.lower()
+            items = [bundle for bundle in items if needle in (bundle.get("description") or "").lower()]
+        return list(items)
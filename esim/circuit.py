@@ -0,0 +1,162 @@
+"""
+Circuit breakers for vendor endpoints.
+
+While eSIMAccess or eSIMGo is down every request used to wait out the full
+timeout again. A breaker opens after ``ESIM_BREAKER_FAILURE_THRESHOLD``
+consecutive failed or slow calls to one endpoint and then rejects calls
+immediately. After ``ESIM_BREAKER_RESET_SECONDS`` a single probe is let
+through (half-open); its outcome closes or re-opens the breaker.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"{endpoint} is unavailable; retrying in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one vendor endpoint."""
+
+    def __init__(self, endpoint, failure_threshold=None, slow_call_seconds=None, reset_seconds=None):
+        self.endpoint = endpoint
+        self._failure_threshold = failure_threshold
+        self._slow_call_seconds = slow_call_seconds
+        self._reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def failure_threshold(self):
+        if self._failure_threshold is not None:
+            return self._failure_threshold
+        return getattr(settings, "ESIM_BREAKER_FAILURE_THRESHOLD", 5)
+
+    @property
+    def slow_call_seconds(self):
+        if self._slow_call_seconds is not None:
+            return self._slow_call_seconds
+        return getattr(settings, "ESIM_BREAKER_SLOW_CALL_SECONDS", 8)
+
+    @property
+    def reset_seconds(self):
+        if self._reset_seconds is not None:
+            return self._reset_seconds
+        return getattr(settings, "ESIM_BREAKER_RESET_SECONDS", 30)
+
+    def allow(self):
+        """Return True if a call may go out now; moves an expired open breaker to half-open."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_in(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, failed=None, ignore=(), **kwargs):
+        """
+        Call ``fn`` through the breaker.
+
+        Exceptions and calls slower than ``slow_call_seconds`` count as
+        failures; so do results for which ``failed(result)`` is true, though
+        such results are still returned to the caller. Exceptions of the
+        ``ignore`` types mean the endpoint answered (e.g. a business error
+        for one order) and are re-raised without counting as failures.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.endpoint, self.retry_in())
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except ignore:
+            self.record_success()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        if time.monotonic() - started > self.slow_call_seconds or (failed is not None and failed(result)):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    async def acall(self, fn, *args, failed=None, ignore=(), **kwargs):
+        """``call`` for a coroutine function ``fn``."""
+        if not self.allow():
+            raise CircuitOpenError(self.endpoint, self.retry_in())
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except ignore:
+            self.record_success()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        if time.monotonic() - started > self.slow_call_seconds or (failed is not None and failed(result)):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(endpoint):
+    """The process-wide breaker for ``endpoint`` (e.g. "esimaccess:package/list")."""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.endpoint: breaker.stats() for breaker in breakers}
@@ -0,0 +1,205 @@
+"""
+eSIMGo catalogue queries.
+
+``/catalogue`` accepts group, countries, region, description and paging
+parameters. Sending them upstream keeps a single-country lookup to a few
+kilobytes instead of downloading and filtering every bundle locally.
+"""
+from functools import partial
+
+from decouple import config
+from django.conf import settings
+
+from magic_esim.vendors import esimgo_async, esimgo_http
+
+from .bundle_cache import BundleCache
+from .circuit import breaker_for
+from .singleflight import async_vendor_flights, vendor_flights
+from .utils import format_esimgo_bundle
+
+
+ESIMGO_GROUP = "Standard Unlimited Essential"
+
+
+class ESIMGoCatalogueQuery:
+    """
+    Query parameters for one ``/catalogue`` search.
+
+    Empty filters are left out of the request entirely so eSIMGo does not
+    treat them as "match nothing".
+    """
+
+    def __init__(self, group=ESIMGO_GROUP, countries=None, region=None, description=None,
+                 per_page=None, order_by=None, direction=None):
+        if isinstance(countries, str):
+            countries = [code for code in countries.split(",") if code]
+        self.group = group
+        self.countries = [code.strip().upper() for code in countries or []]
+        self.region = region or None
+        self.description = description or None
+        self.per_page = per_page or getattr(settings, "ESIMGO_CATALOGUE_PAGE_SIZE", 200)
+        self.order_by = order_by
+        self.direction = direction
+
+    @property
+    def is_narrow(self):
+        """True when the query filters the catalogue beyond the product group."""
+        return bool(self.countries or self.region or self.description)
+
+    def params(self, page=1):
+        params = {"page": page, "perPage": self.per_page}
+        if self.group:
+            params["group"] = self.group
+        if self.countries:
+            params["countries"] = ",".join(self.countries)
+        if self.region:
+            params["region"] = self.region
+        if self.description:
+            params["description"] = self.description
+        if self.order_by:
+            params["orderBy"] = self.order_by
+        if self.direction:
+            params["direction"] = self.direction
+        return params
+
+    def __repr__(self):
+        return f"ESIMGoCatalogueQuery({self.params()!r})"
+
+
+def _get_checked(url, **kwargs):
+    response = esimgo_http.get(url, endpoint="catalogue", **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def iter_esimgo_bundles(query=None, max_pages=None):
+    """
+    Yield raw bundles for ``query`` one page at a time.
+
+    Pages are only requested as the caller consumes the previous one, so
+    stopping early (e.g. after the first match) stops the downloads too.
+    Raises ``CircuitOpenError`` while the catalogue endpoint's breaker is open.
+    """
+    query = query or ESIMGoCatalogueQuery()
+    esimgo_host = config("ESIMGO_HOST")
+    esimgo_api_key = config("ESIMGO_API_KEY")
+    headers = {"accept": "application/json", "x-api-key": esimgo_api_key}
+
+    breaker = breaker_for("esimgo:catalogue")
+
+    page = 1
+    while True:
+        response = breaker.call(
+            _get_checked,
+            f"{esimgo_host}/catalogue",
+            params=query.params(page),
+            headers=headers,
+            timeout=15,
+        )
+        body = response.json() or {}
+        bundles = body.get("bundles", [])
+        yield from bundles
+
+        page_count = body.get("pageCount") or 1
+        if not bundles or page >= page_count or (max_pages and page >= max_pages):
+            return
+        page += 1
+
+
+def fetch_esimgo_bundles(query=None):
+    """Fetch every raw bundle matching ``query`` (the storefront groups by default)."""
+    return list(iter_esimgo_bundles(query))
+
+
+def fetch_live_esimgo(query):
+    """Fetch and format the bundles matching a narrow ``query`` without touching the snapshot."""
+    key = ("esimgo-live", repr(query))
+    bundles = vendor_flights.do(key, partial(fetch_esimgo_bundles, query))
+    return [format_esimgo_bundle(item) for item in bundles]
+
+
+def fetch_esimgo_bundle(name):
+    """
+    GET ``/catalogue/bundle/<name>``; concurrent requests for one bundle share a call.
+
+    Returns the ``requests.Response`` so callers can tell a 404 from other errors.
+    Server errors count against the endpoint's circuit breaker; while it is
+    open ``CircuitOpenError`` is raised without calling eSIMGo.
+    """
+    esimgo_host = config("ESIMGO_HOST")
+    esimgo_api_key = config("ESIMGO_API_KEY")
+    headers = {"accept": "application/json", "x-api-key": esimgo_api_key}
+
+    request = partial(
+        breaker_for("esimgo:bundle").call,
+        esimgo_http.get,
+        f"{esimgo_host}/catalogue/bundle/{name}?api_key={esimgo_api_key}",
+        headers=headers,
+        timeout=15,
+        endpoint="catalogue/bundle",
+        failed=lambda response: response.status_code >= 500,
+    )
+    # The body is read eagerly (no streaming), so every waiter can parse it.
+    return vendor_flights.do(("esimgo-bundle", name), request)
+
+
+async def afetch_esimgo_bundle(name):
+    """``fetch_esimgo_bundle`` for async views; returns an ``httpx.Response``."""
+    esimgo_host = config("ESIMGO_HOST")
+    esimgo_api_key = config("ESIMGO_API_KEY")
+    headers = {"accept": "application/json", "x-api-key": esimgo_api_key}
+
+    request = partial(
+        breaker_for("esimgo:bundle").acall,
+        esimgo_async.get,
+        f"{esimgo_host}/catalogue/bundle/{name}?api_key={esimgo_api_key}",
+        headers=headers,
+        timeout=15,
+        endpoint="catalogue/bundle",
+        failed=lambda response: response.status_code >= 500,
+    )
+    return await async_vendor_flights.do(("esimgo-bundle", name), request)
+
+
+bundle_cache = BundleCache()
+
+
+def get_esimgo_bundle(name):
+    """
+    Return the formatted eSIMGo bundle called ``name``, or None if eSIMGo has no such bundle.
+
+    Reads through ``bundle_cache``; only a miss calls ``/catalogue/bundle/<name>``.
+    Raises ``requests.RequestException`` (``HTTPError`` for non-404 error
+    statuses) or ``CircuitOpenError`` when the bundle cannot be fetched.
+    """
+    bundle = bundle_cache.get(name)
+    if bundle is not None:
+        return bundle
+
+    response = fetch_esimgo_bundle(name)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    bundle = format_esimgo_bundle(response.json())
+    bundle_cache.put(name, bundle)
+    return dict(bundle)
+
+
+async def aget_esimgo_bundle(name):
+    """
+    ``get_esimgo_bundle`` for async views.
+
+    Raises ``httpx.HTTPError`` (``HTTPStatusError`` for non-404 error
+    statuses) or ``CircuitOpenError`` when the bundle cannot be fetched.
+    """
+    bundle = bundle_cache.get(name)
+    if bundle is not None:
+        return bundle
+
+    response = await afetch_esimgo_bundle(name)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    bundle = format_esimgo_bundle(response.json())
+    bundle_cache.put(name, bundle)
+    return dict(bundle)
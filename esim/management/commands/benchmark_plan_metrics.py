@@ -0,0 +1,47 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from esim.metrics import UsageRecord, compute_plan_metrics, numpy_available
+
+
+class Command(BaseCommand):
+    help = "Measure the per-row cost of the plan dashboard usage metrics (pure Python vs NumPy)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            action="append",
+            help="Batch size to measure. May be repeated (default: 10, 100, 1000, 10000).",
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per batch size; the fastest is reported.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        paths = [("python", False)] + ([("numpy", True)] if numpy_available() else [])
+        if not numpy_available():
+            self.stdout.write(self.style.WARNING("⚠ NumPy is not installed; only the pure-Python path is measured."))
+
+        for rows in options["rows"] or [10, 100, 1000, 10000]:
+            records = [self._record(rng) for _ in range(rows)]
+            timings = []
+            for name, use_numpy in paths:
+                best = min(self._time(records, use_numpy) for _ in range(options["repeat"]))
+                timings.append(f"{name}: {best * 1e6 / rows:.2f} µs/row")
+            self.stdout.write(f"{rows:>7} rows  " + "  ".join(timings))
+
+    def _record(self, rng):
+        total = rng.choice([1, 3, 5, 10, 20]) * 1024 ** 3
+        activated = None
+        if rng.random() < 0.8:
+            activated = (datetime(2025, 1, 1) + timedelta(minutes=rng.randrange(500000))).strftime("%Y-%m-%dT%H:%M:%S+0000")
+        return UsageRecord(total, rng.randrange(total), activated, rng.choice([1, 7, 15, 30]))
+
+    def _time(self, records, use_numpy):
+        started = time.perf_counter()
+        compute_plan_metrics(records, use_numpy=use_numpy)
+        return time.perf_counter() - started
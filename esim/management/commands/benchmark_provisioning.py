@@ -0,0 +1,70 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.timezone import now
+
+from billing.models import Payment
+from esim.models import ProvisioningJob, eSIMPlan
+from esim.provisioning import process_jobs
+from magic_esim.vendor_stubs import VendorStubs, esimaccess_packages
+
+
+SLUGS = ("NG_1_7", "GH_3_15", "KE_1_7")
+PACKAGES = [package for package in esimaccess_packages() if package["slug"] in SLUGS]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure eSIMAccess calls per provisioned eSIM with and without batched ordering, "
+        "against a local eSIMAccess stub and a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=60, help="Completed payments to provision per run.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            action="append",
+            help="Batch size to measure. May be repeated (default: 1, 5, 20).",
+        )
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stub takes per request.")
+
+    def handle(self, *args, **options):
+        stubs = VendorStubs(latency=options["latency"]).start()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = get_user_model().objects.create_user(
+                email="benchmark@example.com", username="benchmark", password="benchmark"
+            )
+            for size in options["batch_size"] or [1, 5, 20]:
+                self._run(stubs.esimaccess, user, size, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            stubs.stop()
+
+    def _run(self, stub, user, size, options):
+        Payment.objects.all().delete()
+        for i in range(options["payments"]):
+            package = PACKAGES[i % len(PACKAGES)]
+            Payment.objects.create(
+                user=user, price=10, seller="esimaccess", package_code=package["packageCode"],
+                plan_details=package, status="COMPLETED",
+            )
+        ProvisioningJob.objects.update(run_after=now())  # Skip the batching window
+        stub.reset()
+
+        started = time.perf_counter()
+        while process_jobs(concurrency=options["concurrency"], size=size):
+            pass
+        elapsed = time.perf_counter() - started
+
+        provisioned = eSIMPlan.objects.count()
+        orders, queries = stub.calls["esim/order"], stub.calls["esim/query"]
+        calls = orders + queries
+        self.stdout.write(
+            f"batch size {size:>3}: {provisioned} eSIMs, {orders} orders + {queries} "
+            f"queries = {calls / max(provisioned, 1):.2f} vendor calls/eSIM, {elapsed:.2f}s"
+        )
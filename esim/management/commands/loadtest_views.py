@@ -0,0 +1,129 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from magic_esim.vendor_stubs import ESIMGoStub
+
+
+SERVERS = {
+    "wsgi": lambda port, options: [
+        sys.executable, "-m", "gunicorn", "magic_esim.wsgi:application",
+        "--bind", f"127.0.0.1:{port}", "--workers", "1", "--threads", str(options["wsgi_threads"]),
+        "--log-level", "warning",
+    ],
+    "asgi": lambda port, options: [
+        sys.executable, "-m", "uvicorn", "magic_esim.asgi:application",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", "1",
+        "--log-level", "warning", "--no-access-log",
+    ],
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare WSGI (gunicorn) and ASGI (uvicorn) throughput of a vendor-bound endpoint, "
+        "one worker each, against a local eSIMGo stub."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400, help="Requests per server.")
+        parser.add_argument("--concurrency", type=int, default=200, help="Requests in flight at once.")
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds the stub takes per request.")
+        parser.add_argument("--wsgi-threads", type=int, default=1, help="gunicorn threads for the WSGI worker.")
+        parser.add_argument(
+            "--server",
+            choices=sorted(SERVERS),
+            action="append",
+            help="Server to measure. May be repeated (default: both).",
+        )
+
+    def handle(self, *args, **options):
+        stub = ESIMGoStub(latency=options["latency"]).start()
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} concurrent, "
+            f"{options['latency'] * 1000:.0f}ms vendor latency"
+        )
+        try:
+            for name in options["server"] or ["wsgi", "asgi"]:
+                self._run(name, stub, options)
+        finally:
+            stub.stop()
+
+    def _run(self, name, stub, options):
+        port = _free_port()
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "magic_esim.settings"),
+            ESIMGO_HOST=stub.url,
+            ESIM_CATALOGUE_BACKGROUND_REFRESH="False",
+            # One vendor connection per request in flight, so the pool is not what is measured.
+            VENDOR_HTTP_POOL_SIZE=str(max(options["concurrency"], getattr(settings, "VENDOR_HTTP_POOL_SIZE", 20))),
+        )
+        env.pop("ESIM_ASYNC_VIEWS", None)  # Each server picks its own default
+        server = subprocess.Popen(SERVERS[name](port, options), env=env, cwd=settings.BASE_DIR)
+        try:
+            self._wait_until_up(port, server)
+            elapsed, latencies, errors = asyncio.run(self._load(port, sorted(stub.bundles), options))
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+        latencies.sort()
+        count = len(latencies) or 1
+        self.stdout.write(
+            f"{name}: {options['requests'] / elapsed:7.1f} req/s, "
+            f"p50 {latencies[count // 2] * 1000 if latencies else 0:6.0f}ms, "
+            f"p95 {latencies[int(count * 0.95) - 1] * 1000 if latencies else 0:6.0f}ms, "
+            f"{errors} errors, {elapsed:.2f}s"
+        )
+
+    def _wait_until_up(self, port, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"Server exited with status {server.returncode}.")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"Server did not listen on port {port} within {timeout}s.")
+
+    async def _load(self, port, bundles, options):
+        limits = httpx.Limits(max_connections=options["concurrency"])
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        latencies = []
+        errors = 0
+
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+            async def one(i):
+                nonlocal errors
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        # Each catalogue bundle in turn, so requests mostly miss the bundle cache.
+                        response = await client.get("/api/esim/plan/esimgo/", params={"name": bundles[i % len(bundles)]})
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    if ok:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(options["requests"])))
+            return time.perf_counter() - started, latencies, errors
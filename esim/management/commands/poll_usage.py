@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from esim.usage import poll_usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh eSIM usage snapshots from eSIMAccess in prioritised batches: never-polled "
+        "plans first, then recently active plans and plans closest to expiry."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=getattr(settings, "ESIM_USAGE_POLL_BATCH_SIZE", 100),
+            help="Plans refreshed per batch.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=getattr(settings, "ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS", 300),
+            help="Skip snapshots younger than this many seconds.",
+        )
+        parser.add_argument(
+            "--deadline",
+            type=float,
+            default=getattr(settings, "ESIM_USAGE_POLL_DEADLINE_SECONDS", 60),
+            help="Seconds each batch waits for eSIMAccess before leaving the rest for a later batch.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep polling, sleeping this many seconds between batches (default: run one batch).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            due, refreshed = poll_usage(
+                batch_size=options["batch_size"], min_age=options["min_age"], deadline=options["deadline"]
+            )
+            style = self.style.SUCCESS if refreshed == due else self.style.WARNING
+            self.stdout.write(style(f"✅ Refreshed usage for {refreshed} of {due} due plans"))
+
+            if not options["interval"]:
+                return
+            close_old_connections()
+            # A full batch means more plans are waiting; only rest once caught up.
+            if due < options["batch_size"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from esim.catalogue import PROVIDER_SCOPES, store
+
+
+class Command(BaseCommand):
+    help = "Refresh the locally stored eSIMAccess and eSIMGo catalogue snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--provider",
+            choices=sorted(PROVIDER_SCOPES),
+            action="append",
+            help="Only refresh the given provider. May be repeated.",
+        )
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=0,
+            help="Skip snapshots younger than this many seconds (default: always refresh).",
+        )
+
+    def handle(self, *args, **options):
+        results = store.refresh_stale(max_age=options["max_age"], providers=options["provider"])
+
+        failed = 0
+        for provider, scope, error in results:
+            label = f"{provider} [{scope or 'all'}]"
+            if error is None:
+                self.stdout.write(self.style.SUCCESS(f"✅ {label} refreshed"))
+            else:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"⚠ {label} failed: {error}"))
+
+        self.stdout.write(json.dumps(store.stats(), indent=2))
+        if failed == len(results):
+            raise CommandError("No catalogue snapshot could be refreshed.")
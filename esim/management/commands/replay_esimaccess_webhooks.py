@@ -0,0 +1,77 @@
+import json
+import os
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from esim.webhooks import sign
+
+
+DEFAULT_FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    "webhook_fixtures",
+    "esimaccess_notifications.json",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Post recorded eSIMAccess webhook notifications, signed with ESIMACCESS_SECRET_KEY, "
+        "to a running webhook endpoint (local testing only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "fixtures",
+            nargs="*",
+            default=[DEFAULT_FIXTURE],
+            help="JSON files holding one notification or a list of them (default: the bundled sample).",
+        )
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000/api/esim/webhooks/esimaccess/",
+            help="Webhook endpoint to post to.",
+        )
+        parser.add_argument("--order-no", help="Rewrite every notification's orderNo, e.g. to target a local plan.")
+        parser.add_argument("--iccid", help="Rewrite every notification's iccid.")
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help="Post each file as one JSON array instead of one request per notification.",
+        )
+        parser.add_argument("--delay", type=float, default=0, help="Seconds to wait between requests.")
+
+    def _load(self, path):
+        try:
+            with open(path) as handle:
+                notifications = json.load(handle)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        return notifications if isinstance(notifications, list) else [notifications]
+
+    def _post(self, url, payload):
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", **sign(body)}
+        response = requests.post(url, data=body, headers=headers, timeout=15)
+        style = self.style.SUCCESS if response.status_code == 200 else self.style.ERROR
+        self.stdout.write(style(f"{response.status_code} {response.text}"))
+
+    def handle(self, *args, **options):
+        for path in options["fixtures"]:
+            notifications = self._load(path)
+            for notification in notifications:
+                content = notification.get("content")
+                if not content:
+                    continue
+                if options["order_no"] and "orderNo" in content:
+                    content["orderNo"] = options["order_no"]
+                if options["iccid"] and "iccid" in content:
+                    content["iccid"] = options["iccid"]
+
+            requests_to_send = [notifications] if options["batch"] else notifications
+            self.stdout.write(f"Replaying {len(notifications)} notifications from {path}")
+            for index, payload in enumerate(requests_to_send):
+                if index and options["delay"]:
+                    time.sleep(options["delay"])
+                self._post(options["url"], payload)
@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from esim.provisioning import batch_size, process_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Order eSIMs for completed payments from the provisioning job queue. Several workers "
+        "may run at once; each leases its own jobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=getattr(settings, "ESIM_PROVISIONING_CONCURRENCY", 4),
+            help="Jobs run in parallel by this worker.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Payments ordered together in one eSIMAccess order (default: ESIM_PROVISIONING_BATCH_SIZE).",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep working, sleeping this many seconds when the queue is empty (default: run one batch).",
+        )
+
+    def handle(self, *args, **options):
+        size = options["batch_size"] or batch_size()
+        while True:
+            counts = process_jobs(concurrency=options["concurrency"], size=size)
+            if counts:
+                summary = ", ".join(f"{count} {status.lower()}" for status, count in sorted(counts.items()))
+                style = self.style.WARNING if set(counts) - {"SUCCEEDED"} else self.style.SUCCESS
+                self.stdout.write(style(f"✅ Provisioning batch: {summary}"))
+
+            if not options["interval"]:
+                return
+            close_old_connections()
+            # A full batch means more jobs may be due; only rest once caught up.
+            if sum(counts.values()) < options["concurrency"] * size:
+                time.sleep(options["interval"])
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from magic_esim.vendor_stubs import VendorStubs
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve local eSIMAccess, eSIMGo, MPGS and CoinPayments stubs until interrupted, "
+        "printing the environment that points the app at them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=0,
+            help="Port of the eSIMAccess stub; the others take the next three (default: any free ports).",
+        )
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds each stub takes per request.")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more seconds per request.")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=None,
+            help="Requests per second each stub accepts before answering 429.",
+        )
+        parser.add_argument("--seed", type=int, default=None, help="Seed for latency jitter and injected errors.")
+
+    def handle(self, *args, **options):
+        stubs = VendorStubs(
+            port=options["port"],
+            latency=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            rate_limit=options["rate_limit"],
+            seed=options["seed"],
+        )
+        for stub in stubs:
+            stub.start()
+        for name, value in stubs.environ().items():
+            self.stdout.write(f"export {name}={value}")
+        self.stdout.write(self.style.SUCCESS("✅ Vendor stubs running, Ctrl-C to stop"))
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for stub in stubs:
+                stub.stop()
+            for vendor, stats in stubs.stats().items():
+                self.stdout.write(f"{vendor}: {stats}")
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0018_esimplan_iccid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=25)),
+                ('scope', models.CharField(blank=True, default='', max_length=50)),
+                ('payload', models.JSONField(default=list)),
+                ('item_count', models.IntegerField(default=0)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('provider', 'scope')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0019_cataloguesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_no', models.CharField(db_index=True, max_length=25)),
+                ('iccid', models.CharField(blank=True, db_index=True, default=None, max_length=50, null=True)),
+                ('order_usage', models.BigIntegerField(default=0)),
+                ('total_volume', models.BigIntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('activate_time', models.DateTimeField(blank=True, default=None, null=True)),
+                ('expired_time', models.DateTimeField(blank=True, default=None, null=True)),
+                ('esim_status', models.CharField(blank=True, default=None, max_length=25, null=True)),
+                ('smdp_status', models.CharField(blank=True, default=None, max_length=25, null=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('fetched_at', models.DateTimeField()),
+                ('usage_changed_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('plan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='usage_snapshot', to='esim.esimplan')),
+            ],
+        ),
+    ]
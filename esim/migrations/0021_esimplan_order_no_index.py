@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0020_usagesnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='esimplan',
+            name='order_no',
+            field=models.CharField(blank=True, db_index=True, default=None, max_length=25, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0021_esimplan_order_no_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagesnapshot',
+            name='pushed_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0017_payment_mpgs_order_amount_and_more'),
+        ('esim', '0022_usagesnapshot_pushed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisioningJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_after', models.DateTimeField(db_index=True)),
+                ('leased_until', models.DateTimeField(blank=True, default=None, null=True)),
+                ('leased_by', models.CharField(blank=True, default='', max_length=100)),
+                ('order_no', models.CharField(blank=True, default=None, max_length=25, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='provisioning_job', to='billing.payment')),
+            ],
+        ),
+    ]
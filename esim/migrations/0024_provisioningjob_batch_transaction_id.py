@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0023_provisioningjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisioningjob',
+            name='batch_transaction_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0024_provisioningjob_batch_transaction_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisioningjob',
+            name='batch_packages',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esim', '0025_provisioningjob_batch_packages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='esimplan',
+            name='usage_poll_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='esimplan',
+            name='usage_poll_retry_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
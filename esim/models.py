@@ -22,11 +22,84 @@ class eSIMPlan(models.Model):
     esim_status = models.CharField(max_length=25, default='PAID')
     smdp_status = models.CharField(max_length=25, default='RELEASED')
     seller = models.CharField(max_length=25, default='esimaccess')
-    order_no = models.CharField(max_length=25, default=None, blank=True, null=True)
+    order_no = models.CharField(max_length=25, default=None, blank=True, null=True, db_index=True)
     location_code = models.CharField(max_length=25, default=None, blank=True, null=True)
     date_created = models.DateTimeField(auto_now_add=True)
     activated_on = models.DateTimeField(default=None, blank=True, null=True)
     expires_on = models.DateTimeField()
+    usage_poll_failures = models.IntegerField(default=0)  # Consecutive polls that returned no usage
+    usage_poll_retry_at = models.DateTimeField(default=None, blank=True, null=True)  # Poller backoff after a failed poll
+
+    def __str__(self):
+        return f"eSIM Plan {self.name} ({self.esim_status})"
+
+class CatalogueSnapshot(models.Model):
+    """Last good copy of a provider catalogue, shared by every worker process."""
+    provider = models.CharField(max_length=25)
+    scope = models.CharField(max_length=50, default='', blank=True)  # Upstream filter the snapshot was fetched with
+    payload = models.JSONField(default=list)
+    item_count = models.IntegerField(default=0)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('provider', 'scope')
+
+    def __str__(self):
+        return f"{self.provider} catalogue [{self.scope or 'all'}] ({self.item_count} items)"
+
+
+class UsageSnapshot(models.Model):
+    """Last usage eSIMAccess reported for one purchased eSIM, kept current by webhooks and the usage poller."""
+    plan = models.OneToOneField(eSIMPlan, on_delete=models.CASCADE, related_name='usage_snapshot')
+    order_no = models.CharField(max_length=25, db_index=True)
+    iccid = models.CharField(max_length=50, default=None, blank=True, null=True, db_index=True)
+    order_usage = models.BigIntegerField(default=0)  # In Bytes
+    total_volume = models.BigIntegerField(default=0)  # In Bytes
+    total_duration = models.IntegerField(default=0)  # In days
+    activate_time = models.DateTimeField(default=None, blank=True, null=True)
+    expired_time = models.DateTimeField(default=None, blank=True, null=True)
+    esim_status = models.CharField(max_length=25, default=None, blank=True, null=True)
+    smdp_status = models.CharField(max_length=25, default=None, blank=True, null=True)
+    payload = models.JSONField(default=dict)  # The esimList entry as returned by eSIMAccess
+    fetched_at = models.DateTimeField()
+    usage_changed_at = models.DateTimeField(default=None, blank=True, null=True)
+    pushed_at = models.DateTimeField(default=None, blank=True, null=True)  # Last change applied from an eSIMAccess webhook
+
+    def __str__(self):
+        return f"Usage of {self.iccid or self.order_no} at {self.fetched_at:%Y-%m-%d %H:%M}"
+
+
+class ProvisioningJob(models.Model):
+    """eSIM order for a completed payment, processed by the `run_provisioning_worker` command."""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='provisioning_job')
+    transaction_id = models.CharField(max_length=64, unique=True)  # Sent to eSIMAccess as transactionId
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(db_index=True)  # Not leased before this time (retry backoff)
+    leased_until = models.DateTimeField(default=None, blank=True, null=True)
+    leased_by = models.CharField(max_length=100, default='', blank=True)
+    order_no = models.CharField(max_length=25, default=None, blank=True, null=True)
+    batch_transaction_id = models.CharField(max_length=64, default='', blank=True)  # transactionId of a batched order
+    batch_packages = models.JSONField(default=list, blank=True)  # packageInfoList sent under batch_transaction_id
+    last_error = models.TextField(default='', blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Provisioning {self.transaction_id} ({self.status}, {self.attempts} attempts)"
+
+
+class WebhookDelivery(models.Model):
+    """RT-RequestID of an applied eSIMAccess webhook, so redeliveries to any worker are applied once."""
+    request_id = models.CharField(max_length=64, unique=True)
+    received_at = models.DateTimeField(db_index=True)
 
     def __str__(self):
-        return f"eSIM Plan {self.name} ({self.esim_status})"
\ No newline at end of file
+        return f"Webhook {self.request_id} at {self.received_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,54 @@
+"""
+Keyset pagination for the user plans list.
+
+Pages are ordered newest first by ``(date_created, id)`` and continue from
+the last row of the previous page, so page N costs the same as page 1 and
+rows inserted while a client is paging do not shift later pages. Clients
+that ignore the cursor still get the newest plans. The cursor is an opaque
+URL-safe token carrying that last ``(date_created, id)`` pair.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not produced by ``encode_cursor``."""
+
+
+def encode_cursor(plan):
+    raw = json.dumps([plan.date_created.isoformat(), plan.pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the ``(date_created, id)`` pair encoded in ``cursor``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date_created, pk = json.loads(raw)
+        date_created = parse_datetime(date_created)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if date_created is None or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return date_created, pk
+
+
+def keyset_page(queryset, cursor=None, page_size=20):
+    """
+    Return ``(rows, next_cursor)`` for one page of ``queryset``.
+
+    One extra row is fetched to tell whether another page follows;
+    ``next_cursor`` is None on the last page.
+    """
+    queryset = queryset.order_by("-date_created", "-id")
+    if cursor:
+        date_created, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date_created__lt=date_created) | Q(date_created=date_created, id__lt=pk))
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1])
@@ -0,0 +1,45 @@
+"""
+Plan resolution for payments and provisioning.
+
+Payment creation used to ask the vendor for a plan just to read its name,
+and provisioning asked again before ordering. ``resolve_plan`` answers from
+the local catalogue store (every snapshot of the seller, no vendor call)
+and only on a miss makes one targeted call: eSIMAccess ``package/list`` for
+that package code, or the eSIMGo bundle lookup. Only snapshots younger than
+the catalogue TTL answer, since the price resolved here is the one the
+vendor order is later placed at. Payments freeze the result
+in ``Payment.plan_details`` at creation, so provisioning orders from it
+without any catalogue call.
+"""
+from .catalogue import ESIMACCESS, ESIMGO, store
+from .utils import fetch_esim_plan_details
+
+
+def seller_provider(seller):
+    """The catalogue provider for a payment's ``seller`` (eSIMAccess unless it is eSIMGo)."""
+    return ESIMGO if (seller or "").lower() == ESIMGO else ESIMACCESS
+
+
+def resolve_plan(code, seller=None):
+    """
+    Return the plan (eSIMAccess package or eSIMGo bundle) for ``code``, or None if unknown or unreachable.
+    """
+    provider = seller_provider(seller)
+    item, _ = store.find(provider, code, max_age=store.ttl)
+    if item is not None:
+        return dict(item)
+
+    details = fetch_esim_plan_details(code, provider)
+    if not details or provider == ESIMGO:
+        return details
+    if details.get("success") is False:
+        return None
+    packages = (details.get("obj") or {}).get("packageList") or []
+    return packages[0] if packages else None
+
+
+def plan_name(plan, seller=None):
+    """The display name stored as ``Payment.esim_plan``."""
+    if seller_provider(seller) == ESIMGO:
+        return plan.get("description")
+    return plan.get("name")
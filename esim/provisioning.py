@@ -0,0 +1,392 @@
+"""
+Durable eSIM provisioning.
+
+Provisioning used to run inside ``Payment.save()``: the post_save signal
+fetched plan details and ordered the profile from eSIMAccess before the
+payment endpoint could answer. Now the signal only enqueues a
+``ProvisioningJob`` and the ``run_provisioning_worker`` command does the
+vendor calls:
+
+- Jobs are leased with ``SELECT ... FOR UPDATE SKIP LOCKED``, so several
+  workers can run side by side without taking the same job; a lease that
+  expires (crashed worker) makes the job available again.
+- Failures are retried with exponential backoff and jitter up to
+  ``ESIM_PROVISIONING_MAX_ATTEMPTS``; errors that retrying cannot fix fail
+  the job at once.
+- Each payment gets one job, keyed by the ``transactionId`` sent to
+  eSIMAccess, and the ``orderNo`` is stored on the job as soon as it is
+  known, so a retry never orders a second profile.
+
+Plans are ordered from ``Payment.plan_details``, frozen when the payment
+was created, so a job makes no catalogue call.
+
+With ``ESIM_PROVISIONING_BATCH_SIZE`` above 1 the worker orders in batches:
+jobs are held for ``ESIM_PROVISIONING_BATCH_WINDOW_SECONDS`` and each
+user's payments completed in that window (a reseller buying several eSIMs
+at once) go out as one order whose ``packageInfoList`` has an entry per
+package. The order's profiles are then queried once and split back to the
+plans by package (see ``usage.match_profiles``); profiles eSIMAccess has not
+allocated yet are assigned by the next usage refresh.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import ProvisioningJob, eSIMPlan
+from .plans import resolve_plan
+from .usage import persist_plan_usage, refresh_usage, store_snapshots
+from .utils import calculate_expiry_date, order_esim_profile, order_esim_profiles
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningError(Exception):
+    """A provisioning attempt failed; the job is retried."""
+
+
+class PermanentProvisioningError(ProvisioningError):
+    """A provisioning attempt failed in a way retrying cannot fix; the job fails at once."""
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def batch_size():
+    """Most payments ordered together; 1 orders each payment on its own."""
+    return max(1, getattr(settings, "ESIM_PROVISIONING_BATCH_SIZE", 1))
+
+
+def enqueue_provisioning(payment):
+    """Create the payment's provisioning job unless it exists. Returns ``(job, created)``."""
+    run_after = now()
+    if batch_size() > 1:
+        # Held back so payments completed shortly after can share its order.
+        run_after += timedelta(seconds=getattr(settings, "ESIM_PROVISIONING_BATCH_WINDOW_SECONDS", 10))
+    return ProvisioningJob.objects.get_or_create(
+        transaction_id=str(payment.ref_id),
+        defaults={"payment": payment, "run_after": run_after},
+    )
+
+
+def backoff_seconds(attempts):
+    """Delay before retry number ``attempts``: exponential, capped, with full jitter."""
+    base = getattr(settings, "ESIM_PROVISIONING_BACKOFF_SECONDS", 30)
+    cap = getattr(settings, "ESIM_PROVISIONING_BACKOFF_MAX_SECONDS", 3600)
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+def lease_jobs(limit, lease_seconds=None, owner=None, fill=False):
+    """
+    Lease up to ``limit`` due jobs for this worker and return them.
+
+    Due jobs are pending ones whose ``run_after`` has passed and running
+    ones whose lease expired. With ``fill``, once a job is due the batch is
+    topped up with new jobs still in their batching window. Leasing counts
+    as an attempt.
+    """
+    lease_seconds = lease_seconds or getattr(settings, "ESIM_PROVISIONING_LEASE_SECONDS", 300)
+    owner = owner or worker_id()
+    at = now()
+    due = Q(status="PENDING", run_after__lte=at) | Q(status="RUNNING", leased_until__lt=at)
+    with transaction.atomic():
+        jobs = list(
+            ProvisioningJob.objects
+            .select_related("payment")
+            .select_for_update(skip_locked=True, of=("self",))
+            .filter((due | Q(status="PENDING", attempts=0)) if fill else due)
+            .order_by("run_after", "id")[:limit]
+        )
+        # Due jobs sort first, so if the first is still in its window none is due.
+        if jobs and jobs[0].status == "PENDING" and jobs[0].run_after > at:
+            return []
+        for job in jobs:
+            job.status = "RUNNING"
+            job.attempts += 1
+            job.leased_until = at + timedelta(seconds=lease_seconds)
+            job.leased_by = owner
+        ProvisioningJob.objects.bulk_update(jobs, ["status", "attempts", "leased_until", "leased_by"])
+    return jobs
+
+
+def _plan_details(payment):
+    # Frozen at payment creation; only payments created before that was
+    # introduced still need resolving.
+    plan_details = payment.plan_details or resolve_plan(payment.package_code, payment.seller)
+    if not plan_details:
+        raise ProvisioningError(f"Failed to resolve plan details for {payment.package_code}.")
+    if "packageCode" not in plan_details:
+        raise PermanentProvisioningError(f"{payment.package_code} is not an eSIMAccess package.")
+    return plan_details
+
+
+def _prepare(job):
+    # (existing plan, None) when the job already provisioned, else (None, plan details).
+    payment = job.payment
+    if payment.status != "COMPLETED":
+        raise PermanentProvisioningError(f"Payment {payment.ref_id} is {payment.status}.")
+    if payment.user_id is None:
+        raise PermanentProvisioningError(f"Payment {payment.ref_id} has no user.")
+
+    existing_plan = eSIMPlan.objects.filter(payment=payment).first()
+    if existing_plan:
+        return existing_plan, None
+    return None, _plan_details(payment)
+
+
+def provision(job):
+    """Order the eSIM for ``job`` and create its ``eSIMPlan``; raises ``ProvisioningError`` on failure."""
+    existing_plan, plan_details = _prepare(job)
+    if existing_plan:
+        return existing_plan
+
+    payment = job.payment
+    if not job.order_no:
+        order_no = order_esim_profile(payment.package_code, job.transaction_id, plan_details["price"])
+        if not order_no:
+            raise ProvisioningError("Failed to create eSIM order (orderNo missing).")
+        # Stored before anything else can fail, so retries skip the order.
+        job.order_no = order_no
+        job.save(update_fields=["order_no", "date_updated"])
+
+    return _create_plan(job, plan_details)
+
+
+def _create_plan(job, plan_details):
+    payment = job.payment
+    return eSIMPlan.objects.create(
+        user_id=payment.user_id,
+        payment=payment,
+        order_no=job.order_no,
+        location_code=plan_details['locationNetworkList'][0]['locationCode'],
+        name=plan_details['name'],
+        package_code=payment.package_code,
+        slug=plan_details['slug'],
+        currency_code=plan_details['currencyCode'],
+        speed=plan_details['speed'],
+        description=plan_details['description'],
+        price=plan_details['price'],
+        volume=plan_details['volume'],
+        duration=plan_details['duration'],
+        duration_unit=plan_details['durationUnit'],
+        support_top_up_type=plan_details['supportTopUpType'],
+        expires_on=calculate_expiry_date(plan_details['duration']),
+        seller=payment.seller,
+        esim_status='PAID'
+    )
+
+
+def _record(job, plan=None, error=None, retry_at=None):
+    # Save the outcome of one attempt; ``retry_at`` overrides the retry backoff.
+    if error is not None:
+        max_attempts = getattr(settings, "ESIM_PROVISIONING_MAX_ATTEMPTS", 8)
+        permanent = isinstance(error, PermanentProvisioningError)
+        job.last_error = str(error) or error.__class__.__name__
+        job.leased_until = None
+        if permanent or job.attempts >= max_attempts:
+            job.status = "FAILED"
+            logger.error("Provisioning %s failed after %s attempts: %s", job.transaction_id, job.attempts, error)
+        else:
+            job.status = "PENDING"
+            job.run_after = retry_at or now() + timedelta(seconds=backoff_seconds(job.attempts))
+            logger.warning("Provisioning %s attempt %s failed: %s", job.transaction_id, job.attempts, error)
+    else:
+        job.status = "SUCCEEDED"
+        job.order_no = plan.order_no
+        job.leased_until = None
+        job.last_error = ""
+        logger.info("Provisioned eSIM order %s for payment %s", plan.order_no, job.transaction_id)
+    job.save(update_fields=["status", "order_no", "leased_until", "last_error", "run_after", "date_updated"])
+    return job.status
+
+
+def run_job(job):
+    """Run one leased job and record its outcome. Returns the job's new status."""
+    try:
+        plan = provision(job)
+    except Exception as e:
+        return _record(job, error=e)
+    return _record(job, plan=plan)
+
+
+def package_info_list(jobs, plan_details):
+    """The ``packageInfoList`` ordering one profile per job, one entry per package and price."""
+    packages = {}
+    for job in jobs:
+        key = (job.payment.package_code, plan_details[job.pk]["price"])
+        entry = packages.setdefault(key, {"packageCode": key[0], "count": 0, "price": key[1]})
+        entry["count"] += 1
+    return list(packages.values())
+
+
+def order_batch(jobs, plan_details):
+    """
+    Order one profile per job in a single request and store the orderNo on each job.
+
+    A lone new job is ordered under its own ``transaction_id``. Otherwise the
+    jobs share a batch ``transactionId``, stored with its ``packageInfoList``
+    before the request so a retry of the same jobs sends both again and
+    eSIMAccess cannot fill it twice. A retry whose list changed (a job of
+    the batch failed or was leased apart) gets a new ``transactionId``: the
+    old one must never name a different order.
+    """
+    packages = package_info_list(jobs, plan_details)
+    if len(jobs) == 1 and not jobs[0].batch_transaction_id:
+        transaction_id = jobs[0].transaction_id
+    else:
+        transaction_id = next((job.batch_transaction_id for job in jobs if job.batch_transaction_id), None)
+        if transaction_id is not None and any(job.batch_packages != packages for job in jobs):
+            logger.warning("Batch %s changed since it was first ordered; ordering it under a new transactionId", transaction_id)
+            transaction_id = None
+        if transaction_id is None:
+            transaction_id = f"batch-{uuid.uuid4().hex}"
+            for job in jobs:
+                job.batch_transaction_id = transaction_id
+                job.batch_packages = packages
+            ProvisioningJob.objects.bulk_update(jobs, ["batch_transaction_id", "batch_packages"])
+
+    order_no = order_esim_profiles(transaction_id, packages)
+    if not order_no:
+        raise ProvisioningError("Failed to create eSIM order (orderNo missing).")
+    for job in jobs:
+        job.order_no = order_no
+    ProvisioningJob.objects.bulk_update(jobs, ["order_no"])
+    return order_no
+
+
+def assign_profiles(order_nos):
+    """
+    Query each shared order once and give its plans their ICCIDs, matched by package.
+
+    Profiles eSIMAccess has not allocated yet are left for the next usage refresh.
+    """
+    plans = list(eSIMPlan.objects.filter(order_no__in=order_nos).select_related("usage_snapshot"))
+    try:
+        usage = refresh_usage(plans)
+        persist_plan_usage(plans, usage)
+        store_snapshots(plans, usage)
+    except Exception as e:
+        logger.warning("Assigning profiles of orders %s failed: %s", ", ".join(sorted(order_nos)), e)
+
+
+def run_batch(jobs):
+    """
+    Provision leased ``jobs`` with one order and record each outcome. Returns their new statuses.
+
+    Jobs already provisioned or ordered skip the order; the rest are ordered
+    together. A failed order retries all of them at the same time so they are
+    leased, and ordered, together again.
+    """
+    plans, details, errors = {}, {}, {}
+    retry_at = None
+    for job in jobs:
+        try:
+            existing_plan, plan_details = _prepare(job)
+        except Exception as e:
+            errors[job.pk] = e
+            continue
+        if existing_plan:
+            plans[job.pk] = existing_plan
+        else:
+            details[job.pk] = plan_details
+
+    to_order = [job for job in jobs if job.pk in details and not job.order_no]
+    if to_order:
+        try:
+            order_batch(to_order, details)
+        except Exception as e:
+            retry_at = now() + timedelta(seconds=backoff_seconds(max(job.attempts for job in to_order)))
+            for job in to_order:
+                errors[job.pk] = e
+
+    shared_orders = set()
+    for job in jobs:
+        if job.pk not in details or job.pk in errors:
+            continue
+        try:
+            plans[job.pk] = _create_plan(job, details[job.pk])
+        except Exception as e:
+            errors[job.pk] = e
+            continue
+        if job.batch_transaction_id:
+            shared_orders.add(job.order_no)
+    if shared_orders:
+        assign_profiles(shared_orders)
+
+    statuses = []
+    for job in jobs:
+        if job.pk in errors:
+            statuses.append(_record(job, error=errors[job.pk], retry_at=retry_at if job in to_order else None))
+        else:
+            statuses.append(_record(job, plan=plans[job.pk]))
+    return statuses
+
+
+def _batches(jobs, size):
+    # Jobs of an earlier batch order stay together; new jobs are grouped by
+    # user and split into runs of ``size``. An order is only ever shared by
+    # one customer's eSIMs: its profiles are looked up by orderNo.
+    by_batch = {}
+    by_user = {}
+    for job in jobs:
+        if job.batch_transaction_id:
+            by_batch.setdefault(job.batch_transaction_id, []).append(job)
+        else:
+            by_user.setdefault(job.payment.user_id, []).append(job)
+    batches = list(by_batch.values())
+    for new in by_user.values():
+        batches += [new[i:i + size] for i in range(0, len(new), size)]
+    return batches
+
+
+def _run_one(batch):
+    return [run_job(batch[0])]
+
+
+def _run_in_thread(run, batch):
+    try:
+        return run(batch)
+    finally:
+        close_old_connections()
+
+
+def process_jobs(concurrency=None, size=None):
+    """
+    Lease and run one round of jobs, ``concurrency`` orders in parallel.
+
+    With a batch ``size`` above 1 (default ``ESIM_PROVISIONING_BATCH_SIZE``)
+    each order covers up to ``size`` jobs. Returns ``{status: count}`` for
+    the jobs run.
+    """
+    concurrency = concurrency or getattr(settings, "ESIM_PROVISIONING_CONCURRENCY", 4)
+    size = size or batch_size()
+    if size > 1:
+        batches = _batches(lease_jobs(concurrency * size, fill=True), size)
+        run = run_batch
+    else:
+        batches = [[job] for job in lease_jobs(concurrency)]
+        run = _run_one
+    if not batches:
+        return {}
+    if len(batches) == 1:
+        results = [run(batches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="esim-provisioning") as executor:
+            results = list(executor.map(partial(_run_in_thread, run), batches))
+    counts = {}
+    for statuses in results:
+        for job_status in statuses:
+            counts[job_status] = counts.get(job_status, 0) + 1
+    return counts
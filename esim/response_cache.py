@@ -0,0 +1,97 @@
+"""
+Rendered JSON cache for the plans endpoint.
+
+Storefront traffic concentrates on a handful of ``locationCode`` values, so
+the final encoded response for each normalized filter set is kept as bytes.
+A hit skips filtering, DRF serialization and rendering entirely. Entries
+expire with the snapshots they were built from, and the whole cache is
+dropped whenever the catalogue store swaps in a new snapshot.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .catalogue import store as catalogue_store
+
+
+def cache_key(filters, **extra):
+    """Stable key for a filter set; empty values are treated as absent."""
+    items = {key: value for key, value in {**filters, **extra}.items() if value not in (None, "")}
+    return json.dumps(items, sort_keys=True, default=str)
+
+
+class ResponseCache:
+    """Thread-safe LRU of encoded responses bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (body, expires_at)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, "ESIM_PLANS_RESPONSE_CACHE_MAX_ENTRIES", 256)
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, "ESIM_PLANS_RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, body, ttl):
+        if ttl <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (body, time.monotonic() + ttl)
+            self._size += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        body, _ = self._entries.pop(key)
+        self._size -= len(body)
+
+    def clear(self, *args):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+plans_cache = ResponseCache()
+catalogue_store.add_listener(plans_cache.clear)
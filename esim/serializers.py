@@ -117,8 +117,35 @@ class eSIMPlanCollectionSerializer(serializers.Serializer):
     )
 
 
+class ProviderStatusSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=["ok", "error", "timeout", "unavailable"])
+    source = serializers.CharField(
+        allow_null=True,
+        help_text="snapshot, vendor, live or stale; null when nothing could be served.",
+    )
+    latency_ms = serializers.FloatField()
+    age = serializers.FloatField(allow_null=True, help_text="Seconds since the served data was fetched.")
+
+
 class eSIMPlanListResponseSerializer(eSIMBaseResponseSerializer):
     data = eSIMPlanCollectionSerializer(required=False)
+    providers = serializers.DictField(child=ProviderStatusSerializer(), required=False)
+
+
+class eSIMPlanBatchSerializer(serializers.Serializer):
+    packages = serializers.DictField(
+        child=serializers.JSONField(allow_null=True),
+        help_text="eSIMAccess packages keyed by packageCode; null when the code is unknown.",
+    )
+    bundles = serializers.DictField(
+        child=serializers.JSONField(allow_null=True),
+        help_text="eSIMGo bundles keyed by bundle name; null when the name is unknown.",
+    )
+
+
+class eSIMPlanBatchResponseSerializer(eSIMBaseResponseSerializer):
+    data = eSIMPlanBatchSerializer(required=False)
+    providers = serializers.DictField(child=ProviderStatusSerializer(), required=False)
 
 
 class ESIMGoPlanDetailResponseSerializer(eSIMBaseResponseSerializer):
@@ -136,6 +163,7 @@ class eSIMProfileResponseSerializer(eSIMBaseResponseSerializer):
 class eSIMUserPlanSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     order_no = serializers.CharField(allow_blank=True, allow_null=True)
+    iccid = serializers.CharField(allow_blank=True, allow_null=True, required=False)
     name = serializers.CharField(allow_blank=True, allow_null=True)
     slug = serializers.CharField(allow_blank=True, allow_null=True)
     package_code = serializers.CharField()
@@ -158,16 +186,41 @@ class eSIMUserPlanSerializer(serializers.Serializer):
     usageScale = serializers.FloatField(required=False, allow_null=True)
     durationLeft = serializers.CharField(required=False, allow_null=True, allow_blank=True)
     formattedVolumeLeft = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    usageFetchedAt = serializers.DateTimeField(
+        required=False, allow_null=True, help_text="When eSIMAccess last reported this usage."
+    )
+    usageAge = serializers.IntegerField(
+        required=False, allow_null=True, help_text="Seconds since the usage was fetched; null if never."
+    )
+
+
+class eSIMUserPlanPaginationSerializer(serializers.Serializer):
+    next_cursor = serializers.CharField(allow_null=True)
+    page_size = serializers.IntegerField()
 
 
 class eSIMUserPlanListResponseSerializer(eSIMBaseResponseSerializer):
     data = eSIMUserPlanSerializer(many=True, required=False)
+    pagination = eSIMUserPlanPaginationSerializer(required=False)
 
 
 class eSIMUserPlanResponseSerializer(eSIMBaseResponseSerializer):
     data = eSIMPlanSerializer(required=False)
 
 
+class eSIMUsageChangesSerializer(serializers.Serializer):
+    version = serializers.CharField(help_text="Pass back as `version` to wait for the next change.")
+    plans = serializers.DictField(
+        child=serializers.JSONField(),
+        help_text="Dashboard fields of every plan, by plan id.",
+    )
+    retryAfter = serializers.FloatField(help_text="Seconds to wait before polling again.")
+
+
+class eSIMUsageChangesResponseSerializer(eSIMBaseResponseSerializer):
+    data = eSIMUsageChangesSerializer(required=False)
+
+
 class CountrySerializer(serializers.Serializer):
     alpha_2 = serializers.CharField()
     name = serializers.CharField()
@@ -0,0 +1,171 @@
+"""
+Request coalescing for vendor calls.
+
+When a popular page spikes, every worker thread used to send the same
+upstream request. ``SingleFlight.do`` lets the first caller for a key run the
+call while concurrent callers with the same key wait for and share its
+result, so vendor traffic grows with distinct keys instead of request rate.
+
+Within a process this is a per-key event. ``ESIM_SINGLEFLIGHT_BACKEND`` can
+additionally serialise the call across workers with a lock file ("file") or
+a PostgreSQL advisory lock ("db"); the caller's ``recheck`` then gets a chance
+to adopt what the previous lock holder stored before calling the vendor again.
+
+``AsyncSingleFlight`` coalesces coroutines the same way within an event loop.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process coalescing only.
+    fcntl = None
+
+
+def _digest(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+@contextmanager
+def _file_lock(key):
+    directory = getattr(settings, "ESIM_SINGLEFLIGHT_LOCK_DIR", "") or tempfile.gettempdir()
+    path = os.path.join(directory, f"esim-vendor-{_digest(key)}.lock")
+    with open(path, "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _advisory_lock(key):
+    # pg_advisory_lock takes a signed 64-bit key.
+    lock_id = int(_digest(key)[:16], 16) - 2 ** 63
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id])
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+
+
+def backend():
+    """The cross-worker backend in effect: "thread", "file" or "db"."""
+    name = getattr(settings, "ESIM_SINGLEFLIGHT_BACKEND", "thread")
+    if name == "file" and fcntl is not None:
+        return "file"
+    if name == "db" and connection.vendor == "postgresql":
+        return "db"
+    return "thread"
+
+
+@contextmanager
+def worker_lock(key):
+    """Hold the cross-worker lock for ``key``, or nothing with the thread backend."""
+    name = backend()
+    if name == "file":
+        with _file_lock(key):
+            yield
+    elif name == "db":
+        with _advisory_lock(key):
+            yield
+    else:
+        yield
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time and share its outcome with concurrent callers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, recheck=None):
+        """
+        Return ``fn()``, or the result of an identical call already in flight.
+
+        Exceptions raised by the leading call are re-raised in every caller
+        that waited for it. ``recheck`` is only consulted once the cross-worker
+        lock is held; a non-None return value is used instead of calling ``fn``.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with worker_lock(key):
+                result = None
+                if recheck is not None and backend() != "thread":
+                    result = recheck()
+                if result is None:
+                    result = fn()
+            call.result = result
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines: concurrent awaiters of one key on an event loop share one call."""
+
+    def __init__(self):
+        self._tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """Await ``fn()`` unless a call for ``key`` is already running on this loop; then await its result."""
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get((loop, key))
+        if task is None:
+            self.calls += 1
+            task = self._tasks[(loop, key)] = loop.create_task(fn())
+            task.add_done_callback(lambda _: self._tasks.pop((loop, key), None))
+        else:
+            self.shared += 1
+        # Shielded so one cancelled waiter does not cancel the call for the others.
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._tasks)}
+
+
+vendor_flights = SingleFlight()
+async_vendor_flights = AsyncSingleFlight()
@@ -0,0 +1,126 @@
+"""
+Server-Sent Events stream of a user's plan usage.
+
+The esims dashboard used to reload ``/api/esim/user/plans/`` to see new
+usage. ``usage_events`` instead reads the user's plans and their usage
+snapshots (kept current by webhooks and the poller; never the vendor)
+every ``ESIM_USAGE_STREAM_INTERVAL_SECONDS`` and emits only what changed:
+
+- ``snapshot``: the dashboard fields of every plan, sent once on connect;
+- ``usage``: ``{plan id: {changed fields}}`` whenever something changed;
+  removed plans map to ``null``.
+
+Idle connections get a comment line every ``ESIM_USAGE_STREAM_HEARTBEAT_SECONDS``
+so proxies keep them open. A stream ends after ``ESIM_USAGE_STREAM_MAX_SECONDS``
+and ``EventSource`` reconnects (getting a fresh ``snapshot``). The loop is
+async, so under ASGI an open stream holds no worker thread.
+
+Under WSGI Django buffers an async stream whole, so the stream is only
+routed with ``ESIM_ASYNC_VIEWS``. The dashboard otherwise polls
+``wait_for_changes`` every ``ESIM_USAGE_POLL_AFTER_SECONDS``. Each request
+answers at once by default; ``ESIM_USAGE_LONG_POLL_SECONDS`` lets it wait
+for a change instead, but a waiting request holds a WSGI worker, so only
+raise it with a worker per open dashboard to spare.
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .metrics import compute_plan_metrics
+from .models import eSIMPlan
+from .usage import dashboard_fields, usage_record
+
+
+# Plan fields streamed alongside the derived usage fields.
+PLAN_FIELDS = ("volume_used", "esim_status", "smdp_status", "activated_on", "expires_on")
+
+
+def plan_states(plans):
+    """``{plan id: dashboard fields}`` from each plan's stored usage snapshot."""
+    snapshots = [getattr(plan, "usage_snapshot", None) for plan in plans]
+    metrics = compute_plan_metrics(usage_record(plan, snapshot) for plan, snapshot in zip(plans, snapshots))
+    states = {}
+    for plan, snapshot, plan_metrics in zip(plans, snapshots, metrics):
+        state = {field: getattr(plan, field) for field in PLAN_FIELDS}
+        state.update(dashboard_fields(plan_metrics))
+        state["usageFetchedAt"] = snapshot.fetched_at if snapshot is not None else None
+        # Round-trip through JSON so states compare the way clients see them.
+        states[str(plan.pk)] = json.loads(json.dumps(state, cls=DjangoJSONEncoder))
+    return states
+
+
+def diff_states(previous, current):
+    """The fields of ``current`` that differ from ``previous``; plans gone from ``current`` map to None."""
+    delta = {}
+    for plan_id, state in current.items():
+        before = previous.get(plan_id, {})
+        changed = {field: value for field, value in state.items() if before.get(field, object()) != value}
+        if changed:
+            delta[plan_id] = changed
+    for plan_id in previous.keys() - current.keys():
+        delta[plan_id] = None
+    return delta
+
+
+def format_event(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, cls=DjangoJSONEncoder)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+def user_plans(user_id):
+    return eSIMPlan.objects.filter(user_id=user_id).select_related("usage_snapshot").order_by("date_created", "id")
+
+
+async def load_states(user_id):
+    return plan_states([plan async for plan in user_plans(user_id)])
+
+
+def states_version(states):
+    """A short fingerprint of ``states``, echoed back by long-polling clients."""
+    return hashlib.sha1(json.dumps(states, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def wait_for_changes(user_id, version=None, timeout=None, interval=None):
+    """
+    Return ``(states, version)`` for ``user_id``'s plans as soon as they
+    differ from ``version``, or as they are after ``timeout`` seconds.
+    """
+    timeout = timeout if timeout is not None else getattr(settings, "ESIM_USAGE_LONG_POLL_SECONDS", 0)
+    interval = interval if interval is not None else getattr(settings, "ESIM_USAGE_STREAM_INTERVAL_SECONDS", 5)
+    deadline = time.monotonic() + timeout
+    while True:
+        states = plan_states(list(user_plans(user_id)))
+        current = states_version(states)
+        if current != version or time.monotonic() + interval > deadline:
+            return states, current
+        time.sleep(interval)
+
+
+async def usage_events(user_id, interval=None, heartbeat=None, max_seconds=None):
+    """Yield SSE messages for ``user_id``'s plans until ``max_seconds`` have passed."""
+    interval = interval if interval is not None else getattr(settings, "ESIM_USAGE_STREAM_INTERVAL_SECONDS", 5)
+    heartbeat = heartbeat if heartbeat is not None else getattr(settings, "ESIM_USAGE_STREAM_HEARTBEAT_SECONDS", 15)
+    max_seconds = max_seconds if max_seconds is not None else getattr(settings, "ESIM_USAGE_STREAM_MAX_SECONDS", 300)
+
+    started = last_sent = time.monotonic()
+    states = await load_states(user_id)
+    event_id = 1
+    yield f"retry: {int(interval * 1000)}\n" + format_event("snapshot", states, event_id)
+
+    while time.monotonic() - started < max_seconds:
+        await asyncio.sleep(interval)
+        current = await load_states(user_id)
+        delta = diff_states(states, current)
+        states = current
+        if delta:
+            event_id += 1
+            last_sent = time.monotonic()
+            yield format_event("usage", delta, event_id)
+        elif time.monotonic() - last_sent >= heartbeat:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
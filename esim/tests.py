@@ -1,3 +1,1675 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
 
-# Create your tests here.
+import asyncio
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from unittest.mock import AsyncMock, MagicMock, patch
+from rest_framework.test import APIClient
+
+from esim.catalogue import (
+    ESIMACCESS, ESIMGO, CatalogueStore, _warm_bundle_cache, build_snapshot, fetch_esimaccess_packages,
+    filter_esimaccess_packages, filter_esimgo_bundles,
+)
+from esim.bundle_cache import BundleCache
+from esim.circuit import CircuitBreaker, CircuitOpenError
+from esim.catalogue_index import ESIMAccessIndex, ESIMGoIndex
+from esim.esimgo import ESIMGoCatalogueQuery, fetch_esimgo_bundle, iter_esimgo_bundles
+from esim.metrics import UsageRecord, compute_plan_metrics, numpy_available
+from esim.usage import UsageRejectedError, current_snapshot, persist_plan_usage, plans_due_for_poll, poll_usage
+from esim.utils import fetch_esim_plan_details
+from billing.models import Payment
+from magic_esim.async_views import routed_view
+from magic_esim.vendor_stubs import ESIMGoStub, VendorStubs, esimaccess_packages
+from magic_esim.vendors import AsyncVendorClient, VendorClient, vendor_metrics
+from esim.models import CatalogueSnapshot, ProvisioningJob, UsageSnapshot, WebhookDelivery, eSIMPlan
+from esim.plans import resolve_plan
+from esim.provisioning import _batches, lease_jobs, process_jobs
+from esim.response_cache import ResponseCache, cache_key
+from esim.singleflight import SingleFlight
+from esim.views import (
+    ESIMGoPlanDetailAsyncView,
+    ESIMGoPlanDetailView,
+    eSIMPlanListAsyncView,
+    eSIMPlanListCreateAsyncView,
+    eSIMProfileAsyncView,
+    eSIMUsageStreamView,
+    plan_list_filters,
+)
+from esim.streams import diff_states, usage_events, wait_for_changes
+from esim.webhooks import apply_notifications, claim_delivery, sign
+
+
+ESIMACCESS_PACKAGES = [
+    {"packageCode": "CKH491", "slug": "NG_3_30", "price": 57000, "volume": 3 * 1024 ** 3},
+    {"packageCode": "CKH001", "slug": "NG_1_7", "price": 18000, "volume": 1024 ** 3},
+    {"packageCode": "CKH002", "slug": "NG_1_End", "price": 9000, "volume": 500 * 1024 ** 2},
+    {"packageCode": "CKH777", "slug": "US_5_30", "price": 45000, "volume": 5 * 1024 ** 3},
+]
+
+ESIMGO_BUNDLES = [
+    {
+        "name": "esim_ULE_1D_NG_V2",
+        "description": "eSIM, Unlimited Essential, 1 Day, Nigeria, V2",
+        "countries": [{"name": "Nigeria", "region": "Africa", "iso": "NG"}],
+        "dataAmount": -1,
+        "unlimited": True,
+        "price": 4.5,
+    },
+    {
+        "name": "esim_1GB_7D_US_V2",
+        "description": "eSIM, 1GB, 7 Days, United States, V2",
+        "countries": [{"name": "United States", "region": "North America", "iso": "US"}],
+        "dataAmount": 1000,
+        "unlimited": False,
+        "price": 2.0,
+    },
+]
+
+
+def _create_plan(user, payment, **fields):
+    values = {
+        "user": user,
+        "payment": payment,
+        "name": "Nigeria 1GB 7Days",
+        "package_code": "CKH001",
+        "slug": "NG_1_7",
+        "currency_code": "USD",
+        "speed": "4G",
+        "description": "Nigeria 1GB 7Days",
+        "price": 18000,
+        "volume": str(1024 ** 3),
+        "volume_used": "0",
+        "duration": 7,
+        "duration_unit": "DAY",
+        "support_top_up_type": 2,
+        "location_code": "NG",
+        "expires_on": now(),
+    }
+    values.update(fields)
+    return eSIMPlan.objects.create(**values)
+
+
+def _copy(items):
+    return [dict(item) for item in items]
+
+
+@override_settings(ESIM_CATALOGUE_BACKGROUND_REFRESH=False)
+class CatalogueStoreTests(TestCase):
+    """Test that catalogue snapshots are fetched once per TTL and shared through the database."""
+
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_miss_then_hit(self, mock_fetch):
+        """The first read fetches from the vendor; the next read is served from memory."""
+        mock_fetch.return_value = _copy(ESIMACCESS_PACKAGES)
+        store = CatalogueStore(ttl=60)
+
+        first = store.get(ESIMACCESS)
+        second = store.get(ESIMACCESS)
+
+        mock_fetch.assert_called_once_with({"locationCode": ""})
+        self.assertIs(first, second)
+        self.assertEqual(store.misses, 1)
+        self.assertEqual(store.hits, 1)
+
+        # Items are sorted by price and formatted once at refresh time.
+        self.assertEqual([item["packageCode"] for item in first.items], ["CKH002", "CKH001", "CKH777", "CKH491"])
+        self.assertEqual(first.items[1]["formattedVolume"], "1.0 GB")
+        self.assertEqual(first.items[1]["formattedPrice"], "3.60")
+
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_snapshot_is_shared_through_database(self, mock_fetch):
+        """A second store (another worker) adopts the persisted snapshot without a vendor call."""
+        mock_fetch.return_value = _copy(ESIMACCESS_PACKAGES)
+        CatalogueStore(ttl=60).get(ESIMACCESS)
+
+        other_worker = CatalogueStore(ttl=60)
+        snapshot = other_worker.get(ESIMACCESS)
+
+        mock_fetch.assert_called_once()
+        self.assertEqual(len(snapshot.items), 4)
+        self.assertEqual(other_worker.hits, 1)
+        self.assertEqual(CatalogueSnapshot.objects.get(provider=ESIMACCESS, scope="").item_count, 4)
+
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_stale_snapshot_served_when_refresh_fails(self, mock_fetch):
+        """A failed refresh keeps the last good snapshot instead of returning nothing."""
+        mock_fetch.return_value = _copy(ESIMACCESS_PACKAGES)
+        store = CatalogueStore(ttl=0)
+        store.get(ESIMACCESS)
+
+        mock_fetch.side_effect = requests.ConnectionError("vendor down")
+        snapshot = store.get(ESIMACCESS)
+
+        self.assertIsNotNone(snapshot)
+        self.assertEqual(len(snapshot.items), 4)
+        self.assertEqual(store.failures, 1)
+
+    @override_settings(ESIM_CATALOGUE_DB_RECHECK_SECONDS=60)
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_expired_snapshot_is_not_reloaded_from_database(self, mock_fetch):
+        """An expired snapshot is rechecked against its row's fetched_at at most once per interval."""
+        mock_fetch.return_value = _copy(ESIMACCESS_PACKAGES)
+        store = CatalogueStore(ttl=0)
+        snapshot = store.get(ESIMACCESS)
+
+        with patch('esim.catalogue.build_snapshot') as mock_build:
+            with self.assertNumQueries(1):  # fetched_at only; the payload is unchanged
+                first = store.lookup(ESIMACCESS)
+            with self.assertNumQueries(0):
+                second = store.lookup(ESIMACCESS)
+
+        mock_build.assert_not_called()
+        self.assertEqual(first, (None, snapshot))
+        self.assertEqual(second, (None, snapshot))
+
+    def test_location_filter_excludes_end_and_daily_packages(self):
+        """Location filters keep the historic slug prefix and suffix rules."""
+        packages = filter_esimaccess_packages(ESIMACCESS_PACKAGES, {"locationCode": "NG"})
+        self.assertEqual([item["packageCode"] for item in packages], ["CKH491", "CKH001"])
+
+
+class CatalogueIndexTests(TestCase):
+    """Test that index lookups return exactly what the list scans return, in the same order."""
+
+    PACKAGES = ESIMACCESS_PACKAGES + [
+        {"packageCode": "RG001", "slug": "EU-42_1_7", "price": 30000, "volume": 1024 ** 3},
+        {"packageCode": "RG002", "slug": "EU-30_3_30", "price": 60000, "volume": 3 * 1024 ** 3},
+        {"packageCode": "RG003", "slug": "EU-42_1_Daily", "price": 10000, "volume": 1024 ** 3},
+        {"packageCode": "GL001", "slug": "GL-139_1_7", "price": 90000, "volume": 1024 ** 3},
+    ]
+
+    def test_esimaccess_filters_match_scan(self):
+        index = ESIMAccessIndex(self.PACKAGES)
+        for filters in (
+            {},
+            {"locationCode": "NG"},
+            {"locationCode": "ZZ"},
+            {"locationCode": "!RG", "mainRegion": "EU"},
+            {"locationCode": "!GL", "mainRegion": "GL"},
+            {"packageCode": "CKH777"},
+            {"packageCode": "CKH777", "locationCode": "NG"},
+            {"slug": "NG_1_7"},
+        ):
+            with self.subTest(filters=filters):
+                self.assertEqual(index.filter(filters), filter_esimaccess_packages(self.PACKAGES, filters))
+
+    def test_esimgo_multi_country_bundles_are_indexed_per_country(self):
+        bundles = ESIMGO_BUNDLES + [{
+            "name": "esim_ULE_7D_WA_V2",
+            "description": "eSIM, Unlimited Essential, 7 Days, West Africa, V2",
+            "countries": [
+                {"name": "Nigeria", "region": "Africa", "iso": "NG"},
+                {"name": "Ghana", "region": "Africa", "iso": "GH"},
+            ],
+        }]
+        index = ESIMGoIndex(bundles)
+        self.assertEqual([b["name"] for b in index.filter(countries="gh")], ["esim_ULE_7D_WA_V2"])
+        for kwargs in ({"countries": "NG"}, {"region": "Africa"}, {"description": "united"}, {}):
+            with self.subTest(**kwargs):
+                self.assertEqual(index.filter(**kwargs), filter_esimgo_bundles(bundles, **kwargs))
+
+
+class ESIMGoCatalogueQueryTests(TestCase):
+    """Test that eSIMGo filters are sent upstream and pages are fetched lazily."""
+
+    def test_params_only_include_supplied_filters(self):
+        query = ESIMGoCatalogueQuery(countries="ng,gh", per_page=50)
+        self.assertTrue(query.is_narrow)
+        self.assertEqual(query.params(2), {
+            "page": 2,
+            "perPage": 50,
+            "group": "Standard Unlimited Essential",
+            "countries": "NG,GH",
+        })
+        self.assertFalse(ESIMGoCatalogueQuery().is_narrow)
+
+    @patch('esim.esimgo.esimgo_http.get')
+    def test_pages_are_requested_on_demand(self, mock_get):
+        def page(number):
+            response = MagicMock(status_code=200)
+            response.json.return_value = {"bundles": [{"name": f"bundle_{number}"}], "pageCount": 3}
+            return response
+        mock_get.side_effect = [page(1), page(2), page(3)]
+
+        bundles = iter_esimgo_bundles(ESIMGoCatalogueQuery(countries="NG"))
+        self.assertEqual(next(bundles)["name"], "bundle_1")
+        self.assertEqual(mock_get.call_count, 1)
+
+        self.assertEqual([bundle["name"] for bundle in bundles], ["bundle_2", "bundle_3"])
+        self.assertEqual(mock_get.call_count, 3)
+
+
+@override_settings(ESIM_CATALOGUE_BACKGROUND_REFRESH=False)
+class eSIMPlanListViewTests(TestCase):
+    """Test that the plans endpoint answers from the snapshot store."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.store = CatalogueStore(ttl=60)
+        self.cache = ResponseCache()
+        self.store.add_listener(self.cache.clear)
+        for target, value in (('esim.views.catalogue_store', self.store), ('esim.views.plans_cache', self.cache)):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_repeat_requests_do_not_call_vendors(self, mock_access, mock_go):
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+        mock_go.return_value = _copy(ESIMGO_BUNDLES)
+
+        self.client.get('/api/esim/plans/')
+        for _ in range(2):
+            response = self.client.get('/api/esim/plans/', {"locationCode": "NG"})
+
+        self.assertEqual(response.status_code, 200)
+        mock_access.assert_called_once()
+        mock_go.assert_called_once()
+        data = response.json()["data"]
+        self.assertEqual([item["packageCode"] for item in data["standard"]], ["CKH001", "CKH491"])
+        self.assertEqual([item["name"] for item in data["unlimited"]], ["esim_ULE_1D_NG_V2"])
+        self.assertEqual(data["unlimited"][0]["formattedVolume"], "Unlimited")
+        self.assertEqual(response.json()["providers"]["esimgo"]["source"], "snapshot")
+
+    @patch('esim.esimgo.esimgo_http.get')
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_cold_country_request_queries_esimgo_for_that_country(self, mock_access, mock_full, mock_get):
+        """A snapshot miss for one country asks eSIMGo for that country instead of the whole catalogue."""
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+        mock_get.return_value = MagicMock(status_code=200)
+        mock_get.return_value.json.return_value = {"bundles": _copy(ESIMGO_BUNDLES[:1]), "pageCount": 1}
+
+        with patch.object(self.store, 'refresh_in_background') as mock_background:
+            response = self.client.get('/api/esim/plans/', {"locationCode": "NG"})
+
+        mock_full.assert_not_called()
+        mock_background.assert_called_once_with("esimgo", "")
+        params = mock_get.call_args[1]["params"]
+        self.assertEqual(params["countries"], "NG")
+        self.assertEqual(params["group"], "Standard Unlimited Essential")
+        body = response.json()
+        self.assertEqual([item["name"] for item in body["data"]["unlimited"]], ["esim_ULE_1D_NG_V2"])
+        self.assertEqual(body["providers"]["esimgo"]["source"], "live")
+
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_package_code_is_resolved_from_snapshot_index(self, mock_access, mock_go):
+        """Checkout's packageCode lookup is answered from the index without touching eSIMGo."""
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+        self.store.get(ESIMACCESS)
+        mock_access.reset_mock()
+
+        response = self.client.get('/api/esim/plans/', {"packageCode": "CKH777"})
+
+        body = response.json()
+        mock_access.assert_not_called()
+        mock_go.assert_not_called()
+        self.assertEqual([item["packageCode"] for item in body["data"]["standard"]], ["CKH777"])
+        self.assertEqual(body["data"]["unlimited"], [])
+        self.assertEqual(body["providers"]["esimaccess"]["source"], "snapshot")
+
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_unknown_package_code_makes_one_targeted_call(self, mock_access):
+        mock_access.return_value = [dict(ESIMACCESS_PACKAGES[0], packageCode="NEW001")]
+
+        response = self.client.get('/api/esim/plans/', {"packageCode": "NEW001"})
+
+        mock_access.assert_called_once_with({"packageCode": "NEW001"})
+        body = response.json()
+        self.assertEqual(body["data"]["standard"][0]["packageCode"], "NEW001")
+        self.assertEqual(body["providers"]["esimaccess"]["source"], "live")
+
+    @override_settings(ESIM_PLANS_DEADLINE_SECONDS=0.2)
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_slow_provider_is_reported_as_timeout(self, mock_access, mock_go):
+        """A provider that misses the deadline no longer holds back the other one."""
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+
+        def slow_catalogue():
+            time.sleep(1)
+            return _copy(ESIMGO_BUNDLES)
+        mock_go.side_effect = slow_catalogue
+
+        started = time.monotonic()
+        with patch.object(self.store, '_commit_late'):
+            response = self.client.get('/api/esim/plans/')
+        elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.9)
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body["data"]["standard"]), 4)
+        self.assertEqual(body["data"]["unlimited"], [])
+        self.assertEqual(body["providers"]["esimaccess"]["status"], "ok")
+        self.assertEqual(body["providers"]["esimaccess"]["source"], "vendor")
+        self.assertEqual(body["providers"]["esimgo"]["status"], "timeout")
+
+    @patch('esim.views.select_esimaccess_packages')
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_repeat_filters_are_served_from_response_cache(self, mock_access, mock_go, mock_select):
+        """The second identical request returns cached bytes without filtering again."""
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+        mock_go.return_value = _copy(ESIMGO_BUNDLES)
+        mock_select.side_effect = lambda result, filters: result.index.filter(filters)
+        self.client.get('/api/esim/plans/')
+
+        first = self.client.get('/api/esim/plans/', {"locationCode": "NG"})
+        second = self.client.get('/api/esim/plans/', {"locationCode": "NG"})
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(mock_select.call_count, 2)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_snapshot_refresh_invalidates_response_cache(self, mock_access, mock_go):
+        """Refreshing a snapshot drops responses rendered from the old one."""
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+        mock_go.return_value = _copy(ESIMGO_BUNDLES)
+        self.client.get('/api/esim/plans/')
+        self.client.get('/api/esim/plans/', {"locationCode": "NG"})
+        self.assertEqual(self.cache.stats()["entries"], 2)
+
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES[:1])
+        self.store.refresh(ESIMACCESS, "")
+
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        data = self.client.get('/api/esim/plans/', {"locationCode": "NG"}).json()["data"]
+        self.assertEqual([item["packageCode"] for item in data["standard"]], ["CKH491"])
+
+
+class ResponseCacheTests(TestCase):
+    """Test the rendered response cache bounds."""
+
+    def test_key_ignores_empty_filters_and_order(self):
+        self.assertEqual(
+            cache_key({"locationCode": "NG", "slug": ""}, region=None),
+            cache_key({"locationCode": "NG"}),
+        )
+
+    def test_least_recently_used_entry_is_evicted_by_size(self):
+        cache = ResponseCache(max_entries=10, max_bytes=10)
+        cache.set("a", b"12345", ttl=60)
+        cache.set("b", b"12345", ttl=60)
+        cache.get("a")
+        cache.set("c", b"12345", ttl=60)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"12345")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expired_entries_are_not_served(self):
+        cache = ResponseCache()
+        cache.set("a", b"{}", ttl=0)
+        self.assertIsNone(cache.get("a"))
+
+
+class SingleFlightTests(TestCase):
+    """Test that identical concurrent vendor calls are coalesced."""
+
+    def _run_concurrently(self, flights, key, fn, count=5):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(flights.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        return results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def vendor_call():
+            calls.append(1)
+            release.wait(timeout=5)
+            return ["plan"]
+
+        threading.Timer(0.2, release.set).start()
+        results, errors = self._run_concurrently(flights, ("esimgo", ""), vendor_call)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["plan"]] * 5)
+        self.assertEqual(errors, [])
+        self.assertEqual(flights.stats()["shared"], 4)
+
+    def test_error_is_shared_with_waiting_callers(self):
+        flights = SingleFlight()
+
+        def failing_call():
+            time.sleep(0.2)
+            raise requests.ConnectionError("vendor down")
+
+        results, errors = self._run_concurrently(flights, "key", failing_call, count=3)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flights.stats()["calls"], 1)
+
+    def test_sequential_calls_are_not_cached(self):
+        flights = SingleFlight()
+        flights.do("key", lambda: 1)
+        self.assertEqual(flights.do("key", lambda: 2), 2)
+
+    def test_file_backend_adopts_result_stored_by_previous_holder(self):
+        """With a cross-worker lock, ``recheck`` runs before the vendor is called."""
+        with tempfile.TemporaryDirectory() as lock_dir:
+            with override_settings(ESIM_SINGLEFLIGHT_BACKEND="file", ESIM_SINGLEFLIGHT_LOCK_DIR=lock_dir):
+                vendor_call = MagicMock(return_value="vendor")
+                result = SingleFlight().do("key", vendor_call, recheck=lambda: "stored")
+
+        self.assertEqual(result, "stored")
+        vendor_call.assert_not_called()
+
+    @patch('esim.catalogue._LOADERS')
+    def test_concurrent_snapshot_fetches_download_once(self, mock_loaders):
+        release = threading.Event()
+        loader = MagicMock(side_effect=lambda scope: release.wait(timeout=5) and [])
+        mock_loaders.__getitem__.return_value = loader
+        store = CatalogueStore(ttl=60)
+
+        threading.Timer(0.2, release.set).start()
+        threads = [threading.Thread(target=store.fetch, args=(ESIMACCESS, "")) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        loader.assert_called_once_with("")
+
+
+class CircuitBreakerTests(TestCase):
+    """Test vendor outage handling: breaker states and stale-while-revalidate."""
+
+    def test_breaker_opens_then_probes_once(self):
+        breaker = CircuitBreaker("esimgo:catalogue", failure_threshold=2, slow_call_seconds=5, reset_seconds=0.1)
+        failing = MagicMock(side_effect=requests.ConnectionError("down"))
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                breaker.call(failing)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(failing)
+        self.assertEqual(failing.call_count, 2)
+
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # Only one probe while half-open.
+        breaker.record_success()
+        self.assertEqual(breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(breaker.stats(), {"state": "closed", "failures": 0})
+
+    def test_slow_and_flagged_calls_count_as_failures(self):
+        breaker = CircuitBreaker("esimgo:bundle", failure_threshold=2, slow_call_seconds=0, reset_seconds=60)
+        breaker.call(lambda: 1)
+        breaker.call(lambda: 503, failed=lambda status: status >= 500)
+        self.assertEqual(breaker.stats()["state"], "open")
+
+    def test_expired_snapshot_is_served_while_it_refreshes(self):
+        store = CatalogueStore(ttl=60)
+        store._remember(build_snapshot(ESIMACCESS, "", _copy(ESIMACCESS_PACKAGES), time.time() - 120))
+
+        with patch.object(store, 'refresh_in_background') as mock_refresh, \
+                patch.object(store, 'fetch') as mock_fetch:
+            result = store.get_many({ESIMACCESS: ""}, timeout=5)[ESIMACCESS]
+
+        self.assertEqual((result.status, result.source), ("ok", "stale"))
+        self.assertEqual(len(result.items), 4)
+        mock_fetch.assert_not_called()
+        mock_refresh.assert_called_once_with(ESIMACCESS, "")
+
+    @override_settings(ESIM_CATALOGUE_STALE_SECONDS=0)
+    @patch('esim.catalogue._request_esimaccess_packages')
+    def test_open_breaker_skips_vendor_and_keeps_last_good_catalogue(self, mock_request):
+        mock_request.side_effect = requests.ConnectionError("vendor down")
+        breaker = CircuitBreaker("esimaccess:package/list", failure_threshold=1, reset_seconds=60)
+        store = CatalogueStore(ttl=60)
+        store._remember(build_snapshot(ESIMACCESS, "", _copy(ESIMACCESS_PACKAGES), time.time() - 120))
+
+        with patch('esim.catalogue.breaker_for', return_value=breaker):
+            first = store.get_many({ESIMACCESS: ""}, timeout=5)[ESIMACCESS]
+            second = store.get_many({ESIMACCESS: ""}, timeout=5)[ESIMACCESS]
+
+        self.assertEqual((first.status, first.source), ("error", "stale"))
+        self.assertEqual((second.status, second.source), ("unavailable", "stale"))
+        self.assertEqual(len(second.items), 4)
+        mock_request.assert_called_once()
+
+
+class VendorClientTests(TestCase):
+    """Test the pooled vendor HTTP client: timeouts, retries and per-endpoint metrics."""
+
+    def _response(self, status_code):
+        response = MagicMock()
+        response.status_code = status_code
+        return response
+
+    def test_idempotent_calls_are_retried_and_measured(self):
+        client = VendorClient("test-retry", connect_timeout=5, retries=2, backoff=0)
+        with patch.object(client.session, 'request') as mock_request:
+            mock_request.side_effect = [requests.ConnectionError("reset"), self._response(503), self._response(200)]
+            response = client.post("https://vendor.example/esim/query", json={}, timeout=15, idempotent=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(mock_request.call_args.kwargs["timeout"], (5, 15))
+        stats = vendor_metrics.snapshot()["test-retry /esim/query"]
+        self.assertEqual((stats["calls"], stats["errors"], stats["statuses"]), (3, 1, {503: 1, 200: 1}))
+
+    def test_other_calls_are_sent_once_with_default_timeouts(self):
+        client = VendorClient("test-once", connect_timeout=2, read_timeout=10, retries=2, backoff=0)
+        with patch.object(client.session, 'request') as mock_request:
+            mock_request.return_value = self._response(503)
+            response = client.post("https://vendor.example/esim/order", endpoint="esim/order")
+            mock_request.side_effect = requests.Timeout("slow")
+            with self.assertRaises(requests.Timeout):
+                client.post("https://vendor.example/esim/order", endpoint="esim/order")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(mock_request.call_args.kwargs["timeout"], (2, 10))
+        self.assertEqual(vendor_metrics.snapshot()["test-once esim/order"]["errors"], 1)
+
+    def test_catalogue_status_reports_vendor_calls(self):
+        client = VendorClient("test-status", retries=0)
+        with patch.object(client.session, 'request', return_value=self._response(200)):
+            client.post("https://vendor.example/package/list", endpoint="package/list")
+        admin = get_user_model().objects.create_user(
+            email="ops@example.com", username="ops", password="secret123", is_staff=True
+        )
+        api = APIClient()
+        api.force_authenticate(admin)
+
+        response = api.get('/api/esim/plans/catalogue/status/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["vendor_calls"]["test-status package/list"]["calls"], 1)
+
+    async def test_async_client_retries_idempotent_calls(self):
+        client = AsyncVendorClient("test-async", connect_timeout=5, retries=2, backoff=0)
+        statuses = iter([503, 200])
+        transport = httpx.MockTransport(lambda request: httpx.Response(next(statuses), json={}))
+        client._clients[asyncio.get_running_loop()] = httpx.AsyncClient(transport=transport)
+
+        response = await client.post("https://vendor.example/esim/query", json={}, timeout=15, idempotent=True)
+
+        self.assertEqual(response.status_code, 200)
+        stats = vendor_metrics.snapshot()["test-async /esim/query"]
+        self.assertEqual((stats["calls"], stats["statuses"]), (2, {503: 1, 200: 1}))
+
+
+class ESIMGoBundleCacheTests(TestCase):
+    """Test that bundle details are served from the catalogue-warmed cache."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.cache = BundleCache(ttl=60, max_entries=10)
+        for target in ('esim.esimgo.bundle_cache', 'esim.catalogue.bundle_cache'):
+            patcher = patch(target, self.cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('esim.esimgo.esimgo_http.get')
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    def test_catalogue_refresh_warms_detail_lookups(self, mock_bundles, mock_get):
+        mock_bundles.return_value = _copy(ESIMGO_BUNDLES)
+        store = CatalogueStore(ttl=60)
+        store.add_listener(_warm_bundle_cache)
+        store.refresh(ESIMGO, "")
+
+        response = self.client.get('/api/esim/plan/esimgo/', {"name": "esim_1GB_7D_US_V2"})
+        details = fetch_esim_plan_details("esim_ULE_1D_NG_V2", seller="esimgo")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["formattedVolume"], "1000 MB")
+        self.assertEqual(details["formattedPrice"], "9.00")
+        mock_get.assert_not_called()
+
+    @patch('esim.esimgo.esimgo_http.get')
+    def test_miss_is_fetched_once_then_cached(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: _copy(ESIMGO_BUNDLES)[0])
+
+        for _ in range(2):
+            response = self.client.get('/api/esim/plan/esimgo/', {"name": "esim_ULE_1D_NG_V2"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["formattedVolume"], "Unlimited")
+        mock_get.assert_called_once()
+
+    @patch('esim.esimgo.esimgo_http.get')
+    def test_unknown_bundle_is_not_found(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=404)
+        response = self.client.get('/api/esim/plan/esimgo/', {"name": "esim_missing"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_entries_expire_and_least_recent_is_evicted(self):
+        cache = BundleCache(ttl=60, max_entries=2)
+        cache.put_many(_copy(ESIMGO_BUNDLES))
+        cache.get("esim_ULE_1D_NG_V2")
+        cache.put("esim_extra", {"name": "esim_extra"})
+        self.assertIsNone(cache.get("esim_1GB_7D_US_V2"))
+        self.assertIsNotNone(cache.get("esim_ULE_1D_NG_V2"))
+
+        cache.put_many([{"name": "esim_old"}], age=61)
+        self.assertIsNone(cache.get("esim_old"))
+
+
+class eSIMPlanBatchViewTests(TestCase):
+    """Test resolving several plans in one request."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.store = CatalogueStore(ttl=60)
+        patcher = patch('esim.views.catalogue_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('esim.catalogue.fetch_esimgo_bundles')
+    @patch('esim.catalogue.fetch_esimaccess_packages')
+    def test_codes_are_resolved_with_one_download_per_provider(self, mock_access, mock_go):
+        mock_access.return_value = _copy(ESIMACCESS_PACKAGES)
+        mock_go.return_value = _copy(ESIMGO_BUNDLES)
+
+        for _ in range(2):
+            response = self.client.get('/api/esim/plans/batch/', {
+                "packageCodes": "CKH491,CKH777,NOPE",
+                "bundleNames": "esim_ULE_1D_NG_V2",
+            })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(list(data["packages"]), ["CKH491", "CKH777", "NOPE"])
+        self.assertEqual(data["packages"]["CKH777"]["slug"], "US_5_30")
+        self.assertIsNone(data["packages"]["NOPE"])
+        self.assertEqual(data["bundles"]["esim_ULE_1D_NG_V2"]["formattedPrice"], "9.00")
+        mock_access.assert_called_once()
+        mock_go.assert_called_once()
+
+    @override_settings(ESIM_PLANS_BATCH_MAX_ITEMS=2)
+    def test_empty_and_oversized_batches_are_rejected(self):
+        self.assertEqual(self.client.get('/api/esim/plans/batch/').status_code, 400)
+        response = self.client.get('/api/esim/plans/batch/', {"packageCodes": "A,B,C"})
+        self.assertEqual(response.status_code, 400)
+
+
+class eSIMPlanListCreateViewTests(TestCase):
+    """Test the batched usage refresh on the user plans dashboard."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email="buyer@example.com", username="buyer", password="secret123"
+        )
+        self.client.force_authenticate(self.user)
+        payment = Payment.objects.create(user=self.user, price=10, package_code="CKH001")
+        self.first = _create_plan(self.user, payment, order_no="B1", iccid="8901")
+        self.second = _create_plan(self.user, payment, order_no="B1", iccid="8902")
+        self.slow = _create_plan(self.user, payment, order_no="B2", volume_used=str(512 * 1024 ** 2))
+
+    @override_settings(ESIM_USAGE_REFRESH_DEADLINE_SECONDS=0.2)
+    @patch('esim.usage.query_esim_order')
+    def test_one_query_per_order_and_slow_orders_keep_stored_usage(self, mock_query):
+        def query(order_no, timeout):
+            if order_no == "B2":
+                time.sleep(1)
+            return [
+                {"iccid": "8902", "orderUsage": 300, "totalVolume": 1000, "activateTime": None, "totalDuration": 7},
+                {"iccid": "8901", "orderUsage": 100, "totalVolume": 1000, "activateTime": None, "totalDuration": 7},
+            ]
+        mock_query.side_effect = query
+
+        started = time.monotonic()
+        response = self.client.get('/api/esim/user/plans/')
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual(mock_query.call_count, 2)
+        plans = {plan["id"]: plan for plan in response.json()["data"]}
+        self.assertEqual(plans[self.first.id]["volume_used"], "100")
+        self.assertEqual(plans[self.second.id]["usageScale"], 0.3)
+        self.assertEqual(plans[self.slow.id]["usageScale"], 0.5)
+        self.assertEqual(plans[self.slow.id]["formattedVolumeLeft"], "512 MB")
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.volume_used, "100")
+
+    def test_only_changed_rows_are_written(self):
+        usage = {
+            self.first.pk: {"activateTime": None, "orderUsage": 0},  # Unchanged
+            self.second.pk: {"activateTime": "2025-03-05T12:00:00+0000", "orderUsage": 0},
+            self.slow.pk: {"activateTime": None, "orderUsage": 42},
+        }
+        plans = list(eSIMPlan.objects.filter(user=self.user))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(persist_plan_usage(plans, usage), (2, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(persist_plan_usage(plans, usage), (0, 3))
+
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.activated_on.day, 5)
+        self.assertEqual(eSIMPlan.objects.get(pk=self.slow.pk).volume_used, "42")
+
+    @patch('esim.usage.query_esim_order')
+    def test_fresh_snapshots_are_served_without_vendor_calls(self, mock_query):
+        for plan, used in ((self.first, 100), (self.second, 200), (self.slow, 300)):
+            UsageSnapshot.objects.create(
+                plan=plan, order_no=plan.order_no, iccid=plan.iccid, order_usage=used,
+                total_volume=1000, total_duration=7, fetched_at=now(),
+            )
+
+        with self.assertNumQueries(1):  # plans joined with their snapshots, nothing per plan
+            response = self.client.get('/api/esim/user/plans/')
+
+        mock_query.assert_not_called()
+        plans = {plan["id"]: plan for plan in response.json()["data"]}
+        self.assertEqual(plans[self.second.id]["usageScale"], 0.2)
+        self.assertEqual(plans[self.slow.id]["usageAge"], 0)
+
+    @patch('esim.usage.query_esim_order')
+    def test_keyset_pages_refresh_only_the_returned_page(self, mock_query):
+        mock_query.return_value = []
+
+        first_page = self.client.get('/api/esim/user/plans/', {"page_size": 2}).json()
+        self.assertEqual([plan["id"] for plan in first_page["data"]], [self.slow.id, self.second.id])  # Newest first
+        self.assertEqual(mock_query.call_count, 2)  # Orders B2 and B1 are on this page
+        cursor = first_page["pagination"]["next_cursor"]
+        self.assertIsNotNone(cursor)
+
+        # A plan created between requests goes on top instead of shifting later pages.
+        _create_plan(self.user, self.first.payment, order_no="B3")
+        mock_query.reset_mock()
+        second_page = self.client.get('/api/esim/user/plans/', {"page_size": 2, "cursor": cursor}).json()
+        self.assertEqual([plan["id"] for plan in second_page["data"]], [self.first.id])
+        self.assertEqual(mock_query.call_count, 1)  # Only order B1 is on this page
+        self.assertIsNone(second_page["pagination"]["next_cursor"])
+
+        response = self.client.get('/api/esim/user/plans/', {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('esim.usage.query_esim_order')
+    def test_fields_projection_skips_usage_when_not_requested(self, mock_query):
+        response = self.client.get('/api/esim/user/plans/', {"fields": "id,name"})
+
+        self.assertEqual(response.status_code, 200)
+        mock_query.assert_not_called()
+        self.assertEqual(response.json()["data"][0], {"id": self.slow.id, "name": "Nigeria 1GB 7Days"})
+        self.assertEqual(self.client.get('/api/esim/user/plans/', {"fields": "id,secret"}).status_code, 400)
+
+    def test_status_filter(self):
+        eSIMPlan.objects.filter(pk__in=[self.first.pk, self.second.pk]).update(expires_on=now() + timedelta(days=7))
+        UsageSnapshot.objects.create(plan=self.second, order_no="B1", esim_status="USED_UP", fetched_at=now())
+
+        def ids(plan_status):
+            response = self.client.get('/api/esim/user/plans/', {"status": plan_status, "fields": "id"})
+            return [plan["id"] for plan in response.json()["data"]]
+
+        self.assertEqual(ids("active"), [self.first.id])
+        self.assertEqual(ids("expired"), [self.slow.id, self.second.id])
+        self.assertEqual(self.client.get('/api/esim/user/plans/', {"status": "soon"}).status_code, 400)
+
+
+@patch.dict(os.environ, {"ESIMACCESS_SECRET_KEY": "webhook-secret", "ESIMACCESS_ACCESS_CODE": "access-code"})
+class eSIMAccessWebhookTests(TestCase):
+    """Test signed eSIMAccess webhook notifications."""
+
+    def setUp(self):
+        self.client = APIClient()
+        user = get_user_model().objects.create_user(email="push@example.com", username="push", password="secret123")
+        payment = Payment.objects.create(user=user, price=10, package_code="CKH001")
+        self.first = _create_plan(user, payment, order_no="B1", iccid="8901", expires_on=now() + timedelta(days=7))
+        self.second = _create_plan(user, payment, order_no="B1", iccid="8902", expires_on=now() + timedelta(days=7))
+
+    def _post(self, payload, **header_overrides):
+        body = json.dumps(payload).encode()
+        headers = {**sign(body), **header_overrides}
+        return self.client.generic(
+            "POST", "/api/esim/webhooks/esimaccess/", body, content_type="application/json",
+            headers=headers,
+        )
+
+    def _usage(self, iccid, used):
+        return {"notifyType": "DATA_USAGE", "content": {
+            "orderNo": "B1", "iccid": iccid, "totalVolume": 1000, "orderUsage": used,
+        }}
+
+    def test_rejects_bad_or_expired_signatures(self):
+        self.assertEqual(self._post(self._usage("8901", 10), **{"RT-Signature": "0" * 64}).status_code, 401)
+        stale = str(int((time.time() - 3600) * 1000))
+        body = json.dumps(self._usage("8901", 10)).encode()
+        response = self.client.generic(
+            "POST", "/api/esim/webhooks/esimaccess/", body, content_type="application/json",
+            headers=sign(body, timestamp=stale),
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(UsageSnapshot.objects.exists())
+
+    def test_batch_is_applied_in_bulk_and_idempotently(self):
+        batch = [
+            {"notifyType": "ORDER_STATUS", "content": {"orderNo": "B1", "orderStatus": "GOT_RESOURCE"}},
+            {"notifyType": "ESIM_STATUS", "content": {
+                "orderNo": "B1", "iccid": "8901", "esimStatus": "IN_USE", "smdpStatus": "ENABLED",
+                "activateTime": "2025-03-05T12:00:00+0000",
+            }},
+            self._usage("8901", 600),
+            self._usage("8902", 200),
+            {"notifyType": "CHECK_HEALTH", "content": {}},
+            {"notifyType": "DATA_USAGE", "content": {"orderNo": "B9", "iccid": "8999", "orderUsage": 1}},
+        ]
+
+        # One read, then bulk writes whatever the batch size.
+        with self.assertNumQueries(5):  # select, savepoint, plan bulk_update, snapshot bulk_create, release
+            counts = apply_notifications(batch)
+        self.assertEqual(counts, {"applied": 4, "unchanged": 0, "unmatched": 1, "ignored": 1, "malformed": 0})
+
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.esim_status, self.first.smdp_status, self.first.volume_used), ("IN_USE", "ENABLED", "600"))
+        self.assertEqual(UsageSnapshot.objects.get(plan=self.second).order_usage, 200)
+        self.assertIsNotNone(UsageSnapshot.objects.get(plan=self.first).pushed_at)
+
+        # Redelivery and late, older usage change nothing.
+        response = self._post(batch + [self._usage("8901", 300)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["applied"], 0)
+        self.assertEqual(UsageSnapshot.objects.get(plan=self.first).order_usage, 600)
+
+    def test_malformed_notifications_are_skipped(self):
+        batch = [
+            {"notifyType": "DATA_USAGE", "content": {"orderNo": "B1", "iccid": "8901", "orderUsage": "lots"}},
+            {"notifyType": "VALIDITY_USAGE", "content": {"orderNo": "B1", "iccid": "8902", "expiredTime": "soon"}},
+            {"notifyType": "ESIM_STATUS", "content": {"orderNo": "B1", "iccid": "8902", "activateTime": 5}},
+            self._usage("8902", 200),
+        ]
+
+        with self.assertLogs("esim.webhooks", level="WARNING"):
+            response = self._post(batch)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["malformed"], 3)
+        self.assertEqual(response.json()["data"]["applied"], 1)
+        self.assertFalse(UsageSnapshot.objects.filter(plan=self.first).exists())
+
+    @patch('esim.views.apply_notifications', wraps=apply_notifications)
+    def test_redelivered_request_id_is_acknowledged_without_applying(self, mock_apply):
+        body = json.dumps(self._usage("8901", 600)).encode()
+        headers = sign(body)
+        for _ in range(2):
+            response = self.client.generic(
+                "POST", "/api/esim/webhooks/esimaccess/", body, content_type="application/json", headers=headers,
+            )
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.json()["message"], "Notification already received.")
+        self.assertEqual(mock_apply.call_count, 1)
+        self.assertEqual(UsageSnapshot.objects.get(plan=self.first).order_usage, 600)
+        self.assertTrue(WebhookDelivery.objects.filter(request_id=headers["RT-RequestID"]).exists())
+
+    @patch('esim.views.apply_notifications', side_effect=RuntimeError("database went away"))
+    def test_failed_delivery_is_not_recorded(self, mock_apply):
+        body = json.dumps(self._usage("8901", 600)).encode()
+        with self.assertRaises(RuntimeError):
+            self.client.generic(
+                "POST", "/api/esim/webhooks/esimaccess/", body, content_type="application/json", headers=sign(body),
+            )
+        self.assertFalse(WebhookDelivery.objects.exists())  # eSIMAccess's retry is applied
+
+    def test_old_delivery_ids_are_pruned(self):
+        self.assertTrue(claim_delivery("old", received_at=now() - timedelta(hours=1)))
+        self.assertFalse(claim_delivery("old"))
+        self.assertTrue(claim_delivery("new"))
+        self.assertEqual(list(WebhookDelivery.objects.values_list("request_id", flat=True)), ["new"])
+
+    @override_settings(ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS=60, ESIM_USAGE_PUSH_MAX_AGE_SECONDS=3600)
+    def test_pushed_plans_are_not_polled(self):
+        apply_notifications([self._usage("8901", 600)], received_at=now() - timedelta(minutes=10))
+
+        plan = eSIMPlan.objects.select_related("usage_snapshot").get(pk=self.first.pk)
+        self.assertIsNotNone(current_snapshot(plan))
+        due = plans_due_for_poll(batch_size=10, min_age=60)
+        self.assertEqual([plan.pk for plan in due], [self.second.pk])
+
+    @patch('esim.management.commands.replay_esimaccess_webhooks.requests.post')
+    def test_replay_command_posts_signed_fixtures(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, text="{}")
+
+        call_command("replay_esimaccess_webhooks", "--order-no", "B1", "--iccid", "8901", stdout=MagicMock())
+
+        self.assertEqual(mock_post.call_count, 7)
+        for call in mock_post.call_args_list:
+            body, headers = call.kwargs["data"], call.kwargs["headers"]
+            self.assertEqual(json.loads(body)["content"].get("orderNo", "B1"), "B1")
+            self.assertEqual(headers["RT-Signature"], sign(body, headers["RT-Timestamp"], headers["RT-RequestID"])["RT-Signature"])
+
+        # The replayed fixtures apply cleanly through the real view.
+        notifications = [json.loads(call.kwargs["data"]) for call in mock_post.call_args_list]
+        self.assertEqual(self._post(notifications).status_code, 200)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.esim_status, "USED_EXPIRED")
+        self.assertEqual(self.first.volume_used, "858993459")
+
+
+class UsageStreamTests(TestCase):
+    """Test the Server-Sent Events stream of plan usage."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="stream@example.com", username="stream", password="secret123"
+        )
+        payment = Payment.objects.create(user=self.user, price=10, package_code="CKH001")
+        self.plan = _create_plan(self.user, payment, order_no="B1", volume="1000")
+        self.snapshot = UsageSnapshot.objects.create(
+            plan=self.plan, order_no="B1", order_usage=100, total_volume=1000, total_duration=7, fetched_at=now(),
+        )
+
+    def test_diff_keeps_only_changed_fields(self):
+        previous = {"1": {"usageScale": 0.1, "esim_status": "IN_USE"}, "2": {"usageScale": 0.5}}
+        current = {"1": {"usageScale": 0.3, "esim_status": "IN_USE"}, "3": {"usageScale": 0}}
+        self.assertEqual(diff_states(previous, current), {"1": {"usageScale": 0.3}, "2": None, "3": {"usageScale": 0}})
+
+    async def test_stream_sends_snapshot_then_only_changes(self):
+        events = usage_events(self.user.pk, interval=0, heartbeat=60, max_seconds=60)
+
+        first = await anext(events)
+        self.assertIn("event: snapshot", first)
+        state = json.loads(first.split("data: ")[1])[str(self.plan.pk)]
+        self.assertEqual(state["usageScale"], 0.1)
+
+        self.snapshot.order_usage = 300
+        await sync_to_async(self.snapshot.save)()
+        second = await anext(events)
+
+        self.assertIn("event: usage", second)
+        changes = json.loads(second.split("data: ")[1])
+        self.assertEqual(changes, {str(self.plan.pk): {"usageScale": 0.3}})  # Volume left still rounds to "0 MB"
+        await events.aclose()
+
+    async def test_stream_requires_authentication(self):
+        request = AsyncRequestFactory().get('/api/esim/user/plans/stream/')
+        request.auser = AsyncMock(return_value=AnonymousUser())
+        self.assertEqual((await eSIMUsageStreamView.as_view()(request)).status_code, 401)
+
+        request.auser = AsyncMock(return_value=self.user)
+        response = await eSIMUsageStreamView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+    def test_stream_is_only_routed_under_asgi(self):
+        # WSGI (the default here) would buffer the stream whole.
+        self.assertEqual(self.client.get('/api/esim/user/plans/stream/').status_code, 404)
+
+    def test_changes_poll_answers_at_once_then_on_change(self):
+        self.assertEqual(self.client.get('/api/esim/user/plans/changes/').status_code, 403)
+        self.client.force_login(self.user)
+
+        first = self.client.get('/api/esim/user/plans/changes/').json()["data"]
+        self.assertEqual(first["plans"][str(self.plan.pk)]["usageScale"], 0.1)
+        self.assertEqual(first["retryAfter"], 15)  # Plain polling: nothing held the worker
+        _, version = wait_for_changes(self.user.pk, first["version"], timeout=0, interval=0)
+        self.assertEqual(version, first["version"])  # Timed out without a change
+
+        self.snapshot.order_usage = 300
+        self.snapshot.save()
+        changed = self.client.get('/api/esim/user/plans/changes/', {"version": first["version"]}).json()["data"]
+        self.assertNotEqual(changed["version"], first["version"])
+        self.assertEqual(changed["plans"][str(self.plan.pk)]["usageScale"], 0.3)
+
+        with override_settings(ESIM_USAGE_LONG_POLL_SECONDS=5):
+            self.assertEqual(self.client.get('/api/esim/user/plans/changes/').json()["data"]["retryAfter"], 0)
+
+
+PACKAGE = {
+    "packageCode": "CKH001", "name": "Nigeria 1GB 7Days", "slug": "NG_1_7", "currencyCode": "USD",
+    "speed": "4G", "description": "Nigeria 1GB 7Days", "price": 18000, "volume": 1024 ** 3, "duration": 7,
+    "durationUnit": "DAY", "supportTopUpType": 2, "locationNetworkList": [{"locationCode": "NG"}],
+}
+
+
+@patch('esim.provisioning.order_esim_profile')
+@patch('esim.provisioning.resolve_plan')
+class ProvisioningJobTests(TestCase):
+    """Test the durable provisioning queue that replaced ordering inside Payment.save()."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="job@example.com", username="job", password="secret123")
+        self.payment = Payment.objects.create(
+            user=self.user, price=10, package_code="CKH001", seller="esimaccess", plan_details=PACKAGE
+        )
+
+    def _complete(self):
+        self.payment.status = "COMPLETED"
+        self.payment.save()
+        return ProvisioningJob.objects.get(payment=self.payment)
+
+    def test_completing_a_payment_only_enqueues(self, mock_details, mock_order):
+        job = self._complete()
+        self.payment.save()  # Saving again does not enqueue twice
+
+        mock_details.assert_not_called()
+        mock_order.assert_not_called()
+        self.assertEqual(ProvisioningJob.objects.count(), 1)
+        self.assertEqual((job.status, job.transaction_id), ("PENDING", str(self.payment.ref_id)))
+
+    def test_only_the_completion_edge_enqueues(self, mock_details, mock_order):
+        with self.assertNumQueries(1):  # A pending payment: just the UPDATE
+            self.payment.save()
+
+        self.payment.status = "COMPLETED"
+        with self.assertNumQueries(5):  # UPDATE, then one job: SELECT, SAVEPOINT, INSERT, RELEASE
+            self.payment.save()
+
+        # Later saves of the completed payment, in memory or reloaded, are a single UPDATE.
+        self.payment.date_paid = now()
+        with self.assertNumQueries(1):
+            self.payment.save()
+        reloaded = Payment.objects.get(pk=self.payment.pk)
+        reloaded.payment_method = "WALLET"
+        with self.assertNumQueries(1):
+            reloaded.save()
+
+        # A failed payment that later succeeds is provisioned once.
+        retried = Payment.objects.create(user=self.user, price=10, package_code="CKH001", status="FAILED")
+        retried = Payment.objects.get(pk=retried.pk)
+        retried.status = "COMPLETED"
+        retried.save()
+        self.assertEqual(ProvisioningJob.objects.filter(payment=retried).count(), 1)
+        self.assertEqual(ProvisioningJob.objects.count(), 2)
+
+    def test_worker_provisions_and_retries_without_reordering(self, mock_details, mock_order):
+        Payment.objects.filter(pk=self.payment.pk).update(plan_details={"packageCode": "CKH001", "price": 18000})
+        self.payment.refresh_from_db()
+        job = self._complete()
+        mock_order.return_value = "B100"
+
+        # The order succeeds but creating the plan fails: retried later, keeping the orderNo.
+        self.assertEqual(process_jobs(concurrency=1), {"PENDING": 1})
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.order_no), (1, "B100"))
+        self.assertGreater(job.run_after, now() - timedelta(seconds=1))
+        self.assertIn("locationNetworkList", job.last_error)
+
+        ProvisioningJob.objects.filter(pk=job.pk).update(run_after=now())
+        Payment.objects.filter(pk=self.payment.pk).update(plan_details=PACKAGE)
+        call_command("run_provisioning_worker", "--concurrency", "1", stdout=MagicMock())
+
+        mock_order.assert_called_once()
+        mock_details.assert_not_called()  # Ordered from the frozen plan, no catalogue call
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("SUCCEEDED", 2))
+        plan = eSIMPlan.objects.get(payment=self.payment)
+        self.assertEqual((plan.order_no, plan.location_code), ("B100", "NG"))
+
+    @override_settings(ESIM_PROVISIONING_MAX_ATTEMPTS=2, ESIM_PROVISIONING_BACKOFF_SECONDS=0)
+    def test_job_fails_after_max_attempts(self, mock_details, mock_order):
+        Payment.objects.filter(pk=self.payment.pk).update(plan_details=None)  # Created before plans were frozen
+        self.payment.refresh_from_db()
+        job = self._complete()
+        mock_details.return_value = None
+
+        self.assertEqual(process_jobs(concurrency=1), {"PENDING": 1})
+        self.assertEqual(process_jobs(concurrency=1), {"FAILED": 1})
+        self.assertEqual(process_jobs(concurrency=1), {})
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(mock_details.call_count, 2)
+        mock_order.assert_not_called()
+
+    def test_leased_jobs_are_skipped_until_the_lease_expires(self, mock_details, mock_order):
+        job = self._complete()
+
+        self.assertEqual(lease_jobs(10, owner="worker-1"), [job])
+        self.assertEqual(lease_jobs(10, owner="worker-2"), [])
+
+        ProvisioningJob.objects.filter(pk=job.pk).update(leased_until=now() - timedelta(seconds=1))
+        [released] = lease_jobs(10, owner="worker-2")
+        self.assertEqual((released.leased_by, released.attempts), ("worker-2", 2))
+
+
+@override_settings(ESIM_PROVISIONING_BATCH_SIZE=5, ESIM_PROVISIONING_BATCH_WINDOW_SECONDS=60)
+@patch('esim.usage.query_esim_order')
+@patch('esim.provisioning.order_esim_profiles')
+class BatchedProvisioningTests(TestCase):
+    """Test ordering the payments of one batching window with a single packageInfoList order."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="batch@example.com", username="batch", password="secret123")
+        ghana = dict(PACKAGE, packageCode="CKH002", name="Ghana 1GB 7Days", price=20000)
+        self.payments = [
+            Payment.objects.create(
+                user=self.user, price=10, package_code=plan["packageCode"], seller="esimaccess",
+                plan_details=plan, status="COMPLETED",
+            )
+            for plan in (PACKAGE, ghana, PACKAGE)
+        ]
+
+    def _release_window(self):
+        first = ProvisioningJob.objects.order_by("id").first()
+        ProvisioningJob.objects.filter(pk=first.pk).update(run_after=now())
+
+    def test_window_is_ordered_once_and_profiles_split_by_package(self, mock_order, mock_query):
+        self.assertEqual(process_jobs(concurrency=1), {})  # Still collecting
+        mock_order.return_value = "B500"
+        mock_query.return_value = [
+            {"orderNo": "B500", "iccid": iccid, "packageList": [{"packageCode": code}], "orderUsage": 0}
+            for iccid, code in (("I-GH", "CKH002"), ("I-NG1", "CKH001"), ("I-NG2", "CKH001"))
+        ]
+
+        self._release_window()  # The oldest job is due: the rest of the window joins it
+        self.assertEqual(process_jobs(concurrency=1), {"SUCCEEDED": 3})
+
+        mock_order.assert_called_once()
+        transaction_id, packages = mock_order.call_args.args
+        self.assertTrue(transaction_id.startswith("batch-"))
+        self.assertEqual(packages, [
+            {"packageCode": "CKH001", "count": 2, "price": 18000},
+            {"packageCode": "CKH002", "count": 1, "price": 20000},
+        ])
+        mock_query.assert_called_once()
+        iccids = dict(eSIMPlan.objects.values_list("payment_id", "iccid"))
+        self.assertEqual(
+            [iccids[payment.pk] for payment in self.payments], ["I-NG1", "I-GH", "I-NG2"]
+        )
+        self.assertEqual(set(ProvisioningJob.objects.values_list("order_no", flat=True)), {"B500"})
+
+    @override_settings(ESIM_PROVISIONING_BACKOFF_SECONDS=0)
+    def test_failed_batch_is_retried_together_under_its_transaction_id(self, mock_order, mock_query):
+        mock_order.return_value = None
+        self._release_window()
+        self.assertEqual(process_jobs(concurrency=1), {"PENDING": 3})
+        jobs = list(ProvisioningJob.objects.all())
+        self.assertEqual(len({(job.batch_transaction_id, job.run_after) for job in jobs}), 1)
+        first_transaction_id = mock_order.call_args.args[0]
+
+        mock_order.return_value = "B501"
+        mock_query.return_value = []  # Profiles not allocated yet
+        self.assertEqual(process_jobs(concurrency=1), {"SUCCEEDED": 3})
+        self.assertEqual(mock_order.call_count, 2)
+        self.assertEqual(mock_order.call_args.args[0], first_transaction_id)
+        self.assertFalse(eSIMPlan.objects.exclude(iccid=None).exists())
+
+
+    def test_batches_never_mix_users(self, mock_order, mock_query):
+        other = get_user_model().objects.create_user(email="other@example.com", username="other", password="secret123")
+        Payment.objects.create(
+            user=other, price=10, package_code="CKH001", seller="esimaccess", plan_details=PACKAGE, status="COMPLETED",
+        )
+
+        batches = _batches(list(ProvisioningJob.objects.select_related("payment").order_by("id")), size=5)
+
+        self.assertEqual(
+            sorted([job.payment.user_id for job in batch] for batch in batches),
+            [[self.user.pk] * 3, [other.pk]],
+        )
+
+    @override_settings(ESIM_PROVISIONING_BACKOFF_SECONDS=0)
+    def test_changed_batch_is_reordered_under_a_new_transaction_id(self, mock_order, mock_query):
+        mock_order.return_value = None
+        self._release_window()
+        process_jobs(concurrency=1)
+        first_transaction_id = mock_order.call_args.args[0]
+        refunded = self.payments[1]
+        Payment.objects.filter(pk=refunded.pk).update(status="REFUNDED")
+
+        mock_order.return_value = "B502"
+        mock_query.return_value = []
+        self.assertEqual(process_jobs(concurrency=1), {"SUCCEEDED": 2, "FAILED": 1})
+
+        transaction_id, packages = mock_order.call_args.args
+        self.assertNotEqual(transaction_id, first_transaction_id)
+        self.assertEqual(packages, [{"packageCode": "CKH001", "count": 2, "price": 18000}])
+
+class VendorStubTests(TestCase):
+    """Test the vendor code end to end against the local vendor stubs."""
+
+    def setUp(self):
+        self.stubs = VendorStubs(seed=1).start()
+        self.addCleanup(self.stubs.stop)
+
+    def test_catalogues_are_filtered_and_paginated_like_the_vendors(self):
+        packages = fetch_esimaccess_packages({"locationCode": "NG"})
+        bundles = list(iter_esimgo_bundles(ESIMGoCatalogueQuery(countries="NG", per_page=5)))
+
+        self.assertTrue(packages)
+        self.assertTrue(all("NG" in package["location"].split(",") for package in packages))
+        self.assertEqual(len(bundles), 6)  # Unlimited Essential only, over two pages
+        self.assertEqual(self.stubs.esimgo.calls["catalogue"], 2)
+        self.assertEqual(fetch_esimgo_bundle(bundles[0]["name"]).json(), bundles[0])
+        self.assertEqual(fetch_esimgo_bundle("esim_unknown_bundle").status_code, 404)
+
+    @patch('esim.provisioning.resolve_plan')
+    def test_batched_order_is_provisioned_against_the_stub(self, mock_details):
+        user = get_user_model().objects.create_user(email="stub@example.com", username="stub", password="secret123")
+        packages = [package for package in esimaccess_packages() if package["slug"] in ("NG_1_7", "GH_3_15")]
+        for package in packages + packages[:1]:
+            Payment.objects.create(
+                user=user, price=10, package_code=package["packageCode"], seller="esimaccess",
+                plan_details=package, status="COMPLETED",
+            )
+        first = ProvisioningJob.objects.order_by("id").first()
+        ProvisioningJob.objects.filter(pk=first.pk).update(run_after=now())  # Release the batching window
+
+        self.assertEqual(process_jobs(concurrency=1, size=5), {"SUCCEEDED": 3})
+
+        self.assertEqual((self.stubs.esimaccess.calls["esim/order"], self.stubs.esimaccess.calls["esim/query"]), (1, 1))
+        self.assertEqual(eSIMPlan.objects.exclude(iccid=None).count(), 3)
+        for plan in eSIMPlan.objects.all():
+            profile = self.stubs.esimaccess.orders[plan.order_no]
+            self.assertIn(plan.package_code, [esim["packageList"][0]["packageCode"] for esim in profile])
+
+    def test_latency_errors_and_throttling_are_injected(self):
+        slow = ESIMGoStub(latency=0.2).start()
+        failing = ESIMGoStub(error_rate=1).start()
+        throttled = ESIMGoStub(rate_limit=2).start()
+        for stub in (slow, failing, throttled):
+            self.addCleanup(stub.stop)
+
+        started = time.perf_counter()
+        self.assertEqual(requests.get(f"{slow.url}/catalogue", timeout=5).status_code, 200)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.2)
+        self.assertEqual(requests.get(f"{failing.url}/catalogue", timeout=5).status_code, 503)
+        responses = [requests.get(f"{throttled.url}/catalogue", timeout=5) for _ in range(4)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429, 429])
+        self.assertEqual(responses[-1].headers["Retry-After"], "1")
+        self.assertEqual(throttled.stats()["throttled"], {"catalogue": 2})
+
+
+@override_settings(ESIM_CATALOGUE_BACKGROUND_REFRESH=False)
+class PlanResolutionTests(TestCase):
+    """Test that plans resolve from the catalogue snapshot and are frozen on payments."""
+
+    def setUp(self):
+        self.store = CatalogueStore(ttl=60)
+        with patch('esim.catalogue.fetch_esimaccess_packages', return_value=[dict(PACKAGE)]):
+            self.store.get(ESIMACCESS)
+
+    @patch('esim.plans.fetch_esim_plan_details')
+    def test_snapshot_hit_then_one_targeted_call_on_a_miss(self, mock_details):
+        other = dict(PACKAGE, packageCode="CKH999", name="Ghana 1GB 7Days")
+        mock_details.return_value = {"success": True, "obj": {"packageList": [other]}}
+
+        with patch('esim.plans.store', self.store):
+            self.assertEqual(resolve_plan("CKH001", "esimaccess")["name"], "Nigeria 1GB 7Days")
+            mock_details.assert_not_called()
+            self.assertEqual(resolve_plan("CKH999", None), other)
+        mock_details.assert_called_once_with("CKH999", ESIMACCESS)
+
+    @patch('esim.plans.fetch_esim_plan_details')
+    def test_expired_snapshot_price_is_not_used(self, mock_details):
+        self.store.refresh_in_background = MagicMock()
+        repriced = dict(PACKAGE, price=PACKAGE["price"] + 5000)
+        mock_details.return_value = {"success": True, "obj": {"packageList": [repriced]}}
+        expired = time.time() + 120  # Past the 60s TTL, within the stale window
+
+        with patch('esim.plans.store', self.store), patch('esim.catalogue.time.time', return_value=expired):
+            self.assertEqual(resolve_plan("CKH001", "esimaccess")["price"], repriced["price"])
+            self.assertIsNotNone(self.store.find(ESIMACCESS, "CKH001")[0])
+            self.assertEqual(self.store.find(ESIMACCESS, "CKH001", max_age=60), (None, None))
+        mock_details.assert_called_once_with("CKH001", ESIMACCESS)
+
+        past_stale = expired + self.store.stale_ttl
+        with patch('esim.catalogue.time.time', return_value=past_stale):
+            self.assertEqual(self.store.find(ESIMACCESS, "CKH001"), (None, None))
+
+    @patch('esim.plans.fetch_esim_plan_details')
+    def test_payment_creation_freezes_the_plan(self, mock_details):
+        user = get_user_model().objects.create_user(email="pay@example.com", username="pay", password="secret123")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with patch('esim.plans.store', self.store):
+            response = client.post('/api/payments/', {
+                "price": "10.00", "package_code": "CKH001", "seller": "esimaccess", "payment_gateway": "Stripe",
+            }, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        mock_details.assert_not_called()
+        payment = Payment.objects.get(user=user)
+        self.assertEqual(payment.esim_plan, "Nigeria 1GB 7Days")
+        self.assertEqual(payment.plan_details["locationNetworkList"], [{"locationCode": "NG"}])
+
+    @patch('esim.plans.fetch_esim_plan_details', return_value=None)
+    def test_unknown_plan_is_rejected_without_saving_a_payment(self, mock_details):
+        user = get_user_model().objects.create_user(email="nopay@example.com", username="nopay", password="secret123")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with patch('esim.plans.store', self.store):
+            response = client.post('/api/payments/', {
+                "price": "10.00", "package_code": "CKH999", "seller": "esimaccess", "payment_gateway": "CoinPayments",
+            }, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.filter(user=user).exists())
+
+
+class UsagePollerTests(TestCase):
+    """Test the prioritised usage snapshot poller."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email="poll@example.com", username="poll", password="secret123")
+        payment = Payment.objects.create(user=user, price=10, package_code="CKH001")
+        valid_until = now() + timedelta(days=30)
+        self.never_polled = _create_plan(user, payment, order_no="B1", expires_on=valid_until)
+        self.expiring = _create_plan(user, payment, order_no="B2", expires_on=valid_until)
+        self.idle = _create_plan(user, payment, order_no="B3", expires_on=valid_until)
+        self.finished = _create_plan(user, payment, order_no="B4", expires_on=valid_until)
+
+        old = now() - timedelta(hours=1)
+        for plan, expires, status in (
+            (self.expiring, now() + timedelta(hours=2), "IN_USE"),
+            (self.idle, now() + timedelta(days=20), "IN_USE"),
+            (self.finished, now() + timedelta(days=20), "USED_UP"),
+        ):
+            UsageSnapshot.objects.create(
+                plan=plan, order_no=plan.order_no, total_volume=1000, fetched_at=old,
+                usage_changed_at=now() - timedelta(days=3), expired_time=expires, esim_status=status,
+            )
+
+    def test_due_plans_are_ordered_by_priority(self):
+        due = plans_due_for_poll(batch_size=10, min_age=60)
+        self.assertEqual([plan.order_no for plan in due], ["B1", "B2", "B3"])
+        self.assertEqual(plans_due_for_poll(batch_size=10, min_age=7200), [self.never_polled])
+
+    def test_near_expiry_plan_is_polled_before_an_idle_one(self):
+        # Snapshot ids must not decide the order: the idle plan's snapshot is the older row.
+        user = self.never_polled.user
+        idle = _create_plan(user, self.never_polled.payment, order_no="B5", expires_on=now() + timedelta(days=30))
+        expiring = _create_plan(user, self.never_polled.payment, order_no="B6", expires_on=now() + timedelta(days=30))
+        for plan, expires in ((idle, now() + timedelta(days=25)), (expiring, now() + timedelta(minutes=30))):
+            UsageSnapshot.objects.create(
+                plan=plan, order_no=plan.order_no, total_volume=1000, fetched_at=now() - timedelta(hours=1),
+                usage_changed_at=now() - timedelta(days=5), expired_time=expires, esim_status="IN_USE",
+            )
+
+        due = [plan.order_no for plan in plans_due_for_poll(batch_size=10, min_age=60)]
+        self.assertLess(due.index("B6"), due.index("B5"))
+        self.assertEqual(due[:2], ["B1", "B6"])
+
+    def test_expired_plans_are_not_polled_and_the_batch_is_limited_in_sql(self):
+        self.never_polled.expires_on = now() - timedelta(days=1)
+        self.never_polled.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            due = plans_due_for_poll(batch_size=1, min_age=60)
+        self.assertEqual(due, [self.expiring])
+        self.assertEqual(len(queries), 1)
+        self.assertIn("LIMIT 1", queries[0]["sql"])
+
+    @patch('esim.usage.query_esim_order')
+    def test_poll_writes_snapshots_in_batches(self, mock_query):
+        mock_query.side_effect = lambda order_no, timeout: [{
+            "orderNo": order_no, "iccid": f"ICC-{order_no}", "orderUsage": 250, "totalVolume": 1000,
+            "totalDuration": 7, "activateTime": "2024-05-01T10:00:00+0000", "esimStatus": "IN_USE",
+        }]
+
+        self.assertEqual(poll_usage(batch_size=2, min_age=60), (2, 2))
+
+        self.assertEqual(mock_query.call_count, 2)
+        snapshot = UsageSnapshot.objects.get(plan=self.never_polled)
+        self.assertEqual((snapshot.iccid, snapshot.order_usage), ("ICC-B1", 250))
+        self.assertEqual(snapshot.activate_time.year, 2024)
+        self.assertEqual(UsageSnapshot.objects.get(plan=self.expiring).order_usage, 250)
+        self.assertEqual(UsageSnapshot.objects.get(plan=self.idle).order_usage, 0)
+
+    @override_settings(ESIM_USAGE_REFRESH_DEADLINE_SECONDS=5, ESIM_USAGE_POLL_DEADLINE_SECONDS=60)
+    @patch('esim.usage.refresh_usage', return_value={})
+    def test_poller_waits_on_its_own_deadline(self, mock_refresh):
+        poll_usage(batch_size=2, min_age=60)
+        self.assertEqual(mock_refresh.call_args.args[1], 60)
+
+        call_command("poll_usage", "--batch-size", "2", "--deadline", "90", stdout=MagicMock())
+        self.assertEqual(mock_refresh.call_args.args[1], 90)
+
+    @patch('esim.usage.query_esim_order')
+    def test_plans_without_usage_back_off_without_tripping_the_breaker(self, mock_query):
+        def query(order_no, timeout):
+            if order_no == "B1":
+                raise UsageRejectedError("API error for order B1: order not allocated")
+            return []  # Nothing allocated for B2 yet
+        mock_query.side_effect = query
+        breaker = CircuitBreaker("esimaccess:esim/query", failure_threshold=1)
+
+        with patch('esim.usage.breaker_for', return_value=breaker):
+            self.assertEqual(poll_usage(batch_size=2, min_age=60), (2, 0))
+        self.assertEqual(breaker.stats(), {"state": "closed", "failures": 0})
+
+        self.never_polled.refresh_from_db()
+        self.assertEqual(self.never_polled.usage_poll_failures, 1)
+        self.assertGreater(self.never_polled.usage_poll_retry_at, now())
+        self.assertEqual([plan.order_no for plan in plans_due_for_poll(batch_size=10, min_age=60)], ["B3"])
+
+        # Once the backoff lapses the plan queues behind plans that have usage.
+        later = now() + timedelta(minutes=5)
+        self.assertEqual([plan.order_no for plan in plans_due_for_poll(batch_size=10, min_age=60, at=later)], ["B2", "B3", "B1"])
+
+
+class eSIMProfileViewTests(TestCase):
+    """Test that profile enrichment loads plans with one query."""
+
+    def setUp(self):
+        self.client = APIClient()
+        user = get_user_model().objects.create_user(email="profile@example.com", username="profile", password="secret123")
+        payment = Payment.objects.create(user=user, price=10, package_code="CKH001")
+        for order_no in ("B1", "B2", "B3"):
+            _create_plan(user, payment, order_no=order_no)
+
+    @patch('esim.views.esimaccess_http.post')
+    def test_profiles_are_enriched_without_a_query_per_esim(self, mock_post):
+        esims = [
+            {"orderNo": order_no, "iccid": f"ICC-{order_no}", "orderUsage": 256 * 1024 ** 2,
+             "totalVolume": 1024 ** 3, "activateTime": None, "totalDuration": 7}
+            for order_no in ("B1", "B2", "B3", "B9")
+        ]
+        mock_post.return_value = MagicMock(
+            status_code=200, json=lambda: {"success": True, "obj": {"esimList": esims}}
+        )
+
+        # Snapshot lookup for the ICCID, then every plan in one query.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/esim/profile/', {"iccid": "ICC-B1"})
+
+        data = response.json()["data"]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data[0]["usageScale"], 0.75)
+        self.assertEqual(data[0]["formattedVolumeLeft"], "768 MB")
+        self.assertEqual(data[0]["formattedPrice"], "3.60")
+        self.assertEqual(data[0]["durationLeftScale"], 1)
+        self.assertIsNone(data[3]["price"])
+
+    @patch('esim.views.esimaccess_http.post')
+    def test_profiles_of_a_batched_order_are_matched_by_iccid(self, mock_post):
+        user = get_user_model().objects.get(email="profile@example.com")
+        payment = Payment.objects.create(user=user, price=10, package_code="CKH002")
+        _create_plan(user, payment, order_no="B4", iccid="ICC-B4-2", package_code="CKH002", price=42000)
+        eSIMPlan.objects.filter(order_no="B3").update(order_no="B4", iccid="ICC-B4-1")
+        esims = [
+            {"orderNo": "B4", "iccid": iccid, "orderUsage": 0, "totalVolume": 1024 ** 3,
+             "activateTime": None, "totalDuration": 7}
+            for iccid in ("ICC-B4-2", "ICC-B4-1", "ICC-B4-3")
+        ]
+        mock_post.return_value = MagicMock(
+            status_code=200, json=lambda: {"success": True, "obj": {"esimList": esims}}
+        )
+
+        data = self.client.get('/api/esim/profile/', {"orderNo": "B4"}).json()["data"]
+
+        self.assertEqual([item["price"] for item in data], [42000, 18000, None])
+
+
+def _httpx_response(status_code, payload):
+    return httpx.Response(status_code, json=payload, request=httpx.Request("GET", "https://vendor.example"))
+
+
+@override_settings(ESIM_CATALOGUE_BACKGROUND_REFRESH=False)
+class AsyncViewTests(TestCase):
+    """Test that the async views await their vendor calls and answer like the DRF views."""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = get_user_model().objects.create_user(
+            email="async@example.com", username="async", password="secret123"
+        )
+        payment = Payment.objects.create(user=self.user, price=10, package_code="CKH001")
+        self.first = _create_plan(self.user, payment, order_no="B1", iccid="8901")
+        self.slow = _create_plan(self.user, payment, order_no="B2", volume_used=str(512 * 1024 ** 2))
+        self.cache = BundleCache(ttl=60, max_entries=10)
+        patcher = patch('esim.esimgo.bundle_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, path, params=None, user=None):
+        request = self.factory.get(path, params or {})
+
+        async def auser():
+            return user or AnonymousUser()
+        request.auser = auser
+        return request
+
+    async def test_concurrent_bundle_lookups_share_one_esimgo_call(self):
+        async def get(url, **kwargs):
+            await asyncio.sleep(0.05)
+            return _httpx_response(200, _copy(ESIMGO_BUNDLES)[0])
+
+        view = ESIMGoPlanDetailAsyncView.as_view()
+        with patch('esim.esimgo.esimgo_async.get', AsyncMock(side_effect=get)) as mock_get:
+            responses = await asyncio.gather(*(
+                view(self._get('/api/esim/plan/esimgo/', {"name": "esim_ULE_1D_NG_V2"})) for _ in range(5)
+            ))
+            missing = await view(self._get('/api/esim/plan/esimgo/'))
+
+        mock_get.assert_called_once()
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(json.loads(responses[0].content)["data"]["formattedVolume"], "Unlimited")
+        self.assertEqual(missing.status_code, 400)
+
+    async def test_bundle_errors_match_the_drf_view(self):
+        async_view, sync_view = ESIMGoPlanDetailAsyncView.as_view(), ESIMGoPlanDetailView.as_view()
+        sync_response = MagicMock(status_code=404)
+        with patch('esim.esimgo.esimgo_async.get', AsyncMock(return_value=_httpx_response(404, {}))), \
+                patch('esim.esimgo.esimgo_http.get', return_value=sync_response):
+            response = await async_view(self._get('/api/esim/plan/esimgo/', {"name": "esim_gone"}))
+            expected = await sync_to_async(sync_view)(self._get('/api/esim/plan/esimgo/', {"name": "esim_gone"}))
+
+        self.assertEqual(response.status_code, 404)
+        expected.render()
+        self.assertEqual(response.content, expected.content)
+
+    async def test_profile_query_is_awaited(self):
+        esims = [{"orderNo": "B1", "iccid": "8901", "orderUsage": 256 * 1024 ** 2,
+                  "totalVolume": 1024 ** 3, "activateTime": None, "totalDuration": 7}]
+        response = _httpx_response(200, {"success": True, "obj": {"esimList": esims}})
+        with patch('esim.views.esimaccess_async.post', AsyncMock(return_value=response)) as mock_post:
+            response = await eSIMProfileAsyncView.as_view()(self._get('/api/esim/profile/', {"orderNo": "B1"}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_post.call_args.kwargs["endpoint"], "esim/query")
+        self.assertEqual(json.loads(response.content)["data"][0]["usageScale"], 0.75)
+
+    @override_settings(ESIM_USAGE_REFRESH_DEADLINE_SECONDS=0.2)
+    async def test_user_plans_await_usage_under_the_deadline(self):
+        async def query(order_no, timeout):
+            if order_no == "B2":
+                await asyncio.sleep(1)
+            return [{"iccid": "8901", "orderUsage": 100, "totalVolume": 1000, "activateTime": None, "totalDuration": 7}]
+
+        view = eSIMPlanListCreateAsyncView.as_view()
+        with patch('esim.usage.aquery_esim_order', AsyncMock(side_effect=query)):
+            started = time.monotonic()
+            response = await view(self._get('/api/esim/user/plans/', user=self.user))
+            elapsed = time.monotonic() - started
+        anonymous = await view(self._get('/api/esim/user/plans/'))
+        invalid = await view(self._get('/api/esim/user/plans/', {"status": "old"}, user=self.user))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.9)
+        plans = {plan["id"]: plan for plan in json.loads(response.content)["data"]}
+        self.assertEqual(plans[self.first.id]["volume_used"], "100")
+        self.assertEqual(plans[self.slow.id]["formattedVolumeLeft"], "512 MB")
+        await self.first.arefresh_from_db()
+        self.assertEqual(self.first.volume_used, "100")
+        self.assertEqual(anonymous.status_code, 403)
+        self.assertEqual(invalid.status_code, 400)
+
+    async def test_cached_plan_lists_are_served_without_a_thread(self):
+        request = self._get('/api/esim/plans/', {"locationCode": "NG"})
+        cache = ResponseCache()
+        cache.set(plan_list_filters(request.GET)[1], b'{"status":true}', 60)
+        with patch('esim.views.plans_cache', cache), patch('esim.views.run_sync_view') as mock_run:
+            response = await eSIMPlanListAsyncView.as_view()(request)
+
+        mock_run.assert_not_called()
+        self.assertEqual(response.content, b'{"status":true}')
+
+    def test_async_views_are_routed_only_when_enabled(self):
+        self.assertFalse(asyncio.iscoroutinefunction(routed_view(ESIMGoPlanDetailView, ESIMGoPlanDetailAsyncView)))
+        with self.settings(ESIM_ASYNC_VIEWS=True):
+            view = routed_view(ESIMGoPlanDetailView, ESIMGoPlanDetailAsyncView)
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        self.assertIs(view.cls, ESIMGoPlanDetailView)  # Still documented by the API schema
+
+
+class PlanMetricsTests(TestCase):
+    """Test the shared usage/expiry computation."""
+
+    current = datetime(2025, 3, 10, 12, 0)
+    records = [
+        UsageRecord(1024 ** 3, 256 * 1024 ** 2, "2025-03-05T12:00:00+0000", 7),
+        UsageRecord(5 * 1024 ** 3, 0, None, 30),
+        UsageRecord(1024 ** 3, 1024 ** 3 - 5 * 1024 ** 2, "2025-03-03T13:30:00+0000", 7),
+        UsageRecord(0, 0, None, 0),
+    ]
+
+    def test_derived_fields(self):
+        metrics = compute_plan_metrics(self.records, current_datetime=self.current, use_numpy=False)
+
+        self.assertEqual(metrics[0].used_scale, 0.2)
+        self.assertEqual(metrics[0].remaining_scale, 0.75)
+        self.assertEqual(metrics[0].duration_left_label, "2.0 days")
+        self.assertAlmostEqual(metrics[0].duration_left_scale, 2 / 7)
+        self.assertEqual(metrics[0].formatted_volume_left, "768 MB")
+        self.assertEqual(metrics[1].duration_left_label, "30.0 days")
+        self.assertEqual(metrics[1].formatted_volume_left, "5.0 GB")
+        self.assertEqual(metrics[2].duration_left_label, "1.0 hours")
+        self.assertEqual(metrics[3].used_scale, 0)
+        self.assertEqual(metrics[3].duration_left_scale, 0)
+
+    @unittest.skipUnless(numpy_available(), "NumPy is not installed")
+    def test_numpy_path_matches_python_path(self):
+        # Rounding ties: 1/20 and 512 MB of 10 GB are exactly 0.05 of the plan.
+        ties = [
+            UsageRecord(20, 1, None, 7),
+            UsageRecord(10240, 512, None, 7),
+            UsageRecord(10 * 1024 ** 3, 512 * 1024 ** 2, None, 7),
+        ]
+        small = [UsageRecord(total, used, None, 7) for total in range(1, 200) for used in range(total + 1)]
+        records = self.records + ties + small
+
+        python = compute_plan_metrics(records, current_datetime=self.current, use_numpy=False)
+        vectorized = compute_plan_metrics(records, current_datetime=self.current, use_numpy=True)
+        self.assertEqual(python, vectorized)
+        self.assertEqual([metrics.used_scale for metrics in vectorized[4:7]], [0.1, 0.1, 0.1])
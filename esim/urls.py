@@ -1,20 +1,41 @@
 from django.urls import path
+from magic_esim.async_views import routed_view
 from .views import (
     eSIMPlanListView,
+    eSIMPlanListAsyncView,
+    eSIMPlanBatchView,
+    CatalogueStatusView,
     ESIMGoPlanDetailView, 
+    ESIMGoPlanDetailAsyncView,
     eSIMProfileView, 
+    eSIMProfileAsyncView,
     eSIMPlanListCreateView, 
+    eSIMPlanListCreateAsyncView,
     eSIMPlanDetailView,
     CountriesListView,
-    PopularCountriesListView
+    PopularCountriesListView,
+    eSIMAccessWebhookView,
+    eSIMUsageStreamView,
+    eSIMUsageChangesView,
 )
+from django.conf import settings
 
 urlpatterns = [
-    path('plans/', eSIMPlanListView.as_view(), name='esim-plans-list'),
-    path('plan/esimgo/', ESIMGoPlanDetailView.as_view(), name='esimgo-plan-details'),
-    path('profile/', eSIMProfileView.as_view(), name='esim-profile'),
-    path('user/plans/', eSIMPlanListCreateView.as_view(), name='user-esim-plan'),
+    path('plans/', routed_view(eSIMPlanListView, eSIMPlanListAsyncView), name='esim-plans-list'),
+    path('plans/batch/', eSIMPlanBatchView.as_view(), name='esim-plans-batch'),
+    path('plans/catalogue/status/', CatalogueStatusView.as_view(), name='esim-catalogue-status'),
+    path('plan/esimgo/', routed_view(ESIMGoPlanDetailView, ESIMGoPlanDetailAsyncView), name='esimgo-plan-details'),
+    path('profile/', routed_view(eSIMProfileView, eSIMProfileAsyncView), name='esim-profile'),
+    path('user/plans/', routed_view(eSIMPlanListCreateView, eSIMPlanListCreateAsyncView), name='user-esim-plan'),
+    path('user/plans/changes/', eSIMUsageChangesView.as_view(), name='user-esim-plan-changes'),
     path('user/plans/<int:pk>/', eSIMPlanDetailView.as_view(), name='user-esim-plan-detail'),
     path('countries/', CountriesListView.as_view(), name='countries-list'),
     path('countries/popular/', PopularCountriesListView.as_view(), name='popular-countries-list'),
+    path('webhooks/esimaccess/', eSIMAccessWebhookView.as_view(), name='esimaccess-webhook'),
 ]
+
+# Under WSGI an async stream is buffered whole; clients long-poll `changes/` instead.
+if getattr(settings, "ESIM_ASYNC_VIEWS", False):
+    urlpatterns.append(
+        path('user/plans/stream/', eSIMUsageStreamView.as_view(), name='user-esim-plan-stream'),
+    )
@@ -0,0 +1,496 @@
+"""
+Usage refresh for purchased eSIMs.
+
+The user plans dashboard used to query eSIMAccess once per plan, serially
+and without a timeout. ``refresh_usage`` sends one ``/esim/query`` per
+distinct order number (an order's profiles all fit in one page), runs
+those queries on a bounded pool and stops waiting at a global deadline.
+Plans whose order did not answer in time keep their last stored usage.
+
+Results are persisted as ``UsageSnapshot`` rows. eSIMAccess webhooks (see
+``webhooks``) and the ``poll_usage`` management command keep them current
+in the background, so dashboards can read usage from the database and only
+query eSIMAccess for plans whose snapshot is missing or too old.
+
+``arefresh_usage`` is the same refresh for async views: the order queries
+are awaited together on the event loop instead of using the pool.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+
+from decouple import config
+from django.conf import settings
+from django.db.models import Case, DateTimeField, DurationField, ExpressionWrapper, Q, Value, When
+from django.db.models.functions import Coalesce, Least
+from django.utils.timezone import now
+
+from magic_esim.vendors import esimaccess_async, esimaccess_http
+
+from .circuit import breaker_for
+from .metrics import UsageRecord, compute_plan_metrics, parse_activate_time
+from .models import UsageSnapshot, eSIMPlan
+from .singleflight import async_vendor_flights, vendor_flights
+
+
+logger = logging.getLogger(__name__)
+
+# eSIMAccess caps pageSize; one page holds every profile of a normal order.
+USAGE_QUERY_PAGE_SIZE = 50
+
+# eSIMAccess statuses after which usage can no longer change.
+FINISHED_ESIM_STATUSES = ("USED_UP", "USED_EXPIRED", "UNUSED_EXPIRED", "CANCEL", "REVOKED")
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "ESIM_USAGE_REFRESH_WORKERS", 8),
+    thread_name_prefix="esim-usage",
+)
+
+
+class UsageQueryError(Exception):
+    """Raised when eSIMAccess cannot report usage for an order."""
+
+
+class UsageRejectedError(UsageQueryError):
+    """Raised when eSIMAccess answers but reports an error for the order, e.g. not allocated yet or cancelled."""
+
+
+def _query_request(order_no, timeout):
+    esim_host = config("ESIMACCESS_HOST")
+    api_token = config("ESIMACCESS_ACCESS_CODE")
+    params = {
+        "orderNo": order_no,
+        "iccid": "",
+        "pager": {
+            "pageNum": 1,
+            "pageSize": USAGE_QUERY_PAGE_SIZE
+        }
+    }
+    return dict(
+        url=f"{esim_host}/api/v1/open/esim/query",
+        json=params,
+        headers={"RT-AccessCode": api_token},
+        timeout=timeout,
+        endpoint="esim/query",
+        idempotent=True,
+    )
+
+
+def query_esim_order(order_no, timeout=15):
+    """Return the eSIMAccess ``esimList`` for ``order_no``."""
+    return _esim_list(esimaccess_http.post(**_query_request(order_no, timeout)), order_no)
+
+
+async def aquery_esim_order(order_no, timeout=15):
+    """``query_esim_order`` for async views."""
+    return _esim_list(await esimaccess_async.post(**_query_request(order_no, timeout)), order_no)
+
+
+def _esim_list(response, order_no):
+    if response.status_code != 200:
+        raise UsageQueryError(f"HTTP error {response.status_code} for order {order_no}: {response.text}")
+
+    api_response = response.json() or {}
+    if not api_response.get("success", False):
+        raise UsageRejectedError(f"API error for order {order_no}: {api_response.get('errorMsg', 'Unknown error')}")
+    return (api_response.get("obj") or {}).get("esimList", [])
+
+
+def _query_order(order_no, timeout):
+    query = partial(
+        breaker_for("esimaccess:esim/query").call,
+        query_esim_order, order_no, timeout=timeout, ignore=(UsageRejectedError,),
+    )
+    return vendor_flights.do(("esim-query", order_no), query)
+
+
+async def _aquery_order(order_no, timeout):
+    query = partial(
+        breaker_for("esimaccess:esim/query").acall,
+        aquery_esim_order, order_no, timeout=timeout, ignore=(UsageRejectedError,),
+    )
+    return await async_vendor_flights.do(("esim-query", order_no), query)
+
+
+def match_profiles(plans, esims):
+    """
+    Pair the plans of one order with the profiles eSIMAccess returned for it.
+
+    Plans with a known ICCID take the matching profile; the rest take the
+    remaining profiles in order, preferring one of the plan's package (a
+    batched order holds profiles of several packages). Returns
+    ``{plan.pk: esim}``.
+    """
+    by_iccid = {esim.get("iccid"): esim for esim in esims if esim.get("iccid")}
+    matched = {}
+    used = set()
+    for plan in plans:
+        esim = by_iccid.get(plan.iccid) if plan.iccid else None
+        if esim is not None:
+            matched[plan.pk] = esim
+            used.add(id(esim))
+
+    remaining = [esim for esim in esims if id(esim) not in used]
+    for plan in plans:
+        if plan.pk in matched:
+            continue
+        if not remaining:
+            break
+        index = next(
+            (i for i, esim in enumerate(remaining) if plan.package_code in _package_codes(esim)),
+            0,
+        )
+        matched[plan.pk] = remaining.pop(index)
+    return matched
+
+
+def _package_codes(esim):
+    return {package.get("packageCode") for package in esim.get("packageList") or []}
+
+
+def refresh_usage(plans, deadline=None):
+    """
+    Fetch live usage for ``plans`` under one deadline.
+
+    Returns ``{plan.pk: esim}`` for every plan whose order answered in time;
+    plans missing from the result should fall back to their stored usage.
+    """
+    deadline = deadline if deadline is not None else getattr(settings, "ESIM_USAGE_REFRESH_DEADLINE_SECONDS", 5)
+    by_order = _plans_by_order(plans)
+    if not by_order:
+        return {}
+
+    futures = {_executor.submit(_query_order, order_no, deadline): order_no for order_no in by_order}
+    done, not_done = wait(futures, timeout=deadline)
+    for future in not_done:
+        future.cancel()
+        logger.warning("Usage query for order %s exceeded the %ss deadline", futures[future], deadline)
+
+    usage = {}
+    for future in done:
+        order_no = futures[future]
+        try:
+            esims = future.result()
+        except Exception as e:
+            logger.warning("Usage query for order %s failed: %s", order_no, e)
+            continue
+        usage.update(match_profiles(by_order[order_no], esims))
+    return usage
+
+
+async def arefresh_usage(plans, deadline=None):
+    """``refresh_usage`` for async views: the order queries are awaited together instead of using the pool."""
+    deadline = deadline if deadline is not None else getattr(settings, "ESIM_USAGE_REFRESH_DEADLINE_SECONDS", 5)
+    by_order = _plans_by_order(plans)
+    if not by_order:
+        return {}
+
+    tasks = {asyncio.ensure_future(_aquery_order(order_no, deadline)): order_no for order_no in by_order}
+    done, not_done = await asyncio.wait(tasks, timeout=deadline)
+    for task in not_done:
+        task.cancel()
+        logger.warning("Usage query for order %s exceeded the %ss deadline", tasks[task], deadline)
+
+    usage = {}
+    for task in done:
+        order_no = tasks[task]
+        try:
+            esims = task.result()
+        except Exception as e:
+            logger.warning("Usage query for order %s failed: %s", order_no, e)
+            continue
+        usage.update(match_profiles(by_order[order_no], esims))
+    return usage
+
+
+def _plans_by_order(plans):
+    by_order = {}
+    for plan in plans:
+        if plan.order_no:
+            by_order.setdefault(plan.order_no, []).append(plan)
+    return by_order
+
+
+def dashboard_fields(metrics):
+    """The user plans dashboard fields for one ``PlanMetrics``."""
+    return {
+        "usageScale": metrics.used_scale,
+        "durationLeft": metrics.duration_left_label,
+        "formattedVolumeLeft": metrics.formatted_volume_left,
+    }
+
+
+def enrich_profiles(items, plans_by_iccid, plans_by_order):
+    """
+    Add the profile page fields to a list of eSIMAccess ``esimList`` entries in place.
+
+    Entries are matched to their ``eSIMPlan`` by ICCID, or by order number
+    for orders holding a single plan (a batched order holds several, so its
+    number alone does not say which). Both maps must be loaded up front in
+    one query; entries without a plan get ``price=None``. Sets ``price``,
+    ``usageScale`` (share of data left), ``durationLeft``,
+    ``durationLeftScale``, ``formattedVolumeLeft`` and ``formattedPrice``.
+    """
+    matched = []
+    for item in items:
+        if not item.get('orderNo') and not item.get('iccid'):
+            continue
+        esim_plan = plans_by_iccid.get(item.get('iccid')) or plans_by_order.get(item.get('orderNo'))
+        if esim_plan is None:
+            item['price'] = None
+            continue
+        matched.append((item, esim_plan))
+
+    metrics = compute_plan_metrics(
+        UsageRecord(item['totalVolume'], item['orderUsage'], item.get('activateTime'), item.get('totalDuration', 0))
+        for item, _ in matched
+    )
+    for (item, esim_plan), plan_metrics in zip(matched, metrics):
+        item['price'] = esim_plan.price
+        item['usageScale'] = plan_metrics.remaining_scale
+        item['durationLeft'] = plan_metrics.duration_left_label
+        item['durationLeftScale'] = plan_metrics.duration_left_scale
+        item["formattedVolumeLeft"] = plan_metrics.formatted_volume_left
+        item["formattedPrice"] = f"{((esim_plan.price / 10000) * 2):.2f}"
+    return items
+
+
+_write_lock = threading.Lock()
+# Process-wide counters of plan rows written vs left untouched by persist_plan_usage.
+write_counters = {"written": 0, "skipped": 0}
+
+
+def persist_plan_usage(plans, usage):
+    """
+    Copy refreshed ``activateTime``/``orderUsage`` (and a missing ``iccid``)
+    from ``usage`` onto ``plans`` and save only the rows whose values actually changed.
+
+    Changed rows are written with one ``bulk_update`` limited to the changed
+    fields. Returns ``(written, skipped)``.
+    """
+    changed = []
+    fields = set()
+    skipped = 0
+    for plan in plans:
+        esim = usage.get(plan.pk)
+        if esim is None:
+            continue
+        updates = {}
+        if "activateTime" in esim:
+            updates["activated_on"] = parse_vendor_time(esim["activateTime"])
+        if "orderUsage" in esim:
+            updates["volume_used"] = str(esim["orderUsage"]) if esim["orderUsage"] is not None else None
+        if esim.get("iccid") and not plan.iccid:
+            updates["iccid"] = esim["iccid"]  # Profiles of batched orders are assigned once allocated
+
+        updates = {field: value for field, value in updates.items() if getattr(plan, field) != value}
+        if not updates:
+            skipped += 1
+            continue
+        for field, value in updates.items():
+            setattr(plan, field, value)
+        fields.update(updates)
+        changed.append(plan)
+
+    if changed:
+        eSIMPlan.objects.bulk_update(changed, sorted(fields))
+    with _write_lock:
+        write_counters["written"] += len(changed)
+        write_counters["skipped"] += skipped
+    return len(changed), skipped
+
+
+def parse_vendor_time(value):
+    """Parse an eSIMAccess timestamp such as ``2024-05-01T10:00:00+0000``; None stays None."""
+    if not value:
+        return None
+    return parse_activate_time(value)
+
+
+def store_snapshots(plans, usage, fetched_at=None):
+    """
+    Persist the ``usage`` returned by ``refresh_usage`` as one ``UsageSnapshot`` per plan.
+
+    Existing rows are updated and new ones created in bulk. Returns
+    ``{plan.pk: snapshot}`` for every plan in ``usage``.
+    """
+    fetched_at = fetched_at or now()
+    plans = [plan for plan in plans if plan.pk in usage]
+    existing = {
+        snapshot.plan_id: snapshot
+        for snapshot in UsageSnapshot.objects.filter(plan__in=[plan.pk for plan in plans])
+    }
+
+    snapshots = {}
+    created = []
+    for plan in plans:
+        esim = usage[plan.pk]
+        snapshot = existing.get(plan.pk) or UsageSnapshot(plan=plan)
+        order_usage = esim.get("orderUsage") or 0
+        if snapshot.pk is None or snapshot.order_usage != order_usage:
+            snapshot.usage_changed_at = fetched_at
+        snapshot.order_no = esim.get("orderNo") or plan.order_no
+        snapshot.iccid = esim.get("iccid") or plan.iccid
+        snapshot.order_usage = order_usage
+        snapshot.total_volume = esim.get("totalVolume") or 0
+        snapshot.total_duration = esim.get("totalDuration") or 0
+        snapshot.activate_time = parse_vendor_time(esim.get("activateTime"))
+        snapshot.expired_time = parse_vendor_time(esim.get("expiredTime"))
+        snapshot.esim_status = esim.get("esimStatus")
+        snapshot.smdp_status = esim.get("smdpStatus")
+        snapshot.payload = esim
+        snapshot.fetched_at = fetched_at
+        snapshots[plan.pk] = snapshot
+        if snapshot.pk is None:
+            created.append(snapshot)
+
+    updated = [snapshot for snapshot in snapshots.values() if snapshot.pk is not None]
+    UsageSnapshot.objects.bulk_create(created)
+    UsageSnapshot.objects.bulk_update(updated, [
+        "order_no", "iccid", "order_usage", "total_volume", "total_duration", "activate_time",
+        "expired_time", "esim_status", "smdp_status", "payload", "fetched_at", "usage_changed_at",
+    ])
+    return snapshots
+
+
+def current_snapshot(plan, max_age=None):
+    """
+    The plan's ``UsageSnapshot`` if it is younger than ``max_age`` seconds, else None.
+
+    By default snapshots of eSIMs updated by webhook stay current for
+    ``ESIM_USAGE_PUSH_MAX_AGE_SECONDS`` rather than the polling max age.
+
+    Expects ``plan`` to be loaded with ``select_related("usage_snapshot")``.
+    """
+    if not hasattr(plan, "usage_snapshot"):
+        return None
+    snapshot = plan.usage_snapshot
+    if max_age is None:
+        max_age = getattr(settings, "ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS", 300)
+        if snapshot.pushed_at is not None:
+            # eSIMAccess pushes changes for this eSIM, so polling is only a safety net.
+            max_age = max(max_age, getattr(settings, "ESIM_USAGE_PUSH_MAX_AGE_SECONDS", 21600))
+    if (now() - snapshot.fetched_at).total_seconds() >= max_age:
+        return None
+    return snapshot
+
+
+def usage_record(plan, snapshot=None):
+    """The ``UsageRecord`` for a plan: from its snapshot when there is one, else the stored plan fields."""
+    if snapshot is not None:
+        return UsageRecord(snapshot.total_volume, snapshot.order_usage, snapshot.activate_time, snapshot.total_duration)
+    return UsageRecord(plan.volume, plan.volume_used, plan.activated_on, plan.duration)
+
+
+def freshness(snapshot):
+    """``usageFetchedAt``/``usageAge`` for a snapshot (both None when usage was never fetched)."""
+    if snapshot is None:
+        return {"usageFetchedAt": None, "usageAge": None}
+    return {
+        "usageFetchedAt": snapshot.fetched_at,
+        "usageAge": round((now() - snapshot.fetched_at).total_seconds()),
+    }
+
+
+def poll_priority(at):
+    """
+    ``order_by`` terms for the poller, most urgent first.
+
+    Plans never polled come first; then plans whose usage changed recently
+    or that are closest to expiry, since both are what users check. Plans
+    whose polls keep returning no usage come last.
+    """
+    last_activity = Coalesce("usage_snapshot__usage_changed_at", "usage_snapshot__activate_time", "date_created")
+    expires = Coalesce("usage_snapshot__expired_time", "expires_on")
+    at = Value(at, output_field=DateTimeField())
+    return (
+        Case(
+            When(usage_snapshot__isnull=True, usage_poll_failures=0, then=0),
+            When(usage_snapshot__isnull=True, then=2),
+            default=1,
+        ).asc(),
+        Least(
+            ExpressionWrapper(at - last_activity, output_field=DurationField()),
+            ExpressionWrapper(expires - at, output_field=DurationField()),
+        ).asc(),
+    )
+
+
+def expired_q(at=None):
+    """Plans that are past their expiry or whose eSIM reached a finished status."""
+    at = at or now()
+    return (
+        Q(expires_on__lt=at)
+        | Q(usage_snapshot__esim_status__in=FINISHED_ESIM_STATUSES)
+        | Q(usage_snapshot__expired_time__lt=at)
+    )
+
+
+def plans_due_for_poll(batch_size, min_age, at=None):
+    """
+    Up to ``batch_size`` active plans whose snapshot is missing or older than ``min_age`` seconds.
+
+    Plans updated by webhook within ``ESIM_USAGE_PUSH_MAX_AGE_SECONDS`` are not
+    polled, nor are plans backing off after failed polls (see ``record_poll_outcomes``).
+    """
+    at = at or now()
+    push_max_age = getattr(settings, "ESIM_USAGE_PUSH_MAX_AGE_SECONDS", 21600)
+    plans = (
+        eSIMPlan.objects
+        .filter(seller="esimaccess", order_no__isnull=False)
+        .exclude(order_no="")
+        .exclude(expired_q(at))
+        .exclude(usage_snapshot__pushed_at__gte=at - timedelta(seconds=push_max_age))
+        .filter(Q(usage_snapshot__isnull=True) | Q(usage_snapshot__fetched_at__lt=at - timedelta(seconds=min_age)))
+        .filter(Q(usage_poll_retry_at__isnull=True) | Q(usage_poll_retry_at__lte=at))
+        .select_related("usage_snapshot")
+        .order_by(*poll_priority(at))
+    )
+    return list(plans[:batch_size])
+
+
+def record_poll_outcomes(plans, usage, min_age, at=None):
+    """
+    Back off the polled ``plans`` missing from ``usage`` and clear the backoff of the rest.
+
+    A plan whose order eSIMAccess rejects, returns no profile for or does
+    not answer in time waits ``min_age`` seconds, doubled per consecutive
+    failure up to ``ESIM_USAGE_POLL_MAX_BACKOFF_SECONDS``, before it is polled again.
+    """
+    at = at or now()
+    max_backoff = getattr(settings, "ESIM_USAGE_POLL_MAX_BACKOFF_SECONDS", 86400)
+    changed = []
+    for plan in plans:
+        if plan.pk in usage:
+            if not plan.usage_poll_failures and plan.usage_poll_retry_at is None:
+                continue
+            plan.usage_poll_failures = 0
+            plan.usage_poll_retry_at = None
+        else:
+            backoff = min(max(min_age, 1) * 2 ** min(plan.usage_poll_failures, 20), max_backoff)
+            plan.usage_poll_failures += 1
+            plan.usage_poll_retry_at = at + timedelta(seconds=backoff)
+        changed.append(plan)
+    if changed:
+        eSIMPlan.objects.bulk_update(changed, ["usage_poll_failures", "usage_poll_retry_at"])
+
+
+def poll_usage(batch_size=None, min_age=None, deadline=None):
+    """
+    Refresh one batch of usage snapshots. Returns ``(due, refreshed)`` plan counts.
+
+    The batch waits up to ``ESIM_USAGE_POLL_DEADLINE_SECONDS`` rather than the
+    dashboard deadline: answers arriving later were paid for but thrown away.
+    """
+    batch_size = batch_size or getattr(settings, "ESIM_USAGE_POLL_BATCH_SIZE", 100)
+    min_age = min_age if min_age is not None else getattr(settings, "ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS", 300)
+    at = now()
+    deadline = deadline if deadline is not None else getattr(settings, "ESIM_USAGE_POLL_DEADLINE_SECONDS", 60)
+    plans = plans_due_for_poll(batch_size, min_age, at)
+    usage = refresh_usage(plans, deadline)
+    store_snapshots(plans, usage)
+    record_poll_outcomes(plans, usage, min_age, at)
+    return len(plans), len(usage)
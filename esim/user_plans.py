@@ -0,0 +1,137 @@
+"""
+One page of the user plans dashboard (``/api/esim/user/plans/``).
+
+Shared by the DRF list view and its async counterpart, which differ only in
+how the stale plans' usage is fetched: ``refresh_usage`` on a thread pool
+or ``arefresh_usage`` on the event loop.
+"""
+from django.conf import settings
+
+from .metrics import compute_plan_metrics
+from .pagination import InvalidCursor, keyset_page
+from .usage import (
+    current_snapshot,
+    dashboard_fields,
+    expired_q,
+    freshness,
+    persist_plan_usage,
+    store_snapshots,
+    usage_record,
+)
+
+
+class InvalidPlansQuery(ValueError):
+    """Raised for query parameters the user plans list does not accept."""
+
+
+class UserPlansPage:
+    """
+    Validates the list's query parameters and loads the requested page.
+
+    ``stale`` holds the plans whose usage must be fetched live (none when no
+    requested field depends on usage); pass what was fetched to
+    ``apply_usage``, then render the page with ``payload``.
+    """
+
+    # Output fields that depend on the plan's current usage.
+    USAGE_FIELDS = frozenset({
+        "activated_on", "volume_used", "usageScale", "durationLeft",
+        "formattedVolumeLeft", "usageFetchedAt", "usageAge",
+    })
+    FIELDS = (
+        "id", "order_no", "iccid", "name", "slug", "package_code", "activated_on", "volume_used",
+        "esim_status", "duration", "currency_code", "speed", "volume", "price", "description",
+        "seller", "location_code", "location_code_lower", "expires_on", "smdp_status",
+        "duration_unit", "support_top_up_type", "usageScale", "durationLeft",
+        "formattedVolumeLeft", "usageFetchedAt", "usageAge",
+    )
+
+    def __init__(self, params, queryset):
+        fields = [field.strip() for field in params.get("fields", "").split(",") if field.strip()]
+        unknown = sorted(set(fields) - set(self.FIELDS))
+        if unknown:
+            raise InvalidPlansQuery(f"Unknown fields: {', '.join(unknown)}.")
+        self.fields = fields or list(self.FIELDS)
+
+        plan_status = params.get("status")
+        if plan_status not in (None, "", "active", "expired"):
+            raise InvalidPlansQuery("status must be 'active' or 'expired'.")
+
+        max_page_size = getattr(settings, "ESIM_USER_PLANS_MAX_PAGE_SIZE", 100)
+        try:
+            page_size = int(params.get("page_size") or getattr(settings, "ESIM_USER_PLANS_PAGE_SIZE", 20))
+        except ValueError:
+            raise InvalidPlansQuery("page_size must be an integer.")
+        self.page_size = max(1, min(page_size, max_page_size))
+
+        # Plans and their usage snapshots (kept current by `poll_usage`) in one query.
+        queryset = queryset.select_related("usage_snapshot")
+        if plan_status == "expired":
+            queryset = queryset.filter(expired_q())
+        elif plan_status == "active":
+            queryset = queryset.exclude(expired_q())
+        try:
+            self.plans, self.next_cursor = keyset_page(queryset, params.get("cursor"), self.page_size)
+        except InvalidCursor:
+            raise InvalidPlansQuery("Invalid cursor.")
+
+        # Usage is only refreshed for the page being returned, and not at all
+        # when none of the requested fields depend on it. Only plans without a
+        # recent snapshot are refreshed live; plans that miss the refresh
+        # deadline keep their stored usage.
+        self.snapshots = {plan.pk: getattr(plan, "usage_snapshot", None) for plan in self.plans}
+        self.needs_usage = bool(self.USAGE_FIELDS.intersection(self.fields))
+        self.stale = []
+        if self.needs_usage:
+            self.snapshots = {plan.pk: current_snapshot(plan) for plan in self.plans}
+            self.stale = [plan for plan in self.plans if self.snapshots[plan.pk] is None]
+
+    def apply_usage(self, usage):
+        """Store the ``usage`` fetched for ``stale``, writing only the plan rows whose usage changed."""
+        if not self.needs_usage:
+            return
+        self.snapshots.update(store_snapshots(self.stale, usage))
+        persist_plan_usage(self.plans, usage)
+        for plan in self.plans:
+            self.snapshots[plan.pk] = self.snapshots.get(plan.pk) or getattr(plan, "usage_snapshot", None)
+
+    def payload(self):
+        # Derived usage fields for every plan in one pass.
+        metrics = compute_plan_metrics(usage_record(plan, self.snapshots[plan.pk]) for plan in self.plans)
+
+        rows = []
+        for plan, plan_metrics in zip(self.plans, metrics):
+            summary = {**dashboard_fields(plan_metrics), **freshness(self.snapshots[plan.pk])}
+            row = {
+                "id": plan.id,
+                "order_no": plan.order_no,
+                "iccid": plan.iccid,
+                "name": plan.name,
+                "slug": plan.slug,
+                "package_code": plan.package_code,
+                "activated_on": plan.activated_on,
+                "volume_used": plan.volume_used,
+                "esim_status": plan.esim_status,
+                "duration": plan.duration,
+                "currency_code": plan.currency_code,
+                "speed": plan.speed,
+                "volume": plan.volume,
+                "price": plan.price,
+                "description": plan.description,
+                "seller": plan.seller,
+                "location_code": plan.location_code,
+                "location_code_lower": plan.location_code.lower() if plan.location_code else None,
+                "expires_on": plan.expires_on,
+                "smdp_status": plan.smdp_status,
+                "duration_unit": plan.duration_unit,
+                "support_top_up_type": plan.support_top_up_type,
+                **summary,
+            }
+            rows.append({field: row[field] for field in self.fields})
+
+        return {
+            "status": True,
+            "message": "User eSIM plans fetched successfully.",
+            "data": rows,
+            "pagination": {"next_cursor": self.next_cursor, "page_size": self.page_size},
+        }
@@ -1,8 +1,17 @@
+import logging
+
 import requests
 from decouple import config
 from datetime import timedelta
 from django.utils.timezone import now
 
+from magic_esim.vendors import esimaccess_http
+
+from .circuit import CircuitOpenError
+
+
+logger = logging.getLogger(__name__)
+
 
 esim_host = config('ESIMACCESS_HOST')
 api_token = config('ESIMACCESS_ACCESS_CODE')
@@ -14,31 +23,59 @@ def calculate_expiry_date(duration):
     return now() + timedelta(days=duration)
 
 
+def format_esimaccess_package(item):
+    """
+    Add the storefront display fields to an eSIMAccess package in place.
+    Volume is reported in bytes and price in 1/10000 USD.
+    """
+    volume_bytes = item.get("volume", 0)
+    if volume_bytes >= 1024 ** 3:
+        item["formattedVolume"] = f"{(volume_bytes / (1024 ** 3)):.1f} GB"
+    else:
+        item["formattedVolume"] = f"{(volume_bytes / (1024 ** 2)):.0f} MB"
+
+    # Price format (existing logic: (price / 10000) * 2)
+    price = item.get("price", 0)
+    item["formattedPrice"] = f"{((price / 10000) * 2):.2f}"
+    return item
+
+
+def format_esimgo_bundle(item):
+    """
+    Add the storefront display fields to an eSIMGo bundle in place.
+    dataAmount is reported in MB; a negative amount means unlimited.
+    """
+    if item.get("unlimited") or item.get("dataAmount", -1) < 0:
+        item["formattedVolume"] = "Unlimited"
+    else:
+        data_mb = item.get("dataAmount", 0)
+        if data_mb >= 1024:
+            item["formattedVolume"] = f"{(data_mb / 1024):.1f} GB"
+        else:
+            item["formattedVolume"] = f"{data_mb} MB"
+
+    price = item.get("price", 0)
+    item["formattedPrice"] = f"{(price * 2):.2f}"
+    return item
+
+
 def fetch_esim_plan_details(package_code, seller="esimaccess"):
     """
     Fetch plan details from the eSIM API using the package_code.
     The 'seller' parameter determines which provider to query:
       - 'esimaccess': existing POST call
-      - 'esimgo': GET call to eSIM-Go
+      - 'esimgo': eSIM-Go bundle detail, read through the bundle cache
     """
     try:
         if seller.lower() == "esimgo":
-            # eSIM-Go flow
-            esimgo_host = config("ESIMGO_HOST")
-            esimgo_api_key = config("ESIMGO_API_KEY")  # You can set a default in your .env or code
-
-            # Build the GET URL for eSIM-Go
-            # Example: https://api.esim-go.com/v2.4/catalogue/bundle/<package_code>?api_key=...
-            url = f"{esimgo_host}/catalogue/bundle/{package_code}?api_key={esimgo_api_key}"
-
-            headers = {
-                "accept": "application/json",
-                "x-api-key": esimgo_api_key
-            }
+            # eSIM-Go flow: served from the bundle cache, which the catalogue
+            # snapshot keeps warm; a miss costs one /catalogue/bundle call.
+            from .esimgo import get_esimgo_bundle
 
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()  # Raise an error if status_code != 200
-            return response.json()
+            bundle = get_esimgo_bundle(package_code)
+            if bundle is None:
+                logger.warning("Error fetching eSIM plan details from %s: no bundle named %s", seller, package_code)
+            return bundle
 
         else:
             # eSIMAccess flow (default)
@@ -49,13 +86,14 @@ def fetch_esim_plan_details(package_code, seller="esimaccess"):
             headers = {"RT-AccessCode": api_token}
             payload = {"packageCode": package_code}
 
-            response = requests.post(url, json=payload, headers=headers)
+            response = esimaccess_http.post(
+                url, json=payload, headers=headers, timeout=15, endpoint="package/list", idempotent=True
+            )
             response.raise_for_status()
             return response.json()
 
-    except requests.RequestException as e:
-        # Log or handle the exception as appropriate for your app
-        print(f"Error fetching eSIM plan details from {seller}: {e}")
+    except (requests.RequestException, CircuitOpenError):
+        logger.exception("Error fetching eSIM plan details from %s", seller)
         return None
 
 
@@ -63,20 +101,31 @@ def order_esim_profile(package_code, ref_id, amount):
     """
     Order new plan from the eSIM API.
     """
+    return order_esim_profiles(ref_id, [{
+        "packageCode": package_code,
+        "count": 1,
+        "price": amount,
+    }])
+
+
+def order_esim_profiles(transaction_id, packages):
+    """
+    Order several plans from the eSIM API in one request.
+
+    ``packages`` is the ``packageInfoList``: ``{"packageCode", "count", "price"}``
+    entries. Returns the orderNo covering every profile, or None.
+    """
     url = esim_host + "/api/v1/open/esim/order"
     headers = {"RT-AccessCode": api_token}
     params = {
-        "transactionId": str(ref_id),
-        "amount": amount,
-        "packageInfoList": [{
-            "packageCode": package_code,
-            "count": 1,
-            "price": amount,
-        }]
+        "transactionId": str(transaction_id),
+        "amount": sum(package["price"] * package["count"] for package in packages),
+        "packageInfoList": packages,
     }
 
     try:
-        response = requests.post(url, json=params, headers=headers)
+        # Not retried: a repeated transactionId is rejected rather than filled twice.
+        response = esimaccess_http.post(url, json=params, headers=headers, timeout=30, endpoint="esim/order")
         response.raise_for_status()  # Raise an error for non-200 responses
         try:
             payload = response.json() or {}
@@ -85,10 +134,10 @@ def order_esim_profile(package_code, ref_id, amount):
 
         obj = payload.get('obj') if isinstance(payload, dict) else None
         if not isinstance(obj, dict):
-            print(f"Error ordering eSIM plan: unexpected response body {payload}")
+            logger.warning("Error ordering eSIM plan: unexpected response body %s", payload)
             return None
 
         return obj.get('orderNo')
-    except requests.RequestException as e:
-        print(f"Error ordering eSIM plan: {e}")
+    except requests.RequestException:
+        logger.exception("Error ordering eSIM plan")
         return None
@@ -1,36 +1,124 @@
+import httpx
 import requests
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status, generics
 from magic_esim.permissions import IsAuthenticatedWithSessionOrJWT
-from rest_framework.permissions import AllowAny
+from magic_esim.async_views import AsyncAPIView, api_response, authenticate, not_authenticated, run_sync_view
+from magic_esim.vendors import esimaccess_async, esimaccess_http, vendor_metrics
+from rest_framework.permissions import AllowAny, IsAdminUser
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiResponse
 from drf_spectacular.types import OpenApiTypes
+from .catalogue import (
+    ESIMACCESS,
+    ESIMGO,
+    ProviderResult,
+    filter_esimaccess_packages,
+    fetch_live_esimaccess,
+    provider_report,
+    select_esimaccess_packages,
+    select_esimgo_bundles,
+    snapshot_age,
+    start_background_refresher,
+    store as catalogue_store,
+)
+from .circuit import CircuitOpenError
+from .esimgo import (
+    ESIMGoCatalogueQuery,
+    aget_esimgo_bundle,
+    bundle_cache,
+    fetch_live_esimgo,
+    get_esimgo_bundle,
+)
+from .response_cache import cache_key, plans_cache
+from .usage import (
+    arefresh_usage,
+    current_snapshot,
+    enrich_profiles,
+    refresh_usage,
+    write_counters as usage_write_counters,
+)
+from .user_plans import InvalidPlansQuery, UserPlansPage
+from .streams import usage_events, wait_for_changes
+from .webhooks import apply_notifications, claim_delivery, verify_signature
 from .models import eSIMPlan
 from .serializers import (
     CountryListResponseSerializer,
     ESIMGoPlanDetailResponseSerializer,
     eSIMBaseResponseSerializer,
+    eSIMPlanBatchResponseSerializer,
     eSIMPlanFilterSerializer,
     eSIMPlanListResponseSerializer,
     eSIMPlanSerializer,
     eSIMProfileResponseSerializer,
     eSIMProfileSerializer,
+    eSIMUsageChangesResponseSerializer,
     eSIMUserPlanListResponseSerializer,
     eSIMUserPlanResponseSerializer,
 )
 from decouple import config
+from functools import partial
 import json
 import os
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+
+
+def plan_list_filters(query_params):
+    """
+    Validate and normalize the plans list filters.
+
+    Returns ``(filters, key, None)``, where ``key`` is the rendered response
+    cache key (None for top-up catalogues, which are never cached), or
+    ``(None, None, payload)`` with the 400 payload for invalid filters.
+    """
+    # Validate query params against your serializer
+    serializer = eSIMPlanFilterSerializer(data=query_params)
+    if not serializer.is_valid():
+        return None, None, {
+            "status": False,
+            "message": "Invalid input parameters.",
+            "errors": serializer.errors,
+        }
+    filters = serializer.validated_data
+
+    package_code = filters.get("packageCode")
+    if isinstance(package_code, str):
+        normalized_package_code = package_code.strip()
+        if not normalized_package_code:
+            filters.pop("packageCode", None)
+        elif normalized_package_code.lower() in {"null", "undefined"}:
+            return None, None, {
+                "status": False,
+                "message": "A valid packageCode must be provided to retrieve plan details.",
+            }
+        else:
+            filters["packageCode"] = normalized_package_code
+    elif package_code is None:
+        filters.pop("packageCode", None)
+
+    is_top_up = bool(filters.get("iccid")) or (filters.get("type") or "").upper() not in ("", "BASE")
+    if is_top_up:
+        return filters, None, None
+    # Identical filter sets get the exact bytes rendered for the last one.
+    key = cache_key(
+        filters,
+        region=query_params.get("region", ""),
+        description=query_params.get("description", ""),
+    )
+    return filters, key, None
 
 
 class eSIMPlanListView(APIView):
     """
-    View to fetch plans from both:
-      - eSIMAccess (POST request)
-      - eSIMGo (GET request)
+    View to serve plans from the local catalogue snapshots of both:
+      - eSIMAccess (package list)
+      - eSIMGo (catalogue)
 
     Results are combined in a single response under:
       data: {
@@ -43,7 +131,10 @@ class eSIMPlanListView(APIView):
     @extend_schema(
         tags=["eSIM"],
         summary="List available eSIM plans",
-        description="Fetch catalogue data from eSIMAccess and eSIMGo and merge the results into grouped collections.",
+        description=(
+            "Serve eSIMAccess and eSIMGo catalogue data from the local snapshot store and merge the results "
+            "into grouped collections. Snapshots are refreshed in the background once they exceed their TTL."
+        ),
         parameters=[
             # Existing filters from your eSIMPlanFilterSerializer
             OpenApiParameter("locationCode", OpenApiTypes.STR, description="Location code (e.g., US, IN)", required=False),
@@ -74,197 +165,285 @@ class eSIMPlanListView(APIView):
         - eSIMAccess results stored in standard[]
         - eSIMGo results stored in unlimited[]
         """
-        # Validate query params against your serializer
-        serializer = eSIMPlanFilterSerializer(data=request.query_params)
-        if not serializer.is_valid():
-            return Response(
-                {
-                    "status": False,
-                    "message": "Invalid input parameters.",
-                    "errors": serializer.errors,
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        filters = serializer.validated_data
+        filters, key, error = plan_list_filters(request.query_params)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
-        package_code = filters.get("packageCode")
-        if isinstance(package_code, str):
-            normalized_package_code = package_code.strip()
-            if not normalized_package_code:
-                filters.pop("packageCode", None)
-            elif normalized_package_code.lower() in {"null", "undefined"}:
-                return Response(
-                    {
-                        "status": False,
-                        "message": "A valid packageCode must be provided to retrieve plan details.",
-                    },
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            else:
-                filters["packageCode"] = normalized_package_code
-        elif package_code is None:
-            filters.pop("packageCode", None)
+        start_background_refresher()
 
-        # Prepare empty lists for each
-        standard_data = []   # Will hold eSIMAccess results
-        unlimited_data = []  # Will hold eSIMGo results
+        if key is not None:
+            body = plans_cache.get(key)
+            if body is not None:
+                return HttpResponse(body, content_type="application/json", status=status.HTTP_200_OK)
 
-        # =========================================================
-        # 1) Fetch from eSIMAccess (STANDARD)
-        # =========================================================
-        try:
-            esim_host = config("ESIMACCESS_HOST")
-            api_token = config("ESIMACCESS_ACCESS_CODE")
-
-            response = requests.post(
-                f"{esim_host}/api/v1/open/package/list",
-                json=filters,  # includes e.g. locationCode, type, etc.
-                headers={"RT-AccessCode": api_token},
-                timeout=15
-            )
+        region_param = request.query_params.get("region", "")
+        desc_param = request.query_params.get("description", "")
+        is_top_up = key is None
 
-            if response.status_code == 200:
-                access_obj = response.json().get("obj") or {}
-                packages = access_obj.get("packageList", [])
-
-                # Filter packages where slug starts with locationCode and doesn't end with _END or _DAILY
-                location_code = filters.get("locationCode")
-                if location_code and location_code != '!RG' and location_code != '!GL':
-                    packages = [
-                        item for item in packages
-                        if item.get("slug", "").startswith(f"{location_code}_") and not item.get("slug", "").endswith(("_End", "_Daily"))
-                    ]
-
-                # If mainRegion was passed, filter
-                main_region = filters.get("mainRegion")
-                if main_region and location_code == '!RG':
-                    packages = [
-                        item for item in packages
-                        if item.get("slug", "").startswith(f"{main_region}-") and not item.get("slug", "").endswith(("_End", "_Daily"))
-                    ]
-                    
-                elif main_region and location_code == '!GL':
-                    packages = [
-                        item for item in packages
-                        if item.get("slug", "").startswith(main_region) and not item.get("slug", "").endswith(("_End", "_Daily"))
-                    ]
-
-
-                # Sort by price ascending
-                packages = sorted(packages, key=lambda x: x.get("price", float("inf")))
-
-                # Convert volume from bytes to GB/MB and format prices
-                for item in packages:
-                    volume_bytes = item.get("volume", 0)
-
-                    if volume_bytes >= 1024 ** 3:
-                        item["formattedVolume"] = f"{(volume_bytes / (1024 ** 3)):.1f} GB"
-                    else:
-                        item["formattedVolume"] = f"{(volume_bytes / (1024 ** 2)):.0f} MB"
-
-                    # Price format (existing logic: (price / 10000) * 2)
-                    price = item.get("price", 0)
-                    item["formattedPrice"] = f"{((price / 10000) * 2):.2f}"
-
-                standard_data = packages
-
-            else:
-                # If non-200, you could log or return a partial success
-                # We'll simply store an empty list (and optionally store the error in an attribute)
-                print("Error fetching eSIMAccess data:", response.text)
-
-        except requests.RequestException as e:
-            print("Exception fetching eSIMAccess data:", e)
-            # If you prefer, just let standard_data remain empty
+        if filters.get("packageCode") and not is_top_up:
+            return self._render(key, *self._get_single_package(filters))
 
         # =========================================================
-        # 2) Fetch from eSIMGo (UNLIMITED)
+        # 1) Resolve both providers concurrently under one deadline.
+        #    Snapshot hits answer inline; misses go to the vendors in
+        #    parallel and whatever has not finished in time is reported
+        #    as a timeout instead of holding the worker.
         # =========================================================
-        try:
-            esimgo_host = config("ESIMGO_HOST")
-            esimgo_api_key = config("ESIMGO_API_KEY")
-
-            # eSIM-Go typically uses a GET request with 'countries' and 'group' in the query params.
-            # We'll define the group as "Standard+Unlimited+Essential" or something similar
-            # (You can adapt to your own logic as needed)
-            group_param = "Standard Unlimited Essential"
-            countries_param = request.query_params.get("locationCode", "")
-            if '!' in countries_param:
-                countries_param = ""
-            region_param = request.query_params.get("region", "")
-            desc_param = request.query_params.get("description", "")
-
-            # Build the GET URL
-            url = (
-                f"{esimgo_host}/catalogue?"
-                f"group={group_param}&countries={countries_param}&region={region_param}&description={desc_param}"
-                f"&api_key={esimgo_api_key}"
-            )
+        countries_param = request.query_params.get("locationCode", "")
+        if '!' in countries_param:
+            countries_param = ""
+        esimgo_query = ESIMGoCatalogueQuery(countries=countries_param, region=region_param, description=desc_param)
+
+        scopes = {ESIMGO: ""}
+        live = {}
+        # A cold eSIMGo snapshot should not make a single-country request download
+        # the whole catalogue: ask upstream for just that slice instead.
+        narrow = {ESIMGO: partial(fetch_live_esimgo, esimgo_query)} if esimgo_query.is_narrow else {}
+        if is_top_up:
+            # Top-up catalogues depend on the eSIM, so they are never snapshotted.
+            live[ESIMACCESS] = partial(fetch_live_esimaccess, dict(filters))
+        else:
+            location_code = filters.get("locationCode")
+            scopes[ESIMACCESS] = location_code if location_code in ('!RG', '!GL') else ""
+
+        results = catalogue_store.get_many(
+            scopes,
+            timeout=getattr(settings, "ESIM_PLANS_DEADLINE_SECONDS", 10),
+            live=live,
+            narrow=narrow,
+        )
 
-            # Prepare headers
-            headers = {
-                "accept": "application/json",
-                "x-api-key": esimgo_api_key
-            }
+        # =========================================================
+        # 2) Apply the storefront filters to each provider's items
+        # =========================================================
+        # eSIMAccess (STANDARD)
+        standard_data = select_esimaccess_packages(results[ESIMACCESS], filters)
+
+        # eSIMGo (UNLIMITED)
+        unlimited_data = select_esimgo_bundles(
+            results[ESIMGO],
+            countries=countries_param,
+            region=region_param,
+            description=desc_param,
+        )
 
-            get_response = requests.get(url, headers=headers, timeout=15)
-
-            if get_response.status_code == 200:
-                bundles = get_response.json().get("bundles", [])
-
-                # Local filtering
-                if region_param:
-                    # Keep only bundles that have at least one country with region or iso containing region_param
-                    # Adjust logic as you prefer; the snippet below checks region in .iso or .region
-                    bundles = [
-                        bundle for bundle in bundles
-                        if any(
-                            region_param in country.get("iso", "")
-                            for country in bundle.get("countries", [])
-                        )
-                    ]
-
-                # Example transformation: adding formattedVolume / formattedPrice
-                for item in bundles:
-                    # Volume
-                    if item.get("unlimited") or item.get("dataAmount", -1) < 0:
-                        item["formattedVolume"] = "Unlimited"
-                    else:
-                        # eSIM-Go dataAmount is in MB
-                        data_mb = item["dataAmount"]
-                        if data_mb >= 1024:
-                            item["formattedVolume"] = f"{(data_mb / 1024):.1f} GB"
-                        else:
-                            item["formattedVolume"] = f"{data_mb} MB"
-
-                    # Price: you used `(price * 2)` in your prior logic, adapt as needed
-                    price = item.get("price", 0)
-                    item["formattedPrice"] = f"{(price * 2):.2f}"
-
-                unlimited_data = bundles
-
-            else:
-                print("Error fetching eSIMGo data:", get_response.text)
-
-        except requests.RequestException as e:
-            print("Exception fetching eSIMGo data:", e)
-            # If you prefer, unlimited_data stays empty
+        providers = {provider: provider_report(result) for provider, result in results.items()}
+        complete = all(result.status == "ok" for result in results.values())
 
         # =========================================================
         # 3) Combine both sets of data and return
         # =========================================================
-        return Response(
+        return self._render(
+            key,
             {
                 "status": True,
-                "message": "Fetched eSIM plans from both eSIMAccess and eSIMGo.",
+                "message": (
+                    "Fetched eSIM plans from both eSIMAccess and eSIMGo."
+                    if complete
+                    else "Fetched eSIM plans; some providers did not respond in time."
+                ),
                 "data": {
                     "standard": standard_data,     # eSIMAccess
                     "unlimited": unlimited_data    # eSIMGo
                 },
+                "providers": providers,
+            },
+            results,
+        )
+
+    def _get_single_package(self, filters):
+        """
+        Fast path for checkout: resolve one eSIMAccess package by code.
+
+        The code is looked up in the snapshot index; only a code no snapshot
+        knows about costs a single targeted upstream call. eSIMGo is skipped
+        because its bundles never carry eSIMAccess package codes. Returns the
+        response payload and the provider results it was built from.
+        """
+        package_code = filters["packageCode"]
+        item, snapshot = catalogue_store.find(ESIMACCESS, package_code)
+        if item is not None:
+            result = ProviderResult([item], "ok", 0.0, "snapshot", snapshot_age(snapshot), None)
+        else:
+            result = catalogue_store.get_many(
+                {},
+                timeout=getattr(settings, "ESIM_PLANS_DEADLINE_SECONDS", 10),
+                live={ESIMACCESS: partial(fetch_live_esimaccess, {"packageCode": package_code})},
+            )[ESIMACCESS]
+
+        payload = {
+            "status": True,
+            "message": "Fetched eSIM plan details.",
+            "data": {
+                "standard": filter_esimaccess_packages(result.items, filters),
+                "unlimited": [],
+            },
+            "providers": {ESIMACCESS: provider_report(result)},
+        }
+        return payload, {ESIMACCESS: result}
+
+    def _render(self, key, payload, results):
+        """
+        Encode ``payload`` once and keep the bytes when every provider was
+        answered from a current snapshot. Entries expire when the oldest
+        snapshot they were built from does.
+        """
+        body = JSONRenderer().render(payload)
+        cacheable = key is not None and all(
+            result.status == "ok" and result.source in ("snapshot", "vendor")
+            for result in results.values()
+        )
+        if cacheable:
+            ttl = catalogue_store.ttl - max(result.age for result in results.values())
+            plans_cache.set(key, body, ttl)
+        return HttpResponse(body, content_type="application/json", status=status.HTTP_200_OK)
+
+
+class eSIMPlanBatchView(APIView):
+    """
+    Resolve several plans in one round trip for carts and comparison views.
+
+    Example usage:
+      GET /api/esim/plans/batch/?packageCodes=CKH491,CKH001&bundleNames=esim_ULE_1D_NG_V2
+
+    Codes are answered from the catalogue snapshots; at most one catalogue
+    download per provider is made when some are missing.
+    """
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        tags=["eSIM"],
+        summary="Resolve several eSIMAccess packages and eSIMGo bundles at once",
+        parameters=[
+            OpenApiParameter("packageCodes", OpenApiTypes.STR, description="Comma-separated eSIMAccess package codes e.g. CKH491,CKH001", required=False),
+            OpenApiParameter("bundleNames", OpenApiTypes.STR, description="Comma-separated eSIMGo bundle names e.g. esim_ULE_1D_NG_V2", required=False),
+        ],
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                response=eSIMPlanBatchResponseSerializer,
+                description="Plans keyed by code; unknown codes map to null.",
+            ),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description="No codes, or more than ESIM_PLANS_BATCH_MAX_ITEMS codes, were supplied.",
+            ),
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        package_codes = self._codes(request, "packageCodes")
+        bundle_names = self._codes(request, "bundleNames")
+        max_items = getattr(settings, "ESIM_PLANS_BATCH_MAX_ITEMS", 50)
+
+        if not package_codes and not bundle_names:
+            return Response(
+                {"status": False, "message": "Provide packageCodes and/or bundleNames."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(package_codes) + len(bundle_names) > max_items:
+            return Response(
+                {"status": False, "message": f"At most {max_items} plans can be resolved per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        found, results = catalogue_store.resolve(
+            {ESIMACCESS: package_codes, ESIMGO: bundle_names},
+            timeout=getattr(settings, "ESIM_PLANS_DEADLINE_SECONDS", 10),
+        )
+        bundles = found[ESIMGO]
+        for name in bundle_names:
+            # Bundles outside the snapshot group may still have been fetched by the detail view.
+            if bundles[name] is None:
+                bundles[name] = bundle_cache.get(name)
+
+        resolved = sum(item is not None for item in found[ESIMACCESS].values())
+        resolved += sum(item is not None for item in bundles.values())
+        return Response(
+            {
+                "status": True,
+                "message": f"Resolved {resolved} of {len(package_codes) + len(bundle_names)} plans.",
+                "data": {"packages": found[ESIMACCESS], "bundles": bundles},
+                "providers": {provider: provider_report(result) for provider, result in results.items()},
             },
             status=status.HTTP_200_OK
         )
 
+    def _codes(self, request, param):
+        # Accept both ?packageCodes=A,B and ?packageCodes=A&packageCodes=B; keep order, drop repeats.
+        codes = []
+        for value in request.query_params.getlist(param):
+            codes.extend(code.strip() for code in value.split(",") if code.strip())
+        return list(dict.fromkeys(codes))
+
+
+class CatalogueStatusView(APIView):
+    """
+    Report the age of each catalogue snapshot, the store hit/miss counters,
+    the rendered response cache counters, how many refreshed plan rows
+    were written vs skipped as unchanged, and the latency and error
+    counters of every vendor endpoint called.
+    """
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=["eSIM"],
+        summary="Inspect the catalogue snapshot store",
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description="Snapshot statistics for the current worker process.",
+            ),
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "status": True,
+            "message": "Catalogue snapshot status fetched successfully.",
+            "data": {
+                **catalogue_store.stats(),
+                "response_cache": plans_cache.stats(),
+                "usage_writes": dict(usage_write_counters),
+                "vendor_calls": vendor_metrics.snapshot(),
+            },
+        }, status=status.HTTP_200_OK)
+
+
+def esimgo_detail_payload(plan_name, plan_data, error=None):
+    """
+    The eSIMGo plan detail response for a resolved bundle (None when there
+    is no such bundle) or for the ``error`` that stopped its lookup, as
+    ``(payload, status)``. ``error`` may come from ``requests`` or ``httpx``.
+    """
+    if isinstance(error, CircuitOpenError):
+        return {
+            "status": False,
+            "message": "eSIM-Go is temporarily unavailable. Please try again shortly.",
+            "error": str(error),
+        }, status.HTTP_503_SERVICE_UNAVAILABLE
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        # Some other non-200 status
+        return {
+            "status": False,
+            "message": "Failed to fetch eSIM-Go plan details.",
+            "error": error.response.text,
+        }, error.response.status_code
+    if error is not None:
+        return {
+            "status": False,
+            "message": "Error connecting to eSIM-Go API.",
+            "error": str(error),
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    if plan_data is None:
+        return {
+            "status": False,
+            "message": f"No eSIM-Go plan found with name '{plan_name}'.",
+        }, status.HTTP_404_NOT_FOUND
+    return {
+        "status": True,
+        "message": "eSIM-Go plan details fetched successfully.",
+        "data": plan_data,
+    }, status.HTTP_200_OK
+
 
 class ESIMGoPlanDetailView(APIView):
     """
@@ -302,6 +481,10 @@ class ESIMGoPlanDetailView(APIView):
                 response=eSIMBaseResponseSerializer,
                 description="Unexpected error when contacting the eSIM-Go API.",
             ),
+            status.HTTP_503_SERVICE_UNAVAILABLE: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description="eSIM-Go is failing and calls are paused for a short while.",
+            ),
         },
     )
     def get(self, request, *args, **kwargs):
@@ -317,77 +500,58 @@ class ESIMGoPlanDetailView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 2) Prepare eSIM-Go environment variables and the API URL
-        esimgo_host = config("ESIMGO_HOST")
-        esimgo_api_key = config("ESIMGO_API_KEY")
-
-        url = f"{esimgo_host}/catalogue/bundle/{plan_name}?api_key={esimgo_api_key}"
-        headers = {
-            "accept": "application/json",
-            "x-api-key": esimgo_api_key
-        }
-
-        # 3) Make the GET request to fetch the plan details
+        # 2) Resolve the bundle: catalogue-warmed cache first, then a
+        #    single /catalogue/bundle call shared by concurrent requests.
         try:
-            response = requests.get(url, headers=headers, timeout=15)
-        except requests.RequestException as e:
-            return Response(
-                {
-                    "status": False,
-                    "message": "Error connecting to eSIM-Go API.",
-                    "error": str(e),
-                },
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # 4) Handle the response
-        if response.status_code == 200:
-            plan_data = response.json()
-
-            # Optional transformations:
-            # For example, formatting volume/price so it matches your style
+            plan_data, error = get_esimgo_bundle(plan_name), None
+        except (CircuitOpenError, requests.RequestException) as e:
+            plan_data, error = None, e
+
+        # 3) Handle the response (formattedVolume/formattedPrice are already set)
+        payload, status_code = esimgo_detail_payload(plan_name, plan_data, error)
+        return Response(payload, status=status_code)
+
+
+def profile_query(filters):
+    """Request arguments of the eSIMAccess ``esim/query`` call behind the profile view."""
+    return dict(
+        url=f"{config('ESIMACCESS_HOST')}/api/v1/open/esim/query",
+        json=filters,
+        headers={"RT-AccessCode": config('ESIMACCESS_ACCESS_CODE')},
+        endpoint="esim/query",
+        idempotent=True,
+    )
 
-            # (a) Format volume
-            if plan_data.get("unlimited") or plan_data.get("dataAmount", -1) < 0:
-                plan_data["formattedVolume"] = "Unlimited"
-            else:
-                data_mb = plan_data.get("dataAmount", 0)
-                if data_mb >= 1024:
-                    plan_data["formattedVolume"] = f"{(data_mb / 1024):.1f} GB"
-                else:
-                    plan_data["formattedVolume"] = f"{data_mb} MB"
 
-            # (b) Format price (example: multiply by 2 to match your logic)
-            price = plan_data.get("price", 0)
-            plan_data["formattedPrice"] = f"{(price * 2):.2f}"
+def snapshot_profiles(filters):
+    """
+    Profiles for ``filters`` from fresh usage snapshots, or None when any
+    matching eSIM has no recent snapshot and eSIMAccess must be asked.
+    """
+    order_no = filters.get('orderNo')
+    iccid = filters.get('iccid')
+    if not order_no and not iccid:
+        return None
+    plans = eSIMPlan.objects.select_related("usage_snapshot")
+    plans = plans.filter(order_no=order_no) if order_no else plans.filter(iccid=iccid)
+    snapshots = [current_snapshot(plan) for plan in plans]
+    if not snapshots or None in snapshots:
+        return None
+    return [dict(snapshot.payload, usageFetchedAt=snapshot.fetched_at) for snapshot in snapshots]
+
+
+def enrich_plan_profiles(data):
+    """Enrich profile ``data`` with the purchased plans, loaded in one query."""
+    order_nos = {item['orderNo'] for item in data if item.get('orderNo')}
+    iccids = {item['iccid'] for item in data if item.get('iccid')}
+    plans_by_iccid, plans_by_order = {}, {}
+    for plan in eSIMPlan.objects.filter(Q(order_no__in=order_nos) | Q(iccid__in=iccids)):
+        if plan.iccid:
+            plans_by_iccid[plan.iccid] = plan
+        # Only an order with one plan identifies it; a batched order holds several.
+        plans_by_order[plan.order_no] = None if plan.order_no in plans_by_order else plan
+    enrich_profiles(data, plans_by_iccid, plans_by_order)
 
-            return Response(
-                {
-                    "status": True,
-                    "message": "eSIM-Go plan details fetched successfully.",
-                    "data": plan_data,
-                },
-                status=status.HTTP_200_OK
-            )
-        elif response.status_code == 404:
-            return Response(
-                {
-                    "status": False,
-                    "message": f"No eSIM-Go plan found with name '{plan_name}'.",
-                },
-                status=status.HTTP_404_NOT_FOUND
-            )
-        else:
-            # Some other non-200 status
-            return Response(
-                {
-                    "status": False,
-                    "message": "Failed to fetch eSIM-Go plan details.",
-                    "error": response.text,
-                },
-                status=response.status_code
-            )
-        
 
 class eSIMProfileView(APIView):
     """
@@ -424,67 +588,17 @@ class eSIMProfileView(APIView):
             filters = serializer.validated_data
             
             try:
-                esim_host = config('ESIMACCESS_HOST')
-                api_token = config('ESIMACCESS_ACCESS_CODE')
-
-                response = requests.post(
-                    f"{esim_host}/api/v1/open/esim/query",
-                    json=filters,
-                    headers={"RT-AccessCode": api_token},
-                )
-                
-                if response.status_code == 200 and response.json().get('success', False):
-                    # Return the data from the external API
-                    data = response.json().get('obj', {}).get('esimList', [])
-
-                    # Enrich data with time_created from the database
-                    enriched_data = []
-                    for item in data:
-                        order_no = item.get('orderNo')  # Extract order number
-                        if order_no:
-                            try:
-                                esim_plan = eSIMPlan.objects.get(order_no=order_no)
-                                item['price'] = esim_plan.price
-
-                                # Calculate the difference on a scale of 0 - 1
-                                item['usageScale'] = 1 - (item['orderUsage'] / item['totalVolume']) if item['totalVolume'] > 0 else 0
-
-                                # Calculate duration left and duration left scale
-                                activate_time = item.get('activateTime')
-                                total_duration = item.get('totalDuration', 0)
-                                if activate_time is not None:
-                                    activate_datetime = datetime.strptime(activate_time, "%Y-%m-%dT%H:%M:%S%z")
-                                else:
-                                    activate_datetime = datetime.now()
-
-                                expiration_datetime = activate_datetime + timedelta(days=total_duration)
-                                current_datetime = datetime.now()
-
-                                duration_left = (expiration_datetime - current_datetime.replace(tzinfo=activate_datetime.tzinfo)).total_seconds()
-                                
-                                # Calculate duration left and format it
-                                if duration_left >= 86400:
-                                    item['durationLeft'] = f"{duration_left // 86400} days"
-                                elif duration_left >= 3600:
-                                    item['durationLeft'] = f"{duration_left // 3600} hours"
-                                else:
-                                    item['durationLeft'] = f"{duration_left // 60} mins"
-                                item['durationLeftScale'] = max(0, min(1, duration_left / (total_duration * 86400))) if total_duration > 0 else 0
-
-                                print(item['durationLeft'])
-                                print(item['durationLeftScale'])
-                                # Convert volume from bytes to GB/MB and format prices
-                                volume_bytes = item['totalVolume'] - item['orderUsage']
-
-                                if volume_bytes >= 1024 ** 3:
-                                    item["formattedVolumeLeft"] = f"{(volume_bytes / (1024 ** 3)):.1f} GB"
-                                else:
-                                    item["formattedVolumeLeft"] = f"{(volume_bytes / (1024 ** 2)):.0f} MB"
-
-                                item["formattedPrice"] = f"{((esim_plan.price / 10000) * 2):.2f}"
-                            except eSIMPlan.DoesNotExist:
-                                item['price'] = None
-                        enriched_data.append(item)
+                # Serve from the usage snapshots when the poller has them all fresh.
+                data = snapshot_profiles(filters)
+                if data is None:
+                    response = esimaccess_http.post(**profile_query(filters))
+                    success = response.status_code == 200 and response.json().get('success', False)
+                    if success:
+                        # Return the data from the external API
+                        data = response.json().get('obj', {}).get('esimList', [])
+
+                if data is not None:
+                    enrich_plan_profiles(data)
 
                     return Response({
                         "status": True,
@@ -512,16 +626,51 @@ class eSIMProfileView(APIView):
                 "message": "Invalid input parameters.",
                 "errors": serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
-        
+
 
 @extend_schema_view(
     get=extend_schema(
         tags=["eSIM"],
         summary="List the authenticated user's eSIM plans",
+        parameters=[
+            OpenApiParameter(
+                name="cursor",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Opaque cursor from `pagination.next_cursor` of the previous page.",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="page_size",
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description="Plans per page (capped by the server).",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="fields",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Comma-separated fields to return, e.g. `id,name,usageScale`. Defaults to all fields.",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="status",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Only `active` or only `expired` plans.",
+                required=False,
+                enum=["active", "expired"],
+            ),
+        ],
         responses={
             status.HTTP_200_OK: OpenApiResponse(
                 response=eSIMUserPlanListResponseSerializer,
-                description="Plans retrieved successfully.",
+                description="Plans retrieved successfully, newest first.",
+            ),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description="Invalid cursor, page_size, fields or status.",
             ),
             status.HTTP_401_UNAUTHORIZED: OpenApiResponse(
                 description="Authentication credentials were not provided.",
@@ -559,117 +708,15 @@ class eSIMPlanListCreateView(generics.ListCreateAPIView):
         return eSIMPlan.objects.filter(user=self.request.user)
 
     def list(self, request, *args, **kwargs):
-        user = self.request.user
-        plans = self.get_queryset()
-
-        # Update volume_used field for each plan
-        updated_plans = []
-        for plan in plans:
-            try:
-                esim_host = config("ESIMACCESS_HOST")
-                api_token = config("ESIMACCESS_ACCESS_CODE")
-                params = {
-                    "orderNo": plan.order_no,
-                    "iccid": "",
-                    "pager": {
-                        "pageNum": 1,
-                        "pageSize": 20
-                    }
-                }
-
-                response = requests.post(
-                    f"{esim_host}/api/v1/open/esim/query",
-                    json=params,
-                    headers={"RT-AccessCode": api_token},
-                )
+        try:
+            page = UserPlansPage(request.query_params, self.get_queryset())
+        except InvalidPlansQuery as e:
+            return Response({"status": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-                if response.status_code == 200:
-                    api_response = response.json()
-                    if api_response.get("success", False):
-                        profile_data = api_response.get("obj", {}).get("esimList", [])
-                        if profile_data:
-                            esim = profile_data[0]
-                            # Update plan details
-                            plan.activated_on = esim.get("activateTime", plan.activated_on)
-                            plan.volume_used = esim.get("orderUsage", plan.volume_used)
-                            plan.save()
-
-                            # Temporarily pass data to plan object for demonstration
-                            plan.usageScale = round(esim['orderUsage'] / esim['totalVolume'], 1) if esim['totalVolume'] > 0 else 0
-
-                            # Calculate duration left and duration left scale
-                            activate_time = esim.get('activateTime')
-                            total_duration = esim.get('totalDuration', 0)
-                            if activate_time is not None:
-                                activate_datetime = datetime.strptime(activate_time, "%Y-%m-%dT%H:%M:%S%z")
-                            else:
-                                activate_datetime = datetime.now()
-
-                            expiration_datetime = activate_datetime + timedelta(days=total_duration)
-                            current_datetime = datetime.now()
-
-                            duration_left = (expiration_datetime - current_datetime.replace(tzinfo=activate_datetime.tzinfo)).total_seconds()
-                            
-                            # Calculate duration left and format it
-                            if duration_left >= 86400:
-                                plan.durationLeft = f"{duration_left // 86400} days"
-                            elif duration_left >= 3600:
-                                plan.durationLeft = f"{duration_left // 3600} hours"
-                            else:
-                                plan.durationLeft = f"{duration_left // 60} mins"
-                            
-                            # Convert volume from bytes to GB/MB and format prices
-                            volume_bytes = esim['totalVolume'] - esim['orderUsage']
-
-                            if volume_bytes >= 1024 ** 3:
-                                plan.formattedVolumeLeft = f"{(volume_bytes / (1024 ** 3)):.1f} GB"
-                            else:
-                                plan.formattedVolumeLeft = f"{(volume_bytes / (1024 ** 2)):.0f} MB"
-                            print(plan.durationLeft)
-                            print(plan.usageScale)
-                            print(plan.formattedVolumeLeft)
-                        else:
-                            print(f"No eSIM data found for plan {plan.order_no}.")
-                    else:
-                        print(f"API error for plan {plan.order_no}: {api_response.get('errorMsg', 'Unknown error')}")
-                else:
-                    print(f"HTTP error {response.status_code} for plan {plan.order_no}: {response.text}")
-            except requests.RequestException as e:
-                print(f"Error fetching eSIM profile for plan {plan.order_no}: {e}")
-
-            updated_plans.append({
-                "id": plan.id,
-                "order_no": plan.order_no,
-                "name": plan.name,
-                "slug": plan.slug,
-                "package_code": plan.package_code,
-                "activated_on": plan.activated_on,
-                "volume_used": plan.volume_used,
-                "esim_status": plan.esim_status,
-                "duration": plan.duration,
-                "currency_code": plan.currency_code,
-                "speed": plan.speed,
-                "volume": plan.volume,
-                "price": plan.price,
-                "description": plan.description,
-                "seller": plan.seller,
-                "location_code": plan.location_code,
-                "location_code_lower": plan.location_code.lower(),
-                "expires_on": plan.expires_on,
-                "smdp_status": plan.smdp_status,
-                "duration_unit": plan.duration_unit,
-                "support_top_up_type": plan.support_top_up_type,
-                "usageScale": plan.usageScale,
-                "durationLeft": plan.durationLeft,
-                "formattedVolumeLeft": plan.formattedVolumeLeft,
-            })
-
-        print(updated_plans)
-        return Response({
-            "status": True,
-            "message": "User eSIM plans fetched successfully.",
-            "data": updated_plans,
-        }, status=status.HTTP_200_OK)
+        # One eSIMAccess query per order with a stale plan, run concurrently
+        # under a single deadline.
+        page.apply_usage(refresh_usage(page.stale) if page.stale else {})
+        return Response(page.payload(), status=status.HTTP_200_OK)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -881,4 +928,241 @@ class PopularCountriesListView(APIView):
                 "status": False,
                 "message": "Failed to fetch popular countries list.",
                 "error": str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class eSIMAccessWebhookView(APIView):
+    """
+    Receive eSIMAccess push notifications (order ready, eSIM status, data
+    usage and validity) and apply them to the matching plans and usage
+    snapshots. Accepts one notification or a JSON array of them.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []  # Authenticated by the RT-Signature HMAC instead
+
+    @extend_schema(
+        tags=["eSIM"],
+        summary="Receive eSIMAccess webhook notifications",
+        request=OpenApiTypes.OBJECT,
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description=(
+                    "Notifications applied, or a redelivered RT-RequestID acknowledged; "
+                    "data holds applied/unchanged/unmatched/ignored/malformed counts."
+                ),
+            ),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description="The body is not a notification or a list of notifications.",
+            ),
+            status.HTTP_401_UNAUTHORIZED: OpenApiResponse(
+                response=eSIMBaseResponseSerializer,
+                description="Missing, invalid or expired signature.",
+            ),
+        },
+    )
+    def post(self, request, *args, **kwargs):
+        # Verify against the raw body before DRF parses it.
+        body = request.body
+        if not verify_signature(body, request.headers):
+            return Response(
+                {"status": False, "message": "Invalid webhook signature."},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+
+        try:
+            notifications = json.loads(body)
+        except ValueError:
+            notifications = None
+        if isinstance(notifications, dict):
+            notifications = [notifications]
+        if not isinstance(notifications, list) or not all(isinstance(item, dict) for item in notifications):
+            return Response(
+                {"status": False, "message": "Expected a notification or a list of notifications."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # eSIMAccess retries with the same RT-RequestID, possibly to another worker.
+        request_id = request.headers.get("RT-RequestID")
+        with transaction.atomic():
+            if request_id and not claim_delivery(request_id):
+                return Response(
+                    {"status": True, "message": "Notification already received.", "data": None},
+                    status=status.HTTP_200_OK,
+                )
+            counts = apply_notifications(notifications)
+        return Response({
+            "status": True,
+            "message": f"Applied {counts['applied']} of {len(notifications)} notifications.",
+            "data": counts,
+        }, status=status.HTTP_200_OK)
+
+
+class eSIMUsageStreamView(View):
+    """
+    Stream usage and status changes of the signed-in user's plans as
+    Server-Sent Events (see ``esim.streams``). Authenticates with the
+    session cookie, as ``EventSource`` sends it, or a JWT bearer token.
+    Only routed with ``ESIM_ASYNC_VIEWS`` (``magic_esim.asgi``): under WSGI
+    the stream would be buffered whole; ``eSIMUsageChangesView`` is used instead.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        user = await authenticate(request)
+        if user is None:
+            return JsonResponse(
+                {"status": False, "message": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+
+        response = StreamingHttpResponse(usage_events(user.pk), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Stop nginx buffering the stream
+        return response
+
+
+class eSIMUsageChangesView(APIView):
+    """
+    Polling fallback of ``eSIMUsageStreamView`` for WSGI deployments:
+    answers with the user's plans at once, or once they differ from
+    ``version`` when ``ESIM_USAGE_LONG_POLL_SECONDS`` is set (see
+    ``esim.streams``). ``retryAfter`` is how long to wait before asking again.
+    """
+    permission_classes = [IsAuthenticatedWithSessionOrJWT]
+
+    @extend_schema(
+        tags=["eSIM"],
+        summary="Wait for usage changes of the user's eSIM plans",
+        parameters=[
+            OpenApiParameter(
+                "version", OpenApiTypes.STR, required=False,
+                description="`version` of the previous answer; omit to get the current state at once.",
+            ),
+        ],
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(
+                response=eSIMUsageChangesResponseSerializer,
+                description="Current dashboard fields of the user's plans.",
+            ),
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        states, version = wait_for_changes(request.user.pk, request.query_params.get("version") or None)
+        # A request that already waited for a change can be repeated straight away.
+        long_poll = getattr(settings, "ESIM_USAGE_LONG_POLL_SECONDS", 0) > 0
+        retry_after = 0 if long_poll else getattr(settings, "ESIM_USAGE_POLL_AFTER_SECONDS", 15)
+        return Response({
+            "status": True,
+            "message": "eSIM plan usage fetched successfully.",
+            "data": {"version": version, "plans": states, "retryAfter": retry_after},
+        }, status=status.HTTP_200_OK)
+
+
+_plans_list_view = eSIMPlanListView.as_view()
+_user_plans_view = eSIMPlanListCreateView.as_view()
+
+
+class eSIMPlanListAsyncView(AsyncAPIView):
+    """
+    ``eSIMPlanListView`` for ASGI. Cached responses are answered on the
+    event loop; building a response (catalogue snapshots, with vendor
+    fallbacks bounded by the catalogue store's own pool and deadline) runs
+    the DRF view in a thread.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        filters, key, error = plan_list_filters(request.GET)
+        if error is not None:
+            return api_response(error, status=status.HTTP_400_BAD_REQUEST)
+        if key is not None:
+            body = plans_cache.get(key)
+            if body is not None:
+                return HttpResponse(body, content_type="application/json", status=status.HTTP_200_OK)
+        return await run_sync_view(_plans_list_view, request, *args, **kwargs)
+
+
+class ESIMGoPlanDetailAsyncView(AsyncAPIView):
+    """``ESIMGoPlanDetailView`` for ASGI: the ``/catalogue/bundle`` call is awaited."""
+
+    async def get(self, request, *args, **kwargs):
+        plan_name = request.GET.get("name")
+        if not plan_name:
+            return api_response(
+                {
+                    "status": False,
+                    "message": "Missing required 'name' parameter for eSIM-Go plan."
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            plan_data, error = await aget_esimgo_bundle(plan_name), None
+        except (CircuitOpenError, httpx.HTTPError) as e:
+            plan_data, error = None, e
+        payload, status_code = esimgo_detail_payload(plan_name, plan_data, error)
+        return api_response(payload, status=status_code)
+
+
+class eSIMProfileAsyncView(AsyncAPIView):
+    """``eSIMProfileView`` for ASGI: the eSIMAccess query is awaited, snapshots and plans are read in threads."""
+
+    async def get(self, request, *args, **kwargs):
+        serializer = eSIMProfileSerializer(data=request.GET)
+        if not serializer.is_valid():
+            return api_response({
+                "status": False,
+                "message": "Invalid input parameters.",
+                "errors": serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        filters = serializer.validated_data
+
+        try:
+            data = await sync_to_async(snapshot_profiles)(filters)
+            if data is None:
+                response = await esimaccess_async.post(**profile_query(filters))
+                if response.status_code == 200 and response.json().get('success', False):
+                    data = response.json().get('obj', {}).get('esimList', [])
+        except httpx.HTTPError as e:
+            return api_response({
+                "status": False,
+                "message": "Error connecting to the eSIM API.",
+                "error": str(e),
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if data is None:
+            return api_response({
+                "status": False,
+                "message": "Failed to fetch eSIM profile.",
+                "error": response.json().get('errorMsg', {}),
+            }, status=response.status_code)
+
+        await sync_to_async(enrich_plan_profiles)(data)
+        return api_response({
+            "status": True,
+            "message": "eSIM profile fetched successfully.",
+            "data": data
+        }, status=status.HTTP_200_OK)
+
+
+class eSIMPlanListCreateAsyncView(AsyncAPIView):
+    """
+    ``eSIMPlanListCreateView`` for ASGI. Listing awaits the live usage of
+    stale plans with ``arefresh_usage`` and reads and writes the page in
+    threads; creating a plan is delegated to the DRF view.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        user = await authenticate(request)
+        if user is None:
+            return not_authenticated()
+        try:
+            page = await sync_to_async(UserPlansPage)(request.GET, eSIMPlan.objects.filter(user=user))
+        except InvalidPlansQuery as e:
+            return api_response({"status": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        usage = await arefresh_usage(page.stale) if page.stale else {}
+        await sync_to_async(page.apply_usage)(usage)
+        return api_response(page.payload(), status=status.HTTP_200_OK)
+
+    async def post(self, request, *args, **kwargs):
+        return await run_sync_view(_user_plans_view, request, *args, **kwargs)
@@ -0,0 +1,277 @@
+"""
+eSIMAccess webhook notifications.
+
+eSIMAccess pushes order, status, data usage and validity changes to
+``/api/esim/webhooks/esimaccess/``. Notifications are signed like API
+requests: ``RT-Signature`` is the hex HMAC-SHA256, keyed with
+``ESIMACCESS_SECRET_KEY``, of ``RT-Timestamp + RT-RequestID + access code +
+raw body``, and timestamps older than ``ESIMACCESS_WEBHOOK_TOLERANCE_SECONDS``
+are rejected.
+
+``apply_notifications`` folds a batch of notifications into the matching
+``eSIMPlan`` and ``UsageSnapshot`` rows with one read and bulk writes. It
+is idempotent: notifications only set state, fields are only written when
+their value changes, and usage notifications older than the stored usage
+(lower ``orderUsage``) are ignored, so redelivered or replayed batches are
+harmless. Deliveries are also recorded by ``RT-RequestID`` (``claim_delivery``)
+so a retried request is acknowledged without being applied again. Numbers and timestamps are parsed before anything is applied, so a
+malformed notification is logged and skipped without touching the batch.
+Snapshots changed by push are marked with ``pushed_at`` and are
+trusted by dashboards and the poller for ``ESIM_USAGE_PUSH_MAX_AGE_SECONDS``.
+"""
+import hashlib
+import hmac
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from decouple import config
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import UsageSnapshot, WebhookDelivery, eSIMPlan
+from .usage import parse_vendor_time
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_STATUS = "ORDER_STATUS"
+ESIM_STATUS = "ESIM_STATUS"
+DATA_USAGE = "DATA_USAGE"
+VALIDITY_USAGE = "VALIDITY_USAGE"
+CHECK_HEALTH = "CHECK_HEALTH"
+
+INT_FIELDS = ("orderUsage", "totalVolume", "totalDuration")
+TIME_FIELDS = ("activateTime", "expiredTime")
+
+
+def _signature(timestamp, request_id, body, secret):
+    access_code = config("ESIMACCESS_ACCESS_CODE", default="")
+    message = f"{timestamp}{request_id}{access_code}".encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def sign(body, timestamp=None, request_id=None):
+    """The ``RT-*`` headers eSIMAccess would send with ``body`` (bytes); used by the replay tool and tests."""
+    timestamp = str(timestamp if timestamp is not None else int(time.time() * 1000))
+    request_id = request_id or uuid.uuid4().hex
+    secret = config("ESIMACCESS_SECRET_KEY", default="")
+    return {
+        "RT-Timestamp": timestamp,
+        "RT-RequestID": request_id,
+        "RT-Signature": _signature(timestamp, request_id, body, secret),
+    }
+
+
+def verify_signature(body, headers):
+    """True if ``headers`` carry a valid, recent signature for the raw ``body``."""
+    secret = config("ESIMACCESS_SECRET_KEY", default="")
+    if not secret:
+        logger.warning("Rejecting eSIMAccess webhook: ESIMACCESS_SECRET_KEY is not configured")
+        return False
+    timestamp = headers.get("RT-Timestamp", "")
+    request_id = headers.get("RT-RequestID", "")
+    signature = headers.get("RT-Signature", "")
+    try:
+        age = abs(time.time() - int(timestamp) / 1000)
+    except ValueError:
+        return False
+    if age > getattr(settings, "ESIMACCESS_WEBHOOK_TOLERANCE_SECONDS", 300):
+        return False
+    expected = _signature(timestamp, request_id, body, secret)
+    return hmac.compare_digest(expected, signature.lower())
+
+
+def _clean(content):
+    # Raises KeyError, ValueError or TypeError for a notification that cannot be applied.
+    cleaned = {**content, "orderNo": str(content["orderNo"])}
+    if cleaned.get("iccid"):
+        cleaned["iccid"] = str(cleaned["iccid"])
+    for key in INT_FIELDS:
+        if cleaned.get(key) is not None:
+            cleaned[key] = int(cleaned[key])
+    for key in TIME_FIELDS:
+        if cleaned.get(key):
+            cleaned[key] = parse_vendor_time(cleaned[key])
+    return cleaned
+
+
+def claim_delivery(request_id, received_at=None):
+    """
+    Record ``request_id`` as delivered; False if it already was, by any worker.
+
+    Call inside the transaction that applies the delivery, so a failed apply
+    frees the id for eSIMAccess's retry. Ids older than twice the signature
+    tolerance are pruned: a replay that old fails verification anyway.
+    """
+    received_at = received_at or now()
+    tolerance = getattr(settings, "ESIMACCESS_WEBHOOK_TOLERANCE_SECONDS", 300)
+    _, created = WebhookDelivery.objects.get_or_create(request_id=request_id, defaults={"received_at": received_at})
+    if created:
+        WebhookDelivery.objects.filter(received_at__lt=received_at - timedelta(seconds=2 * tolerance)).delete()
+    return created
+
+
+def _match(plans, content):
+    # By ICCID when the plan knows it; otherwise an order's only plan.
+    iccid = content.get("iccid")
+    for plan in plans:
+        if iccid and plan.iccid == iccid:
+            return plan
+    if len(plans) == 1 and (not iccid or not plans[0].iccid):
+        return plans[0]
+    return None
+
+
+def _set(obj, changed, field, value):
+    if getattr(obj, field) != value:
+        setattr(obj, field, value)
+        changed.add(field)
+
+
+def _new_snapshot(plan, received_at):
+    # Seeded from the plan so a push carrying only status still yields usable dashboard values.
+    return UsageSnapshot(
+        plan=plan,
+        order_no=plan.order_no,
+        iccid=plan.iccid,
+        order_usage=int(plan.volume_used or 0),
+        total_volume=int(plan.volume or 0),
+        total_duration=plan.duration or 0,
+        activate_time=plan.activated_on,
+        fetched_at=received_at,
+    )
+
+
+def _apply(notify_type, content, plan, snapshot, plan_fields, snapshot_fields, received_at):
+    if notify_type == ORDER_STATUS:
+        # GOT_RESOURCE: the order's profiles are allocated and ready to install.
+        if content.get("orderStatus") == "GOT_RESOURCE" and plan.esim_status == "PAID":
+            _set(plan, plan_fields, "esim_status", "GOT_RESOURCE")
+            _set(snapshot, snapshot_fields, "esim_status", "GOT_RESOURCE")
+        return
+
+    if content.get("iccid"):
+        _set(plan, plan_fields, "iccid", content["iccid"])
+        _set(snapshot, snapshot_fields, "iccid", content["iccid"])
+
+    if notify_type == ESIM_STATUS:
+        for key, plan_field, snapshot_field in (
+            ("esimStatus", "esim_status", "esim_status"),
+            ("smdpStatus", "smdp_status", "smdp_status"),
+        ):
+            if content.get(key):
+                _set(plan, plan_fields, plan_field, content[key])
+                _set(snapshot, snapshot_fields, snapshot_field, content[key])
+        if content.get("activateTime"):
+            _set(plan, plan_fields, "activated_on", content["activateTime"])
+            _set(snapshot, snapshot_fields, "activate_time", content["activateTime"])
+
+    elif notify_type == DATA_USAGE:
+        order_usage = content.get("orderUsage")
+        if order_usage is None or order_usage < snapshot.order_usage:
+            return  # Usage only grows; an older notification arrived late.
+        if order_usage != snapshot.order_usage:
+            snapshot.usage_changed_at = received_at
+            snapshot_fields.add("usage_changed_at")
+        _set(snapshot, snapshot_fields, "order_usage", order_usage)
+        _set(plan, plan_fields, "volume_used", str(order_usage))
+        if content.get("totalVolume") is not None:
+            _set(snapshot, snapshot_fields, "total_volume", content["totalVolume"])
+
+    elif notify_type == VALIDITY_USAGE:
+        if content.get("expiredTime"):
+            _set(plan, plan_fields, "expires_on", content["expiredTime"])
+            _set(snapshot, snapshot_fields, "expired_time", content["expiredTime"])
+        if content.get("totalDuration") is not None:
+            _set(snapshot, snapshot_fields, "total_duration", content["totalDuration"])
+
+
+def apply_notifications(notifications, received_at=None):
+    """
+    Apply a batch of eSIMAccess notifications (``{"notifyType", "content"}`` dicts).
+
+    Returns counts of ``applied`` (changed something), ``unchanged``,
+    ``unmatched`` (no plan for the order/ICCID), ``ignored`` (unknown
+    or health-check types) and ``malformed`` (fields that do not parse).
+    """
+    received_at = received_at or now()
+    counts = {"applied": 0, "unchanged": 0, "unmatched": 0, "ignored": 0, "malformed": 0}
+
+    known = (ORDER_STATUS, ESIM_STATUS, DATA_USAGE, VALIDITY_USAGE)
+    pending = []
+    for notification in notifications:
+        content = notification.get("content") or {}
+        if notification.get("notifyType") not in known or not isinstance(content, dict) or not content.get("orderNo"):
+            counts["ignored"] += 1
+            continue
+        try:
+            content = _clean(content)
+        except (KeyError, ValueError, TypeError) as e:
+            logger.warning("Skipping malformed eSIMAccess %s notification: %s", notification["notifyType"], e)
+            counts["malformed"] += 1
+            continue
+        pending.append((notification["notifyType"], content))
+    if not pending:
+        return counts
+
+    by_order = {}
+    for plan in (
+        eSIMPlan.objects
+        .filter(order_no__in={content["orderNo"] for _, content in pending})
+        .select_related("usage_snapshot")
+        .order_by("id")
+    ):
+        by_order.setdefault(plan.order_no, []).append(plan)
+
+    plan_fields = {}      # plan.pk -> changed plan fields
+    snapshot_fields = {}  # plan.pk -> changed snapshot fields
+    snapshots = {}
+    plans = {}
+    for notify_type, content in pending:
+        order_plans = by_order.get(content["orderNo"], [])
+        if notify_type == ORDER_STATUS:
+            targets = order_plans  # Order-level: every profile of the order
+        else:
+            targets = [plan for plan in [_match(order_plans, content)] if plan is not None]
+        if not targets:
+            counts["unmatched"] += 1
+            continue
+
+        applied = False
+        for plan in targets:
+            plans[plan.pk] = plan
+            if plan.pk not in snapshots:
+                snapshots[plan.pk] = getattr(plan, "usage_snapshot", None) or _new_snapshot(plan, received_at)
+            changed_plan = plan_fields.setdefault(plan.pk, set())
+            changed_snapshot = snapshot_fields.setdefault(plan.pk, set())
+            before = len(changed_plan) + len(changed_snapshot)
+            _apply(notify_type, content, plan, snapshots[plan.pk], changed_plan, changed_snapshot, received_at)
+            applied = applied or len(changed_plan) + len(changed_snapshot) > before
+        counts["applied" if applied else "unchanged"] += 1
+
+    changed_plans = [plans[pk] for pk, fields in plan_fields.items() if fields]
+    created, updated, update_fields = [], [], set()
+    for pk, fields in snapshot_fields.items():
+        snapshot = snapshots[pk]
+        if not fields and not plan_fields[pk]:
+            continue
+        snapshot.fetched_at = snapshot.pushed_at = received_at
+        if snapshot.pk is None:
+            created.append(snapshot)
+        else:
+            updated.append(snapshot)
+            update_fields.update(fields, ("fetched_at", "pushed_at"))
+
+    with transaction.atomic():
+        if changed_plans:
+            eSIMPlan.objects.bulk_update(
+                changed_plans, sorted(set().union(*(plan_fields[plan.pk] for plan in changed_plans)))
+            )
+        if created:
+            UsageSnapshot.objects.bulk_create(created)
+        if updated:
+            UsageSnapshot.objects.bulk_update(updated, sorted(update_fields))
+    return counts
@@ -161,7 +161,9 @@ def mastercard_checkout(request, ref_id):
 @login_required
 def esim_list(request):
     context = {
-        'user': request.user
+        'user': request.user,
+        # The SSE stream is only served under ASGI; otherwise the page long-polls.
+        'usage_stream': getattr(settings, 'ESIM_ASYNC_VIEWS', False),
     }
     return render(request, 'esims.html', context)
 
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'magic_esim.settings')
+# Serve the vendor-bound endpoints with their async views (see magic_esim.async_views).
+os.environ.setdefault('ESIM_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -0,0 +1,82 @@
+"""
+Building blocks for the async API views served by ``magic_esim.asgi``.
+
+DRF views are sync, so under ASGI each request to one holds a thread for
+its whole duration, vendor I/O included. The async views in ``esim.views``
+and ``billing.views`` await their vendor calls instead (see
+``magic_esim.vendors.AsyncVendorClient``) and only use threads for the ORM.
+They answer with the same bodies and statuses as their DRF counterparts and
+are routed in their place when ``ESIM_ASYNC_VIEWS`` is on, which
+``magic_esim.asgi`` does by default.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+
+class AsyncAPIView(View):
+    """
+    Base class of the async API views.
+
+    Exempt from CSRF like DRF's ``APIView``: the async views only read, and
+    writes are delegated to the DRF views, which enforce CSRF for sessions.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+
+def routed_view(drf_view, async_view, **initkwargs):
+    """
+    The view function for a URL served by ``drf_view`` or, when
+    ``ESIM_ASYNC_VIEWS`` is on, by ``async_view``. The async one keeps the
+    DRF class on ``cls`` so the API schema still documents the endpoint.
+    """
+    if not getattr(settings, "ESIM_ASYNC_VIEWS", False):
+        return drf_view.as_view(**initkwargs)
+    view = async_view.as_view(**initkwargs)
+    view.cls = drf_view
+    view.initkwargs = initkwargs
+    return view
+
+
+def api_response(payload, status=status.HTTP_200_OK):
+    """``payload`` rendered exactly as a DRF ``Response`` would render it."""
+    return HttpResponse(JSONRenderer().render(payload), content_type="application/json", status=status)
+
+
+async def authenticate(request):
+    """The user signed in by session cookie or JWT bearer token, or None."""
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    try:
+        authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return authenticated[0] if authenticated else None
+
+
+def not_authenticated():
+    """The response DRF gives a protected view without credentials."""
+    return api_response(
+        {"detail": "Authentication credentials were not provided."},
+        status=status.HTTP_403_FORBIDDEN,
+    )
+
+
+async def run_sync_view(view, request, *args, **kwargs):
+    """Run the sync (DRF) ``view`` function in a thread and return its rendered response."""
+    def run():
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, "render", None)):
+            response.render()
+        return response
+    return await sync_to_async(run)()
@@ -76,7 +76,7 @@ SOCIALACCOUNT_PROVIDERS = {
 # Middleware
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'magic_esim.middleware.StaticFilesMiddleware',  # WhiteNoise, async-capable (see magic_esim.middleware)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -252,6 +252,7 @@ COINPAYMENTS_MERCHANT_ID = config('COINPAYMENTS_MERCHANT_ID')
 COINPAYMENTS_PUBLIC_KEY = config('COINPAYMENTS_PUBLIC_KEY')
 COINPAYMENTS_PRIVATE_KEY = config('COINPAYMENTS_PRIVATE_KEY')
 COINPAYMENTS_IPN_URL = config('COINPAYMENTS_IPN_URL')
+COINPAYMENTS_API_URL = config('COINPAYMENTS_API_URL', default='https://www.coinpayments.net/api.php')
 
 # Stripe Configuration
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
@@ -282,4 +283,87 @@ MPGS_SESSION_TIMEOUT_MINUTES = config('MPGS_SESSION_TIMEOUT_MINUTES', default=15
 # Example: FX_USD_SAR_RATE='3.80'
 FX_USD_SAR_RATE = config('FX_USD_SAR_RATE', default='3.80')
 
+# eSIM catalogue snapshots
+# Plans are served from locally stored vendor catalogues. A snapshot older than the TTL
+# is refetched on the next request; the in-process refresher keeps them warm before that.
+ESIM_CATALOGUE_TTL_SECONDS = config('ESIM_CATALOGUE_TTL_SECONDS', default=900, cast=int)
+ESIM_CATALOGUE_REFRESH_INTERVAL_SECONDS = config('ESIM_CATALOGUE_REFRESH_INTERVAL_SECONDS', default=300, cast=int)
+ESIM_CATALOGUE_BACKGROUND_REFRESH = config('ESIM_CATALOGUE_BACKGROUND_REFRESH', default=True, cast=bool)
+# Overall deadline for one plans request; providers still fetching after it are reported as timed out.
+ESIM_PLANS_DEADLINE_SECONDS = config('ESIM_PLANS_DEADLINE_SECONDS', default=10, cast=float)
+ESIM_VENDOR_FANOUT_WORKERS = config('ESIM_VENDOR_FANOUT_WORKERS', default=8, cast=int)
+# Upper bound on package codes + bundle names accepted by /api/esim/plans/batch/.
+ESIM_PLANS_BATCH_MAX_ITEMS = config('ESIM_PLANS_BATCH_MAX_ITEMS', default=50, cast=int)
+# Rendered plans responses kept per worker, bounded by entry count and total size.
+ESIM_PLANS_RESPONSE_CACHE_MAX_ENTRIES = config('ESIM_PLANS_RESPONSE_CACHE_MAX_ENTRIES', default=256, cast=int)
+ESIM_PLANS_RESPONSE_CACHE_MAX_BYTES = config('ESIM_PLANS_RESPONSE_CACHE_MAX_BYTES', default=32 * 1024 * 1024, cast=int)
+# Expired snapshots are still served (and refreshed in the background) for this long.
+ESIM_CATALOGUE_STALE_SECONDS = config('ESIM_CATALOGUE_STALE_SECONDS', default=86400, cast=int)
+# While a snapshot in memory is expired, check the database for a newer one at most this often.
+ESIM_CATALOGUE_DB_RECHECK_SECONDS = config('ESIM_CATALOGUE_DB_RECHECK_SECONDS', default=5, cast=float)
+# Vendor circuit breakers: open after N consecutive failed or slow calls, probe again after the reset delay.
+ESIM_BREAKER_FAILURE_THRESHOLD = config('ESIM_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+ESIM_BREAKER_SLOW_CALL_SECONDS = config('ESIM_BREAKER_SLOW_CALL_SECONDS', default=8, cast=float)
+ESIM_BREAKER_RESET_SECONDS = config('ESIM_BREAKER_RESET_SECONDS', default=30, cast=float)
+# eSIMGo bundle details cached per worker (warmed from every catalogue snapshot).
+ESIMGO_BUNDLE_CACHE_TTL_SECONDS = config('ESIMGO_BUNDLE_CACHE_TTL_SECONDS', default=900, cast=int)
+ESIMGO_BUNDLE_CACHE_MAX_ENTRIES = config('ESIMGO_BUNDLE_CACHE_MAX_ENTRIES', default=5000, cast=int)
+# Dashboard usage refresh: eSIMAccess order queries run on this many threads, bounded by one deadline.
+ESIM_USAGE_REFRESH_WORKERS = config('ESIM_USAGE_REFRESH_WORKERS', default=8, cast=int)
+ESIM_USAGE_REFRESH_DEADLINE_SECONDS = config('ESIM_USAGE_REFRESH_DEADLINE_SECONDS', default=5, cast=float)
+# Usage snapshots younger than this are served to dashboards without asking eSIMAccess;
+# the `poll_usage` command refreshes older ones in batches of ESIM_USAGE_POLL_BATCH_SIZE.
+ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS = config('ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS', default=300, cast=int)
+ESIM_USAGE_POLL_BATCH_SIZE = config('ESIM_USAGE_POLL_BATCH_SIZE', default=100, cast=int)
+# How long one poll batch waits for eSIMAccess (dashboards use ESIM_USAGE_REFRESH_DEADLINE_SECONDS).
+ESIM_USAGE_POLL_DEADLINE_SECONDS = config('ESIM_USAGE_POLL_DEADLINE_SECONDS', default=60, cast=float)
+# Plans whose poll returns no usage wait ESIM_USAGE_SNAPSHOT_MAX_AGE_SECONDS, doubled per failure up to this.
+ESIM_USAGE_POLL_MAX_BACKOFF_SECONDS = config('ESIM_USAGE_POLL_MAX_BACKOFF_SECONDS', default=86400, cast=int)
+# Plan dashboard metrics switch to NumPy (when installed) from this batch size.
+ESIM_METRICS_NUMPY_MIN_BATCH = config('ESIM_METRICS_NUMPY_MIN_BATCH', default=256, cast=int)
+# eSIMAccess webhooks: signed requests older than this are rejected. Snapshots
+# updated by push are trusted (not polled) for ESIM_USAGE_PUSH_MAX_AGE_SECONDS.
+ESIMACCESS_WEBHOOK_TOLERANCE_SECONDS = config('ESIMACCESS_WEBHOOK_TOLERANCE_SECONDS', default=300, cast=int)
+ESIM_USAGE_PUSH_MAX_AGE_SECONDS = config('ESIM_USAGE_PUSH_MAX_AGE_SECONDS', default=21600, cast=int)
+# Usage SSE stream (/api/esim/user/plans/stream/): poll the local usage store this often,
+# send a heartbeat when idle, and end streams (clients reconnect) after the max duration.
+ESIM_USAGE_STREAM_INTERVAL_SECONDS = config('ESIM_USAGE_STREAM_INTERVAL_SECONDS', default=5, cast=float)
+ESIM_USAGE_STREAM_HEARTBEAT_SECONDS = config('ESIM_USAGE_STREAM_HEARTBEAT_SECONDS', default=15, cast=float)
+ESIM_USAGE_STREAM_MAX_SECONDS = config('ESIM_USAGE_STREAM_MAX_SECONDS', default=300, cast=float)
+# Without the stream (WSGI) dashboards poll /api/esim/user/plans/changes/ every ESIM_USAGE_POLL_AFTER_SECONDS.
+# ESIM_USAGE_LONG_POLL_SECONDS > 0 makes each poll wait that long for a change instead, holding a
+# sync worker per open dashboard meanwhile: only raise it with workers to spare.
+ESIM_USAGE_POLL_AFTER_SECONDS = config('ESIM_USAGE_POLL_AFTER_SECONDS', default=15, cast=float)
+ESIM_USAGE_LONG_POLL_SECONDS = config('ESIM_USAGE_LONG_POLL_SECONDS', default=0, cast=float)
+# Provisioning jobs (`run_provisioning_worker`): jobs run in parallel per worker, lease length,
+# attempts before a job fails, and the exponential retry backoff (base and cap).
+ESIM_PROVISIONING_CONCURRENCY = config('ESIM_PROVISIONING_CONCURRENCY', default=4, cast=int)
+ESIM_PROVISIONING_LEASE_SECONDS = config('ESIM_PROVISIONING_LEASE_SECONDS', default=300, cast=int)
+ESIM_PROVISIONING_MAX_ATTEMPTS = config('ESIM_PROVISIONING_MAX_ATTEMPTS', default=8, cast=int)
+ESIM_PROVISIONING_BACKOFF_SECONDS = config('ESIM_PROVISIONING_BACKOFF_SECONDS', default=30, cast=float)
+ESIM_PROVISIONING_BACKOFF_MAX_SECONDS = config('ESIM_PROVISIONING_BACKOFF_MAX_SECONDS', default=3600, cast=float)
+# Batched ordering: payments per eSIMAccess order (1 orders each payment alone) and how long a
+# new job waits for others to share its order.
+ESIM_PROVISIONING_BATCH_SIZE = config('ESIM_PROVISIONING_BATCH_SIZE', default=1, cast=int)
+ESIM_PROVISIONING_BATCH_WINDOW_SECONDS = config('ESIM_PROVISIONING_BATCH_WINDOW_SECONDS', default=10, cast=float)
+# Vendor HTTP clients (magic_esim.vendors): pooled connections per host, default connect/read
+# timeouts, and retries with jittered backoff (base delay) for idempotent calls.
+VENDOR_HTTP_POOL_SIZE = config('VENDOR_HTTP_POOL_SIZE', default=20, cast=int)
+VENDOR_HTTP_CONNECT_TIMEOUT = config('VENDOR_HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+VENDOR_HTTP_READ_TIMEOUT = config('VENDOR_HTTP_READ_TIMEOUT', default=30, cast=float)
+VENDOR_HTTP_RETRIES = config('VENDOR_HTTP_RETRIES', default=2, cast=int)
+VENDOR_HTTP_BACKOFF_SECONDS = config('VENDOR_HTTP_BACKOFF_SECONDS', default=0.2, cast=float)
+# Route the async versions of the vendor-bound views (plans, eSIMGo detail, profile, user plans,
+# payment status). magic_esim.asgi turns this on unless the environment sets it.
+ESIM_ASYNC_VIEWS = config('ESIM_ASYNC_VIEWS', default=False, cast=bool)
+# Keyset pagination of /api/esim/user/plans/.
+ESIM_USER_PLANS_PAGE_SIZE = config('ESIM_USER_PLANS_PAGE_SIZE', default=20, cast=int)
+ESIM_USER_PLANS_MAX_PAGE_SIZE = config('ESIM_USER_PLANS_MAX_PAGE_SIZE', default=100, cast=int)
+
+# Coalesce identical vendor calls across workers too: "thread" (per process only), "file" or "db".
+ESIM_SINGLEFLIGHT_BACKEND = config('ESIM_SINGLEFLIGHT_BACKEND', default='thread')
+ESIM_SINGLEFLIGHT_LOCK_DIR = config('ESIM_SINGLEFLIGHT_LOCK_DIR', default='')
+# Bundles requested per eSIMGo /catalogue page when paging through results.
+ESIMGO_CATALOGUE_PAGE_SIZE = config('ESIMGO_CATALOGUE_PAGE_SIZE', default=200, cast=int)
+
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = config('SOCIAL_AUTH_GOOGLE_OAUTH2_KEY')
@@ -0,0 +1,636 @@
+"""
+Local stand-ins for the vendor APIs, for tests and offline benchmarks.
+
+Each stub is a small threaded HTTP server on 127.0.0.1 speaking just enough
+of one vendor's API for the paths this project calls:
+
+- ``ESIMAccessStub``: ``package/list``, ``esim/order`` and ``esim/query``;
+- ``ESIMGoStub``: the paginated ``/catalogue`` and ``/catalogue/bundle/<name>``;
+- ``MPGSStub``: Hosted Checkout ``session`` and Retrieve Order;
+- ``CoinPaymentsStub``: ``api.php`` (``create_transaction``, ``get_tx_info``,
+  ``rates``).
+
+Payloads have the vendors' shapes and sizes: the catalogues are generated
+deterministically (every country in ``COUNTRIES``, with the fields and
+network lists the real ones carry) and MPGS orders are built from the
+recorded order in ``vendor_stub_fixtures/mpgs_order.json``.
+
+Every stub takes the same behaviour knobs: ``latency`` (plus up to
+``jitter`` more) seconds per request, an ``error_rate`` of requests
+answered with ``error_status``, and a ``rate_limit`` in requests per second
+above which requests get 429 with ``Retry-After``. Calls, errors and
+throttled requests are counted per endpoint.
+
+``VendorStubs`` runs all four and, while started, points this process at
+them (environment, settings and ``esim.utils``' import-time host); the
+``run_vendor_stubs`` command serves them for other processes.
+"""
+import copy
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "vendor_stub_fixtures")
+
+# ISO code, name, region: the coverage of the generated catalogues.
+COUNTRIES = [
+    ("NG", "Nigeria", "Africa"), ("GH", "Ghana", "Africa"), ("KE", "Kenya", "Africa"),
+    ("ZA", "South Africa", "Africa"), ("EG", "Egypt", "Africa"), ("MA", "Morocco", "Africa"),
+    ("TZ", "Tanzania", "Africa"), ("UG", "Uganda", "Africa"), ("RW", "Rwanda", "Africa"),
+    ("SN", "Senegal", "Africa"), ("CI", "Cote d'Ivoire", "Africa"), ("CM", "Cameroon", "Africa"),
+    ("TN", "Tunisia", "Africa"), ("DZ", "Algeria", "Africa"), ("ZM", "Zambia", "Africa"),
+    ("SA", "Saudi Arabia", "Middle East"), ("AE", "United Arab Emirates", "Middle East"),
+    ("QA", "Qatar", "Middle East"), ("KW", "Kuwait", "Middle East"), ("BH", "Bahrain", "Middle East"),
+    ("OM", "Oman", "Middle East"), ("JO", "Jordan", "Middle East"), ("IL", "Israel", "Middle East"),
+    ("TR", "Turkey", "Europe"), ("GB", "United Kingdom", "Europe"), ("FR", "France", "Europe"),
+    ("DE", "Germany", "Europe"), ("ES", "Spain", "Europe"), ("IT", "Italy", "Europe"),
+    ("PT", "Portugal", "Europe"), ("NL", "Netherlands", "Europe"), ("BE", "Belgium", "Europe"),
+    ("CH", "Switzerland", "Europe"), ("AT", "Austria", "Europe"), ("SE", "Sweden", "Europe"),
+    ("NO", "Norway", "Europe"), ("DK", "Denmark", "Europe"), ("FI", "Finland", "Europe"),
+    ("IE", "Ireland", "Europe"), ("PL", "Poland", "Europe"), ("CZ", "Czech Republic", "Europe"),
+    ("GR", "Greece", "Europe"), ("HU", "Hungary", "Europe"), ("RO", "Romania", "Europe"),
+    ("HR", "Croatia", "Europe"), ("IS", "Iceland", "Europe"), ("UA", "Ukraine", "Europe"),
+    ("US", "United States", "North America"), ("CA", "Canada", "North America"),
+    ("MX", "Mexico", "North America"), ("PR", "Puerto Rico", "North America"),
+    ("JM", "Jamaica", "North America"), ("CR", "Costa Rica", "North America"),
+    ("PA", "Panama", "North America"), ("DO", "Dominican Republic", "North America"),
+    ("BR", "Brazil", "South America"), ("AR", "Argentina", "South America"),
+    ("CL", "Chile", "South America"), ("CO", "Colombia", "South America"),
+    ("PE", "Peru", "South America"), ("EC", "Ecuador", "South America"),
+    ("UY", "Uruguay", "South America"), ("CN", "China", "Asia"), ("JP", "Japan", "Asia"),
+    ("KR", "South Korea", "Asia"), ("IN", "India", "Asia"), ("ID", "Indonesia", "Asia"),
+    ("TH", "Thailand", "Asia"), ("VN", "Vietnam", "Asia"), ("MY", "Malaysia", "Asia"),
+    ("SG", "Singapore", "Asia"), ("PH", "Philippines", "Asia"), ("HK", "Hong Kong", "Asia"),
+    ("TW", "Taiwan", "Asia"), ("PK", "Pakistan", "Asia"), ("BD", "Bangladesh", "Asia"),
+    ("LK", "Sri Lanka", "Asia"), ("NP", "Nepal", "Asia"), ("KH", "Cambodia", "Asia"),
+    ("AU", "Australia", "Oceania"), ("NZ", "New Zealand", "Oceania"), ("FJ", "Fiji", "Oceania"),
+]
+
+# eSIMAccess regional packages: slug prefix, name and the regions they cover.
+ESIMACCESS_REGIONS = [
+    ("EU-30", "Europe", ("Europe",)),
+    ("AF-15", "Africa", ("Africa",)),
+    ("ME-8", "Middle East", ("Middle East",)),
+    ("AS-20", "Asia", ("Asia",)),
+    ("NA-9", "North America", ("North America",)),
+    ("SA-7", "South America", ("South America",)),
+]
+OPERATORS = ("Airtel", "MTN", "Vodafone", "Orange", "T-Mobile", "Telefonica", "Zain", "Globe")
+
+
+def _operators(iso):
+    # Two or three networks per country, stable across runs.
+    start = sum(map(ord, iso)) % len(OPERATORS)
+    count = 2 + ord(iso[1]) % 2
+    return [
+        {"operatorName": f"{OPERATORS[(start + i) % len(OPERATORS)]} {iso}", "networkType": "4G/5G" if i == 0 else "4G"}
+        for i in range(count)
+    ]
+
+
+def _network_list(countries):
+    return [
+        {"locationName": name, "locationLogo": f"/img/flags/{iso.lower()}.png", "locationCode": iso,
+         "operatorList": _operators(iso)}
+        for iso, name, _ in countries
+    ]
+
+
+def _esimaccess_package(code, slug, name, gb, days, price, countries, location, duration_unit="DAY"):
+    volume = int(gb * 1024 ** 3)
+    return {
+        "packageCode": code, "slug": slug, "name": name, "price": price, "currencyCode": "USD",
+        "volume": volume, "smsStatus": 0, "dataType": 1, "unusedValidTime": 180,
+        "duration": days, "durationUnit": duration_unit, "location": location,
+        "description": name, "activeType": 2, "favorite": False, "retailPrice": price * 2,
+        "speed": "3G/4G/5G", "ipExport": "UK/NO", "supportTopUpType": 2, "fupPolicy": "",
+        "locationNetworkList": _network_list(countries),
+    }
+
+
+@lru_cache(maxsize=None)
+def esimaccess_packages():
+    """The generated eSIMAccess package list (prices in 1/10000 USD, volumes in bytes)."""
+    packages = []
+    codes = itertools.count(1)
+    variants = [(1, 7, "7"), (3, 15, "15"), (5, 30, "30"), (10, 30, "30"), (20, 30, "30"), (1, 1, "Daily"), (0.5, 7, "End")]
+    for iso, name, _ in COUNTRIES:
+        for gb, days, suffix in variants:
+            size = f"{gb:g}GB" if gb >= 1 else f"{int(gb * 1024)}MB"
+            label = f"{name} {size} {'/Day' if suffix == 'Daily' else f'{days}Days'}"
+            price = int((gb * 4 + days * 0.2) * 10000)
+            packages.append(_esimaccess_package(
+                f"P{next(codes):05d}", f"{iso}_{gb:g}_{suffix}", label, gb, days, price,
+                [(iso, name, None)], iso,
+            ))
+    for prefix, region_name, regions in ESIMACCESS_REGIONS:
+        countries = [country for country in COUNTRIES if country[2] in regions]
+        for gb, days in ((1, 7), (3, 15), (5, 30), (10, 30), (20, 30)):
+            packages.append(_esimaccess_package(
+                f"P{next(codes):05d}", f"{prefix}_{gb}_{days}", f"{region_name} {gb}GB {days}Days",
+                gb, days, int((gb * 6 + days * 0.3) * 10000), countries, ",".join(c[0] for c in countries),
+            ))
+    for gb, days in ((1, 7), (3, 15), (5, 30), (10, 30), (20, 30)):
+        packages.append(_esimaccess_package(
+            f"P{next(codes):05d}", f"GL-{len(COUNTRIES)}_{gb}_{days}", f"Global {gb}GB {days}Days",
+            gb, days, int((gb * 9 + days * 0.4) * 10000), COUNTRIES, ",".join(c[0] for c in COUNTRIES),
+        ))
+    return tuple(packages)
+
+
+@lru_cache(maxsize=None)
+def esimgo_bundles():
+    """The generated eSIMGo catalogue (dataAmount in MB, -1 for unlimited; prices in USD)."""
+    bundles = []
+    for iso, name, region in COUNTRIES:
+        country = [{"name": name, "region": region, "iso": iso}]
+        roaming = [{"name": name, "region": region, "iso": iso}]
+        for days in (1, 3, 5, 7, 10, 15):
+            bundles.append({
+                "name": f"esim_ULE_{days}D_{iso}_V2",
+                "description": f"eSIM, Unlimited Essential, {days} Day{'s' if days > 1 else ''}, {name}, V2",
+                "groups": ["Standard Unlimited Essential"], "countries": country, "dataAmount": -1,
+                "duration": days, "speed": ["4G", "5G"], "autostart": True, "unlimited": True,
+                "roamingEnabled": roaming, "price": round(1.5 + days * 1.9, 2), "billingType": "FixedCost",
+            })
+        for gb, days in ((1, 7), (2, 15), (3, 30), (5, 30), (10, 30)):
+            bundles.append({
+                "name": f"esim_{gb}GB_{days}D_{iso}_V2",
+                "description": f"eSIM, {gb}GB, {days} Days, {name}, V2",
+                "groups": ["Standard Fixed"], "countries": country, "dataAmount": gb * 1000,
+                "duration": days, "speed": ["4G"], "autostart": True, "unlimited": False,
+                "roamingEnabled": roaming, "price": round(gb * 1.6 + 0.4, 2), "billingType": "FixedCost",
+            })
+    return tuple(bundles)
+
+
+@lru_cache(maxsize=None)
+def mpgs_order_fixture():
+    with open(os.path.join(FIXTURES_DIR, "mpgs_order.json")) as f:
+        return json.load(f)
+
+
+class VendorStub(ThreadingHTTPServer):
+    """
+    Base class of the stubs: behaviour knobs, counters and routing.
+
+    Subclasses list ``routes`` as ``(method, path regex, endpoint, handler
+    name)``; a handler takes the path match, the query parameters and the
+    raw request (``.body``, ``.headers``) and returns ``(status, payload)``.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+    vendor = None
+    routes = ()
+    error_payload = {"error": "Service unavailable"}
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, rate_limit=None,
+                 seed=None, port=0):
+        super().__init__(("127.0.0.1", port), _StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.throttled = Counter()
+        self._tokens = rate_limit or 0
+        self._refilled = time.monotonic()
+        self._thread = None
+        self._routes = [(method, re.compile(pattern), endpoint, handler) for method, pattern, endpoint, handler in self.routes]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        # A short poll interval so stopping (once per test) is quick.
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.throttled.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors), "throttled": dict(self.throttled)}
+
+    def respond(self, method, request):
+        """``(status, payload, headers)`` for one request."""
+        parts = urlsplit(request.path)
+        for route_method, pattern, endpoint, handler in self._routes:
+            match = pattern.fullmatch(parts.path)
+            if route_method == method and match:
+                break
+        else:
+            return 404, {"error": f"No stub for {method} {parts.path}"}, {}
+
+        with self.lock:
+            self.calls[endpoint] += 1
+            if self.rate_limit and not self._take_token():
+                self.throttled[endpoint] += 1
+                return 429, {"error": "Too many requests"}, {"Retry-After": "1"}
+            failed = self.error_rate and self.random.random() < self.error_rate
+            if failed:
+                self.errors[endpoint] += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+        time.sleep(delay)
+        if failed:
+            return self.error_status, self.error_payload, {}
+        status, payload = getattr(self, handler)(match, parse_qs(parts.query), request)
+        return status, payload, {}
+
+    def _take_token(self):
+        # Token bucket refilled at rate_limit per second, holding at most one second's worth.
+        clock = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (clock - self._refilled) * self.rate_limit)
+        self._refilled = clock
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        status, payload, headers = self.server.respond(method, self)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+
+
+class ESIMAccessStub(VendorStub):
+    """
+    eSIMAccess open API. Orders are kept in memory; each ``esim/query`` of an
+    order adds ``usage_step`` bytes to its profiles' ``orderUsage``.
+    """
+
+    vendor = "esimaccess"
+    routes = (
+        ("POST", r"/api/v1/open/package/list", "package/list", "package_list"),
+        ("POST", r"/api/v1/open/esim/order", "esim/order", "order"),
+        ("POST", r"/api/v1/open/esim/query", "esim/query", "query"),
+    )
+    error_payload = {"success": False, "errorCode": "900001", "errorMsg": "System busy, please try again later"}
+
+    def __init__(self, usage_step=0, **behaviour):
+        super().__init__(**behaviour)
+        self.usage_step = usage_step
+        self.packages = {package["packageCode"]: package for package in esimaccess_packages()}
+        self.orders = {}
+        self.transactions = {}
+        self._order_numbers = itertools.count(1)
+        self._iccids = itertools.count(1)
+
+    @staticmethod
+    def ok(obj):
+        return 200, {"success": True, "errorCode": "0", "errorMsg": None, "obj": obj}
+
+    @staticmethod
+    def failed(code, message):
+        return 200, {"success": False, "errorCode": code, "errorMsg": message, "obj": None}
+
+    def package_list(self, match, query, request):
+        filters = _json_body(request)
+        packages = list(self.packages.values())
+        if filters.get("packageCode"):
+            packages = [p for p in packages if p["packageCode"] == filters["packageCode"]]
+        if filters.get("slug"):
+            packages = [p for p in packages if p["slug"] == filters["slug"]]
+        location = filters.get("locationCode")
+        if location == "!RG":
+            packages = [p for p in packages if "," in p["location"] and not p["slug"].startswith("GL-")]
+        elif location == "!GL":
+            packages = [p for p in packages if p["slug"].startswith("GL-")]
+        elif location:
+            packages = [p for p in packages if location in p["location"].split(",")]
+        return self.ok({"packageList": packages})
+
+    def order(self, match, query, request):
+        body = _json_body(request)
+        transaction_id = body.get("transactionId")
+        items = body.get("packageInfoList") or []
+        unknown = [item.get("packageCode") for item in items if item.get("packageCode") not in self.packages]
+        with self.lock:
+            if not transaction_id or not items:
+                return self.failed("000104", "transactionId and packageInfoList are required")
+            if transaction_id in self.transactions:
+                return self.failed("200005", f"Duplicate transactionId {transaction_id}")
+            if unknown:
+                return self.failed("200002", f"Unknown packageCode {', '.join(map(str, unknown))}")
+            order_no = f"B{time.strftime('%y%m%d')}{next(self._order_numbers):08d}"
+            self.transactions[transaction_id] = order_no
+            self.orders[order_no] = [
+                self._profile(order_no, transaction_id, self.packages[item["packageCode"]])
+                for item in items
+                for _ in range(int(item.get("count") or 1))
+            ]
+        return self.ok({"orderNo": order_no})
+
+    def _profile(self, order_no, transaction_id, package):
+        iccid = f"898522452800{next(self._iccids):08d}"
+        return {
+            "esimTranNo": f"T{iccid[-12:]}", "orderNo": order_no, "transactionId": transaction_id,
+            "imsi": f"45400{iccid[-10:]}", "iccid": iccid, "smsStatus": 0, "msisdn": "",
+            "ac": f"LPA:1$rsp.example.com${uuid.uuid4().hex.upper()}",
+            "qrCodeUrl": f"https://p.qrsim.net/{uuid.uuid4().hex}.png", "shortUrl": f"https://p.qrsim.net/{iccid[-8:]}",
+            "smdpAddress": "rsp.example.com", "activationCode": uuid.uuid4().hex.upper(),
+            "totalVolume": package["volume"], "totalDuration": package["duration"],
+            "durationUnit": package["durationUnit"], "orderUsage": 0,
+            "esimStatus": "GOT_RESOURCE", "smdpStatus": "RELEASED", "eid": "", "activeType": 2,
+            "dataType": 1, "activateTime": None, "expiredTime": None, "installationTime": None,
+            "packageList": [{
+                "packageName": package["name"], "packageCode": package["packageCode"], "slug": package["slug"],
+                "duration": package["duration"], "volume": package["volume"],
+                "locationCode": package["location"], "createTime": time.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+            }],
+        }
+
+    def query(self, match, query, request):
+        body = _json_body(request)
+        with self.lock:
+            if body.get("orderNo"):
+                esims = self.orders.get(body["orderNo"], [])
+            elif body.get("iccid"):
+                esims = [esim for esims in self.orders.values() for esim in esims if esim["iccid"] == body["iccid"]]
+            else:
+                return self.failed("000104", "orderNo or iccid is required")
+            for esim in esims:
+                esim["orderUsage"] = min(esim["totalVolume"], esim["orderUsage"] + self.usage_step)
+            esims = copy.deepcopy(esims)
+        pager = body.get("pager") or {"pageNum": 1, "pageSize": 20}
+        return self.ok({"esimList": esims, "pager": {**pager, "total": len(esims)}})
+
+
+class ESIMGoStub(VendorStub):
+    """eSIMGo catalogue API: paginated, filtered ``/catalogue`` and bundle detail."""
+
+    vendor = "esimgo"
+    routes = (
+        ("GET", r"/catalogue", "catalogue", "catalogue"),
+        ("GET", r"/catalogue/bundle/(?P<name>[^/]+)", "catalogue/bundle", "bundle"),
+    )
+    error_payload = {"message": "Service temporarily unavailable"}
+
+    def __init__(self, **behaviour):
+        super().__init__(**behaviour)
+        self.bundles = {bundle["name"]: bundle for bundle in esimgo_bundles()}
+
+    def catalogue(self, match, query, request):
+        param = lambda name: (query.get(name) or [""])[0]  # noqa: E731
+        bundles = list(self.bundles.values())
+        if param("group"):
+            bundles = [b for b in bundles if param("group") in b["groups"]]
+        if param("countries"):
+            isos = set(param("countries").upper().split(","))
+            bundles = [b for b in bundles if any(c["iso"] in isos for c in b["countries"])]
+        if param("region"):
+            region = param("region").lower()
+            bundles = [b for b in bundles if any(c["region"].lower() == region for c in b["countries"])]
+        if param("description"):
+            needle = param("description").lower()
+            bundles = [b for b in bundles if needle in b["description"].lower()]
+
+        per_page = max(1, int(param("perPage") or 50))
+        page = max(1, int(param("page") or 1))
+        page_count = max(1, -(-len(bundles) // per_page))
+        return 200, {
+            "bundles": bundles[(page - 1) * per_page:page * per_page],
+            "pageCount": page_count, "rows": len(bundles), "pageSize": per_page,
+        }
+
+    def bundle(self, match, query, request):
+        bundle = self.bundles.get(match["name"])
+        if bundle is None:
+            return 404, {"message": f"Bundle {match['name']} not found"}
+        return 200, bundle
+
+
+class MPGSStub(VendorStub):
+    """
+    MPGS Hosted Checkout ``session`` and Retrieve Order. Orders answer with
+    the recorded order, rewritten to the id, amount and currency of the
+    session that created them, with status ``order_status``.
+    """
+
+    vendor = "mpgs"
+    routes = (
+        ("POST", r"/api/rest/version/(?P<version>\d+)/merchant/(?P<merchant>[^/]+)/session", "session", "session"),
+        ("GET", r"/api/rest/version/(?P<version>\d+)/merchant/(?P<merchant>[^/]+)/order/(?P<order>[^/]+)", "order", "order"),
+    )
+    error_payload = {"result": "ERROR", "error": {"cause": "SERVER_BUSY", "explanation": "Server busy"}}
+
+    def __init__(self, order_status="CAPTURED", **behaviour):
+        super().__init__(**behaviour)
+        self.order_status = order_status
+        self.orders = {}
+
+    def session(self, match, query, request):
+        order = _json_body(request).get("order") or {}
+        if not order.get("id"):
+            return 400, {"result": "ERROR", "error": {"cause": "INVALID_REQUEST", "explanation": "Missing order.id"}}
+        with self.lock:
+            self.orders[order["id"]] = order
+        return 201, {
+            "merchant": match["merchant"], "result": "SUCCESS",
+            "session": {"id": f"SESSION0002{uuid.uuid4().int % 10 ** 15:015d}", "updateStatus": "SUCCESS",
+                        "version": uuid.uuid4().hex[:10]},
+            "successIndicator": uuid.uuid4().hex[:16],
+        }
+
+    def order(self, match, query, request):
+        with self.lock:
+            created = self.orders.get(match["order"], {})
+        order = copy.deepcopy(mpgs_order_fixture())
+        values = {
+            "id": match["order"],
+            "amount": float(created.get("amount") or order["amount"]),
+            "currency": created.get("currency") or order["currency"],
+            "status": self.order_status,
+        }
+        order.update(values, merchant=match["merchant"], result="SUCCESS")
+        for transaction in order.get("transaction", []):
+            transaction["order"].update(values)
+            transaction["transaction"]["reference"] = match["order"]
+        return 200, order
+
+
+class CoinPaymentsStub(VendorStub):
+    """CoinPayments ``api.php``: signed form posts, answered with ``{"error": "ok", "result": ...}``."""
+
+    vendor = "coinpayments"
+    routes = (("POST", r"/api.php", "api.php", "api"),)
+    error_payload = {"error": "Service temporarily unavailable"}
+
+    WAITING = "Waiting for buyer funds..."
+
+    def __init__(self, tx_status_text=WAITING, **behaviour):
+        super().__init__(**behaviour)
+        self.tx_status_text = tx_status_text
+        self.transactions = {}
+
+    def api(self, match, query, request):
+        if not request.headers.get("hmac"):
+            return 200, {"error": "No HMAC signature sent."}
+        params = {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+        command = getattr(self, f"cmd_{params.get('cmd')}", None)
+        if command is None:
+            return 200, {"error": "Invalid command name!"}
+        return 200, {"error": "ok", "result": command(params)}
+
+    def cmd_create_transaction(self, params):
+        txn_id = f"CPJ{uuid.uuid4().hex[:22].upper()}"
+        amount = f"{float(params.get('amount') or 0) / 65000:.8f}"
+        with self.lock:
+            self.transactions[txn_id] = {"amount": amount, "coin": params.get("currency2", "BTC"), "created": int(time.time())}
+        return {
+            "amount": amount, "txn_id": txn_id, "address": f"bc1q{uuid.uuid4().hex[:34]}",
+            "confirms_needed": "2", "timeout": 9000,
+            "checkout_url": f"https://www.coinpayments.net/index.php?cmd=checkout&id={txn_id}",
+            "status_url": f"https://www.coinpayments.net/index.php?cmd=status&id={txn_id}",
+            "qrcode_url": f"https://www.coinpayments.net/qrgen.php?id={txn_id}",
+        }
+
+    def cmd_get_tx_info(self, params):
+        with self.lock:
+            transaction = self.transactions.get(params.get("txid") or params.get("pmtid"), {})
+        status = {self.WAITING: 0, "Cancelled / Timed Out": -1}.get(self.tx_status_text, 100)
+        amount = transaction.get("amount", "0.00015000")
+        created = transaction.get("created", int(time.time()))
+        return {
+            "time_created": created, "time_expires": created + 9000, "status": status,
+            "status_text": self.tx_status_text, "type": "coins", "coin": transaction.get("coin", "BTC"),
+            "amount": int(float(amount) * 10 ** 8), "amountf": amount,
+            "received": int(float(amount) * 10 ** 8) if status == 100 else 0,
+            "receivedf": amount if status == 100 else "0.00000000",
+            "recv_confirms": 2 if status == 100 else 0, "payment_address": f"bc1q{uuid.uuid4().hex[:34]}",
+        }
+
+    def cmd_rates(self, params):
+        return {
+            coin: {"is_fiat": int(coin in ("USD", "SAR")), "rate_btc": rate, "last_update": str(int(time.time())),
+                   "tx_fee": "0.00000000", "status": "online", "name": coin, "confirms": "2", "capabilities": []}
+            for coin, rate in (("BTC", "1.000000000000000000000000"), ("ETH", "0.052000000000000000000000"),
+                               ("LTC", "0.001300000000000000000000"), ("USD", "0.000015384615384615384615"),
+                               ("SAR", "0.000004102564102564102564"))
+        }
+
+
+class VendorStubs:
+    """
+    All four stubs, sharing the behaviour knobs. ``start`` serves them and
+    points this process at them; ``stop`` restores the real vendors.
+    """
+
+    def __init__(self, port=0, **behaviour):
+        def at(offset):
+            return port + offset if port else 0
+        self.esimaccess = ESIMAccessStub(port=at(0), **behaviour)
+        self.esimgo = ESIMGoStub(port=at(1), **behaviour)
+        self.mpgs = MPGSStub(port=at(2), **behaviour)
+        self.coinpayments = CoinPaymentsStub(port=at(3), **behaviour)
+        self._saved = None
+
+    def __iter__(self):
+        return iter((self.esimaccess, self.esimgo, self.mpgs, self.coinpayments))
+
+    def environ(self):
+        """Environment variables that point a process at the stubs."""
+        return {
+            "ESIMACCESS_HOST": self.esimaccess.url,
+            "ESIMGO_HOST": self.esimgo.url,
+            "MPGS_API_BASE_URL": self.mpgs.url,
+            "COINPAYMENTS_API_URL": f"{self.coinpayments.url}/api.php",
+        }
+
+    def start(self):
+        import esim.utils
+
+        for stub in self:
+            stub.start()
+        environ = self.environ()
+        self._saved = (
+            {name: os.environ.get(name) for name in environ},
+            {name: getattr(settings, name, None) for name in ("MPGS_API_BASE_URL", "COINPAYMENTS_API_URL")},
+            esim.utils.esim_host,
+        )
+        os.environ.update(environ)
+        settings.MPGS_API_BASE_URL = environ["MPGS_API_BASE_URL"]
+        settings.COINPAYMENTS_API_URL = environ["COINPAYMENTS_API_URL"]
+        esim.utils.esim_host = environ["ESIMACCESS_HOST"]  # Read at import time
+        return self
+
+    def stop(self):
+        import esim.utils
+
+        if self._saved is not None:
+            saved_environ, saved_settings, esim.utils.esim_host = self._saved
+            for name, value in saved_environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            for name, value in saved_settings.items():
+                setattr(settings, name, value)
+            self._saved = None
+        for stub in self:
+            stub.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        return {stub.vendor: stub.stats() for stub in self}
@@ -0,0 +1,244 @@
+"""
+Pooled, instrumented HTTP clients for the vendor APIs.
+
+Vendor calls used to go through module-level ``requests.post/get`` (and
+``urllib`` for CoinPayments), opening a new TCP/TLS connection per call,
+some without a timeout. Each vendor now has one ``VendorClient``:
+
+- a ``requests.Session`` whose connection pool (``VENDOR_HTTP_POOL_SIZE``
+  connections per host) keeps connections alive between calls;
+- default ``(connect, read)`` timeouts, so no call can hang a worker; a
+  number passed as ``timeout`` replaces the read timeout;
+- retries with jittered exponential backoff for connection errors, timeouts
+  and 429/502/503/504 answers, but only for idempotent calls: GETs and the
+  POSTs callers mark ``idempotent=True`` (lookups such as ``esim/query``);
+- latency and status of every attempt recorded per ``(vendor, endpoint)``
+  in ``vendor_metrics`` and logged on the ``magic_esim.vendors`` logger.
+
+``AsyncVendorClient`` does the same on httpx for async views, so a vendor
+call awaits instead of holding a thread.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+class EndpointStats:
+    """Counts and latency of the calls made to one vendor endpoint."""
+
+    __slots__ = ("calls", "errors", "statuses", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0  # Connection errors and timeouts (no HTTP status)
+        self.statuses = {}
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "statuses": dict(self.statuses),
+            "avg_ms": round(self.total_seconds * 1000 / self.calls, 1) if self.calls else None,
+            "max_ms": round(self.max_seconds * 1000, 1),
+        }
+
+
+class VendorMetrics:
+    """Process-wide latency and status counters per ``(vendor, endpoint)``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, vendor, endpoint, status, seconds):
+        with self._lock:
+            stats = self._stats.get((vendor, endpoint))
+            if stats is None:
+                stats = self._stats[(vendor, endpoint)] = EndpointStats()
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            if status is None:
+                stats.errors += 1
+            else:
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        logger.debug("%s %s -> %s in %.0fms", vendor, endpoint, status or "error", seconds * 1000)
+
+    def snapshot(self):
+        """``{"vendor endpoint": stats}`` for every endpoint called so far."""
+        with self._lock:
+            return {f"{vendor} {endpoint}": stats.as_dict() for (vendor, endpoint), stats in sorted(self._stats.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+vendor_metrics = VendorMetrics()
+
+
+class VendorClient:
+    """HTTP client for one vendor: pooled session, default timeouts, retries and metrics."""
+
+    def __init__(self, vendor, pool_size=None, connect_timeout=None, read_timeout=None, retries=None, backoff=None):
+        self.vendor = vendor
+        self.pool_size = pool_size or getattr(settings, "VENDOR_HTTP_POOL_SIZE", 20)
+        self.connect_timeout = connect_timeout or getattr(settings, "VENDOR_HTTP_CONNECT_TIMEOUT", 5)
+        self.read_timeout = read_timeout or getattr(settings, "VENDOR_HTTP_READ_TIMEOUT", 30)
+        self.retries = retries if retries is not None else getattr(settings, "VENDOR_HTTP_RETRIES", 2)
+        self.backoff = backoff if backoff is not None else getattr(settings, "VENDOR_HTTP_BACKOFF_SECONDS", 0.2)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Created on first use, so importing a client opens nothing.
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def timeouts(self, timeout=None):
+        """``(connect, read)`` timeouts; a number replaces the read timeout (and caps the connect one)."""
+        if timeout is None:
+            return (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, (tuple, list)):
+            return tuple(timeout)
+        return (min(self.connect_timeout, timeout), timeout)
+
+    def backoff_seconds(self, attempt):
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def request(self, method, url, endpoint=None, idempotent=None, timeout=None, **kwargs):
+        """
+        Send one request, retrying idempotent ones, and return the ``requests.Response``.
+
+        ``endpoint`` labels the metrics (default: the URL path). Raises
+        ``requests.RequestException`` when the last attempt failed to connect
+        or timed out; HTTP error statuses are returned, not raised.
+        """
+        method = method.upper()
+        endpoint = endpoint or urlsplit(url).path or "/"
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+        timeout = self.timeouts(timeout)
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                vendor_metrics.record(self.vendor, endpoint, None, time.perf_counter() - started)
+                if last:
+                    raise
+                logger.warning("%s %s attempt %s failed: %s; retrying", self.vendor, endpoint, attempt + 1, e)
+            else:
+                vendor_metrics.record(self.vendor, endpoint, response.status_code, time.perf_counter() - started)
+                if last or response.status_code not in RETRY_STATUSES:
+                    return response
+                logger.warning(
+                    "%s %s attempt %s returned HTTP %s; retrying",
+                    self.vendor, endpoint, attempt + 1, response.status_code,
+                )
+            time.sleep(self.backoff_seconds(attempt))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class AsyncVendorClient(VendorClient):
+    """
+    ``VendorClient`` for coroutines, on ``httpx.AsyncClient``.
+
+    httpx connections belong to the event loop that opened them, so each
+    running loop gets its own pooled client. Errors are httpx's:
+    ``httpx.TransportError`` for connection failures and timeouts.
+    """
+
+    def __init__(self, vendor, **kwargs):
+        super().__init__(vendor, **kwargs)
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def session(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            client = self._clients[loop] = httpx.AsyncClient(limits=limits)
+        return client
+
+    def timeouts(self, timeout=None):
+        connect, read = super().timeouts(timeout)
+        return httpx.Timeout(read, connect=connect)
+
+    async def request(self, method, url, endpoint=None, idempotent=None, timeout=None, **kwargs):
+        """
+        Send one request, retrying idempotent ones, and return the ``httpx.Response``.
+
+        Raises ``httpx.TransportError`` when the last attempt failed to
+        connect or timed out; HTTP error statuses are returned, not raised.
+        """
+        method = method.upper()
+        endpoint = endpoint or urlsplit(url).path or "/"
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+        timeout = self.timeouts(timeout)
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            started = time.perf_counter()
+            try:
+                response = await self.session.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                vendor_metrics.record(self.vendor, endpoint, None, time.perf_counter() - started)
+                if last:
+                    raise
+                logger.warning("%s %s attempt %s failed: %s; retrying", self.vendor, endpoint, attempt + 1, e)
+            else:
+                vendor_metrics.record(self.vendor, endpoint, response.status_code, time.perf_counter() - started)
+                if last or response.status_code not in RETRY_STATUSES:
+                    return response
+                logger.warning(
+                    "%s %s attempt %s returned HTTP %s; retrying",
+                    self.vendor, endpoint, attempt + 1, response.status_code,
+                )
+            await asyncio.sleep(self.backoff_seconds(attempt))
+
+
+esimaccess_http = VendorClient("esimaccess")
+esimgo_http = VendorClient("esimgo")
+mpgs_http = VendorClient("mpgs")
+coinpayments_http = VendorClient("coinpayments")
+
+esimaccess_async = AsyncVendorClient("esimaccess")
+esimgo_async = AsyncVendorClient("esimgo")
+mpgs_async = AsyncVendorClient("mpgs")
@@ -1,47 +1,58 @@
-// Function to populate the eSIMs table
-function populateEsimsTable(esims) {
-    const $esimListCard = $("#esim_lists");
-    $esimListCard.empty(); // Clear any existing rows
+// Plans shown on the page, by id, so streamed usage changes can be merged in
+const esimsById = {};
 
-    esims = esims.data;
-    esims.forEach((esim, index) => {
-        const volume_left = esim.volume - esim.volume_used;
+// Card background, remaining volume and duration label for a plan
+function esimCardDisplay(esim) {
+    const volume_left = esim.volume - esim.volume_used;
 
-        // Calculate percentage of volume left
-        const volumePercentage = Math.floor((volume_left / esim.volume) * 100);
+    // Calculate percentage of volume left
+    const volumePercentage = Math.floor((volume_left / esim.volume) * 100);
 
-        // Determine gradient colors based on percentage
-        const gradientStart = "#BB1600";
-        const gradientEnd = "#ffaba0";
-        const colorStop = `${volumePercentage}%`;
+    // Determine gradient colors based on percentage
+    const gradientStart = "#BB1600";
+    const gradientEnd = "#ffaba0";
+    const colorStop = `${volumePercentage}%`;
 
-        const backgroundColor = `linear-gradient(to right, ${gradientStart} ${colorStop}, ${gradientEnd} ${colorStop})`;
+    const backgroundColor = `linear-gradient(to right, ${gradientStart} ${colorStop}, ${gradientEnd} ${colorStop})`;
 
-        // Format data volume (MB if less than 1GB)
-        const volumeLeft = volume_left < 1024 ** 3
-            ? `${(volume_left / 1024 ** 2).toFixed(0)} MB` // Convert to MB
-            : `${(volume_left / 1024 ** 3).toFixed(1)} GB`; // Convert to GB
+    // Format data volume (MB if less than 1GB)
+    const volumeLeft = volume_left < 1024 ** 3
+        ? `${(volume_left / 1024 ** 2).toFixed(0)} MB` // Convert to MB
+        : `${(volume_left / 1024 ** 3).toFixed(1)} GB`; // Convert to GB
 
-        // Call the function with the plan's data
-        if (esim.activated_on == null) {
-            durationDisplay = esim.duration > 1 ? `${esim.duration} Days` : `${esim.duration} Day`;
-        } else {
-            const { isExpired, durationLeft } = calculateRemainingDuration(esim.activated_on, esim.duration);
-            durationDisplay = isExpired ? "Plan Expired" : `${durationLeft}`;
-        }
+    // Call the function with the plan's data
+    let durationDisplay;
+    if (esim.activated_on == null) {
+        durationDisplay = esim.duration > 1 ? `${esim.duration} Days` : `${esim.duration} Day`;
+    } else {
+        const { isExpired, durationLeft } = calculateRemainingDuration(esim.activated_on, esim.duration);
+        durationDisplay = isExpired ? "Plan Expired" : `${durationLeft}`;
+    }
 
-        // Output the results
-        console.log(esim.activated_on);
+    return { backgroundColor, volumeLeft, durationDisplay };
+}
+
+// Function to populate the eSIMs table
+function populateEsimsTable(esims, append = false) {
+    const $esimListCard = $("#esim_lists");
+    if (!append) {
+        $esimListCard.empty(); // Clear any existing rows
+    }
+
+    esims = esims.data;
+    esims.forEach((esim, index) => {
+        esimsById[esim.id] = esim;
+        const { backgroundColor, volumeLeft, durationDisplay } = esimCardDisplay(esim);
         const location_code = esim.location_code != null ? esim.location_code.toLowerCase() : 'ch';
 
         const row = `
-        <div class="col-lg-4 col-md-6 col-12">
+        <div class="col-lg-4 col-md-6 col-12" data-plan_id="${esim.id}">
             <div class="card mb-4 shadow rounded-5 border border-primary border-1">
                 <div class="card-body p-4">
                     <div class="d-flex flex-column justify-content-between p-4 rounded-4 mb-4 text-white fw-bold plan_card"
                         style="overflow: hidden; height: 200px; background: ${backgroundColor}; cursor: pointer;"
                         data-bs-toggle="offcanvas" data-bs-target="#planDetailsOffcanvas" aria-controls="planDetailsOffcanvas"
-                        data-order_no="${esim.order_no}">
+                        data-order_no="${esim.order_no}" data-iccid="${esim.iccid || ''}">
                         <span class="d-flex align-items-center">
                             <img class="me-2 rounded" src="https://flagcdn.com/w320/${location_code}.png" height="30px" width="45px">
                             <span>
@@ -50,8 +61,8 @@ function populateEsimsTable(esims) {
                             </span>
                         </span>
                         <span>
-                            <span class="fs-4 fw-bolder mb-1 me-2">${volumeLeft}</span>
-                            <span>Left for ${durationDisplay}</span>
+                            <span class="fs-4 fw-bolder mb-1 me-2 volume_left">${volumeLeft}</span>
+                            <span class="duration_left">Left for ${durationDisplay}</span>
                         </span>
                     </div>
                     <a href="#" class="btn btn-primary w-100 rounded-5">Buy more data</a>
@@ -64,30 +75,102 @@ function populateEsimsTable(esims) {
     });
 }
 
-// Populate the table on page load
-$(document).ready(function () {
-    const mainCard = $("#esim_lists");
-    blockUI(mainCard); // Show block UI
+// Merge streamed usage changes ({plan id: changed fields}) into the cards already shown
+function applyUsageChanges(changes) {
+    Object.entries(changes).forEach(([planId, fields]) => {
+        const $card = $(`#esim_lists [data-plan_id="${planId}"]`);
+        if (fields === null) {
+            $card.remove(); // Plan no longer belongs to the user
+            delete esimsById[planId];
+            return;
+        }
 
+        const esim = esimsById[planId];
+        if (!esim) {
+            return; // Not loaded yet; its page will arrive with current values
+        }
+        ["volume_used", "activated_on"].forEach((field) => {
+            if (field in fields) {
+                esim[field] = fields[field];
+            }
+        });
+
+        const { backgroundColor, volumeLeft, durationDisplay } = esimCardDisplay(esim);
+        $card.find(".plan_card").css("background", backgroundColor);
+        $card.find(".volume_left").text(volumeLeft);
+        $card.find(".duration_left").text(`Left for ${durationDisplay}`);
+    });
+}
+
+// Subscribe to usage changes pushed by the server (falls back to the loaded values without EventSource)
+function subscribeToUsage() {
+    // The stream is only served under ASGI; otherwise poll for changes.
+    if (!window.ESIM_USAGE_STREAM || !window.EventSource) {
+        pollUsage(null);
+        return;
+    }
+    const usageStream = new EventSource("/api/esim/user/plans/stream/");
+    ["snapshot", "usage"].forEach((eventName) => {
+        usageStream.addEventListener(eventName, function (event) {
+            applyUsageChanges(JSON.parse(event.data));
+        });
+    });
+}
+
+function pollUsage(version) {
     $.ajax({
-        url: "/api/esim/user/plans/",
+        url: "/api/esim/user/plans/changes/",
         type: "GET",
+        data: version ? { version: version } : {},
         success: function (response) {
-            console.log(response);
-            populateEsimsTable(response);
-            unblockUI(mainCard); // Remove block UI once data is loaded
+            if (response.data.version !== version) {
+                applyUsageChanges(response.data.plans);
+            }
+            setTimeout(() => pollUsage(response.data.version), response.data.retryAfter * 1000);
         },
         error: function () {
-            unblockUI(mainCard); // Remove block UI on error
-            showToast("Failed to load data.", "bg-danger");
+            setTimeout(() => pollUsage(version), 30000); // Back off, then resume
         },
     });
+}
+
+// Populate the table on page load
+$(document).ready(function () {
+    const mainCard = $("#esim_lists");
+    blockUI(mainCard); // Show block UI
+
+    // Only the fields the cards use; pages are appended as they arrive.
+    const planFields = "id,name,order_no,iccid,volume,volume_used,activated_on,duration,location_code";
+
+    function loadPlans(cursor) {
+        $.ajax({
+            url: "/api/esim/user/plans/",
+            type: "GET",
+            data: cursor ? { fields: planFields, cursor: cursor } : { fields: planFields },
+            success: function (response) {
+                populateEsimsTable(response, Boolean(cursor));
+                unblockUI(mainCard); // Remove block UI once the first page is shown
+
+                const nextCursor = response.pagination && response.pagination.next_cursor;
+                if (nextCursor) {
+                    loadPlans(nextCursor);
+                }
+            },
+            error: function () {
+                unblockUI(mainCard); // Remove block UI on error
+                showToast("Failed to load data.", "bg-danger");
+            },
+        });
+    }
 
+    loadPlans(null);
+    subscribeToUsage();
 
     
 	// Handle click on "Show Plan Details" button
 	$(document).on('click', '.plan_card', function (e) {
 		const orderNo = $(this).data("order_no");
+		const iccid = $(this).data("iccid");
 
         const planProfile = $('#navs-top-profile');
         const planDataPlan = $('#navs-top-data_plan');
@@ -102,7 +185,8 @@ $(document).ready(function () {
 		$.ajax({
 			url: '/api/esim/profile/', // API endpoint
 			type: 'GET',
-			data: { orderNo: orderNo }, // Send location code as query parameter
+			// By ICCID when known: a batched order holds several of the user's eSIMs.
+			data: iccid ? { iccid: iccid } : { orderNo: orderNo },
 			success: function (response) {
 				if (response.status) {
 					const plan = response.data[0];